@@ -0,0 +1,232 @@
+"""
+Times and memory-profiles the CPython tools on synthetic inputs of increasing size and
+writes the results to a JSON file, so the scaling curves of different versions can be
+compared.
+
+Example:
+    python run_benchmarks.py --sizes 1000 10000 100000 --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from contextlib import contextmanager, redirect_stdout
+from dataclasses import replace
+from datetime import datetime, timezone
+from pathlib import Path
+
+import synthetic_data
+
+REPOSITORY_PATH = Path(__file__).parents[1]
+CSV_WORKFLOW_PATH = REPOSITORY_PATH / "src" / "csv_based_workflow"
+COMPARISON_PATH = REPOSITORY_PATH / "src" / "cad_to_mcnp_comparison"
+LEGACY_PATH = REPOSITORY_PATH / "src" / "legacy"
+REPORT_GENERATION_PATH = LEGACY_PATH / "report_generation[OBSOLETE]"
+
+sys.path.insert(0, str(CSV_WORKFLOW_PATH))
+import mcnp_materials_from_csv as mm  # noqa: E402
+
+DEFAULT_SIZES = [10**3, 10**4, 10**5, 10**6]
+DEFAULT_PAGES = [10, 100]
+
+
+def measure(
+    function: Callable[[], object], setup: Callable[[], object] | None = None
+) -> dict[str, float]:
+    """
+    Runs the function twice, the first time to measure the wall time and the second
+    one with tracemalloc to measure the peak memory, as tracing slows down the run.
+    The setup is run before each of them and is not measured.
+    """
+    if setup is not None:
+        setup()
+    start = time.perf_counter()
+    function()
+    wall_time = time.perf_counter() - start
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"wall_time": wall_time, "peak_memory": peak_memory}
+
+
+def benchmark_processor(folder_path: Path, n_cells: int) -> list[dict]:
+    mcnp_input_filepath = str(folder_path / "synthetic.mcnp")
+    csv_filepath = str(folder_path / "synthetic.csv")
+    n_deck_cells = synthetic_data.write_synthetic_deck(mcnp_input_filepath, n_cells)
+    n_components = synthetic_data.write_synthetic_csv(csv_filepath, n_cells)
+    deck_size = os.path.getsize(mcnp_input_filepath)
+    # The processor adds the new materials to the ids file, the tracked one is kept
+    material_ids_filepath = str(folder_path / "material_ids.csv")
+    shutil.copy(CSV_WORKFLOW_PATH / "material_ids.csv", material_ids_filepath)
+
+    input_data = mm.InputData(mcnp_input_filepath, csv_filepath, material_ids_filepath)
+
+    def remove_manifest() -> None:
+        Path(input_data.manifest_filepath).unlink(missing_ok=True)
+
+    def stage(method: str, before: Callable[[], object] | None = None, **kwargs):
+        """
+        Returns the function that calls the method of a Processor and the setup that
+        builds the Processor, so the csv load is not measured.
+        """
+        processors = []
+
+        def setup() -> None:
+            if before is not None:
+                before()
+            with _quiet():
+                processors.append(mm.Processor(replace(input_data, **kwargs)))
+
+        def function() -> None:
+            with _quiet():
+                getattr(processors.pop(), method)()
+
+        return function, setup
+
+    def load_csv() -> None:
+        with _quiet():
+            mm.Processor(input_data)
+
+    stages = {
+        "csv_load": (load_csv, None),
+        "card_rewrite": stage("write_mcnp_with_materials"),
+        "comment_stripping": stage("remove_geouned_comments"),
+        "streaming": stage("write_mcnp_with_materials_streaming"),
+        "memory_map": stage("write_mcnp_with_materials_mapped"),
+        "parallel": stage(
+            "write_mcnp_with_materials_parallel", processes=os.cpu_count() or 1
+        ),
+        "incremental_first_run": stage(
+            "write_mcnp_with_materials_incremental", before=remove_manifest
+        ),
+        "incremental_unchanged": stage("write_mcnp_with_materials_incremental"),
+    }
+
+    results = []
+    for name, (function, setup) in stages.items():
+        result = measure(function, setup)
+        result.update(
+            benchmark="mcnp_materials_from_csv",
+            stage=name,
+            n_cells=n_deck_cells,
+            n_components=n_components,
+            deck_size=deck_size,
+            cards_per_second=n_deck_cells / result["wall_time"],
+        )
+        results.append(result)
+        print(f"  {name}: {result['wall_time']:.3f} s")
+    return results
+
+
+def benchmark_combine_plots(folder_path: Path, n_plots: int) -> dict:
+    shutil.copy(COMPARISON_PATH / "TEMPLATE.docx", folder_path)
+    script_path = shutil.copy(COMPARISON_PATH / "combine_plots.py", folder_path)
+    synthetic_data.write_synthetic_plots(folder_path, n_plots)
+
+    def run() -> None:
+        with _quiet():
+            runpy.run_path(script_path)
+
+    result = measure(run)
+    result.update(benchmark="combine_plots", stage="report", n_pages=n_plots)
+    return result
+
+
+def benchmark_report_generation(folder_path: Path, n_cells: int) -> dict:
+    """
+    The report has a page for each component of a synthetic model with n_cells.
+    """
+    shutil.copy(REPORT_GENERATION_PATH / "TEMPLATE.docx", folder_path)
+    n_pages = synthetic_data.write_synthetic_report_inputs(folder_path, n_cells)
+    script_path = str(REPORT_GENERATION_PATH / "report_generation.py")
+
+    def run() -> None:
+        # The script reads and writes its files in the working directory
+        working_directory = os.getcwd()
+        os.chdir(folder_path)
+        try:
+            with _quiet():
+                runpy.run_path(script_path)
+        finally:
+            os.chdir(working_directory)
+
+    result = measure(run)
+    result.update(benchmark="report_generation", stage="report", n_pages=n_pages)
+    return result
+
+
+@contextmanager
+def _quiet():
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        yield
+
+
+def get_metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPOSITORY_PATH,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "python": sys.version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--pages", type=int, nargs="+", default=DEFAULT_PAGES)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument(
+        "--skip-reports",
+        action="store_true",
+        help="Do not benchmark combine_plots.py and report_generation.py",
+    )
+    args = parser.parse_args()
+
+    results = []
+    for n_cells in args.sizes:
+        print(f"mcnp_materials_from_csv with {n_cells} cells")
+        with tempfile.TemporaryDirectory() as folder_path:
+            results += benchmark_processor(Path(folder_path), n_cells)
+
+    if not args.skip_reports:
+        for n_pages in args.pages:
+            print(f"combine_plots and report_generation with {n_pages} pages")
+            with tempfile.TemporaryDirectory() as folder_path:
+                results.append(benchmark_combine_plots(Path(folder_path), n_pages))
+            with tempfile.TemporaryDirectory() as folder_path:
+                results.append(benchmark_report_generation(Path(folder_path), n_pages))
+
+    with open(args.output, "w") as outfile:
+        json.dump({"metadata": get_metadata(), "results": results}, outfile, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Generators of synthetic inputs for the benchmarks: GEOUNED-style MCNP input files with
+their workflow CSV file, and the plots and pictures used by the report tools.
+
+The cells of the MCNP input are boxes on a regular grid, so the geometry is valid and
+can also be used to benchmark the tools that evaluate it. The number of bodies per
+component follows the distribution of a real tokamak sector: most components have a
+single body but a few (bolts, coil windings) have thousands of them.
+"""
+
+import csv
+import math
+from pathlib import Path
+
+import numpy as np
+
+BOX_SIZE = 10.0  # cm
+LEVEL_1_NAMES = (
+    "Blanket",
+    "Divertor",
+    "Vacuum Vessel",
+    "Thermal Shield",
+    "Coils",
+    "Ports",
+    "Cryostat",
+    "Diagnostics",
+)
+LEVEL_2_NAMES = ("Supports", "Cooling", "Bolts", "Shielding", "-")
+MATERIALS = (
+    ("316L", 7.93),
+    ("316LN", 7.93),
+    ("Water", 1.0),
+    ("Insulator", 2.2),
+    ("304", 7.9),
+    ("Graphite", 1.7),
+    ("Void", None),
+)
+CSV_COLUMNS = [
+    "Level 0",
+    "Level 1",
+    "Level 2",
+    "Component ID",
+    "MATERIAL",
+    "MASS [g]",
+    "DENSITY [g/cm3]",
+    "CELL IDs",
+    "ORIGINAL VOLUME [cm3]",
+    "%dif (ORG-SIM)/ORG*100",
+    "SIMPLIFIED VOLUME",
+    "STOCHASTIC VOLUME",
+    "DCF=ORG/STOCH",
+    "COMMENT",
+]
+
+
+def get_bodies_per_component(n_cells: int, seed: int = 0) -> np.ndarray:
+    """
+    Returns the number of bodies of each component so that they add up to n_cells.
+    """
+    rng = np.random.default_rng(seed)
+    bodies = []
+    total = 0
+    while total < n_cells:
+        kind = rng.random()
+        if kind < 0.7:
+            n_bodies = 1
+        elif kind < 0.9:
+            n_bodies = int(rng.integers(2, 11))
+        elif kind < 0.99:
+            n_bodies = int(rng.integers(11, 101))
+        else:  # Bolts, coil windings...
+            n_bodies = int(rng.integers(101, 5001))
+        n_bodies = min(n_bodies, n_cells - total)
+        bodies.append(n_bodies)
+        total += n_bodies
+    return np.array(bodies, dtype=np.int64)
+
+
+def get_grid_shape(n_cells: int) -> tuple[int, int, int]:
+    side = max(1, math.ceil(n_cells ** (1 / 3)))
+    return side, side, max(1, math.ceil(n_cells / side**2))
+
+
+def write_synthetic_deck(mcnp_input_filepath: str | Path, n_cells: int) -> int:
+    """
+    Writes an MCNP input file with n_cells box cells that are described in the CSV,
+    followed by the void cells that fill the rest of the grid, an outer void cell and
+    a graveyard. Every cell has a GEOUNED $ comment line. Returns the total number of
+    cells.
+    """
+    nx, ny, nz = get_grid_shape(n_cells)
+    px = np.arange(1, nx + 2)
+    py = np.arange(px[-1] + 1, px[-1] + ny + 2)
+    pz = np.arange(py[-1] + 1, py[-1] + nz + 2)
+    sphere = pz[-1] + 1
+
+    with open(mcnp_input_filepath, "w") as outfile:
+        outfile.write("Synthetic GEOUNED model\n")
+        cell_id = 0
+        for k in range(nz):
+            for j in range(ny):
+                for i in range(nx):
+                    cell_id += 1
+                    outfile.write(
+                        f"{cell_id:<5d} 0 {px[i]} -{px[i + 1]} {py[j]} -{py[j + 1]}\n"
+                        f"           {pz[k]} -{pz[k + 1]}\n"
+                        f"           $ Solid {cell_id}\n"
+                        "           imp:n=1 imp:p=1\n"
+                    )
+        outer = f"({-px[0]}:{px[-1]}:{-py[0]}:{py[-1]}:{-pz[0]}:{pz[-1]})"
+        outfile.write(f"{cell_id + 1:<5d} 0 -{sphere} {outer}\n")
+        outfile.write("           imp:n=1 imp:p=1\n")
+        outfile.write(f"{cell_id + 2:<5d} 0 {sphere} imp:n=0 imp:p=0\n")
+        outfile.write("\n")
+
+        for surface_id, axis, positions in (
+            (px[0], "PX", np.arange(nx + 1)),
+            (py[0], "PY", np.arange(ny + 1)),
+            (pz[0], "PZ", np.arange(nz + 1)),
+        ):
+            for i, position in enumerate(positions * BOX_SIZE):
+                outfile.write(f"{surface_id + i:<6d}{axis} {position:.6e}\n")
+        center = BOX_SIZE * np.array([nx, ny, nz]) / 2
+        radius = np.linalg.norm(center) * 1.5
+        outfile.write(f"{sphere:<6d}S {center[0]} {center[1]} {center[2]} {radius}\n")
+        outfile.write("\n")
+
+        outfile.write("MODE n p\n")
+        outfile.write("NPS 1e6\n")
+        outfile.write("SDEF POS=0 0 0 ERG=14.1\n")
+    return cell_id + 2
+
+
+def write_synthetic_csv(csv_filepath: str | Path, n_cells: int, seed: int = 0) -> int:
+    """
+    Writes the workflow CSV file that matches write_synthetic_deck. Returns the
+    number of components.
+    """
+    rng = np.random.default_rng(seed)
+    bodies_per_component = get_bodies_per_component(n_cells, seed)
+    box_volume = BOX_SIZE**3
+
+    with open(csv_filepath, "w", newline="") as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        first_cell = 1
+        for i, n_bodies in enumerate(bodies_per_component):
+            material, density = MATERIALS[rng.integers(len(MATERIALS))]
+            simplified_volume = n_bodies * box_volume
+            original_volume = simplified_volume * rng.uniform(0.9, 1.1)
+            stochastic_volume = simplified_volume * rng.uniform(0.98, 1.02)
+            dcf = original_volume / stochastic_volume if density else None
+            writer.writerow(
+                {
+                    "Level 0": "Sector",
+                    "Level 1": LEVEL_1_NAMES[i % len(LEVEL_1_NAMES)],
+                    "Level 2": LEVEL_2_NAMES[rng.integers(len(LEVEL_2_NAMES))],
+                    "Component ID": f"Component{i + 1}",
+                    "MATERIAL": material,
+                    "MASS [g]": original_volume * density if density else "",
+                    "DENSITY [g/cm3]": density or "",
+                    "CELL IDs": str([first_cell, first_cell + int(n_bodies) - 1]),
+                    "ORIGINAL VOLUME [cm3]": original_volume,
+                    "%dif (ORG-SIM)/ORG*100": (original_volume - simplified_volume)
+                    / original_volume
+                    * 100,
+                    "SIMPLIFIED VOLUME": simplified_volume,
+                    "STOCHASTIC VOLUME": stochastic_volume,
+                    "DCF=ORG/STOCH": dcf or "",
+                    # ENOVIA code, needed by the legacy report generation
+                    "COMMENT": f"Synthetic part #{i:06X}",
+                }
+            )
+            first_cell += int(n_bodies)
+    return len(bodies_per_component)
+
+
+def write_synthetic_plots(folder_path: str | Path, n_plots: int) -> None:
+    """
+    Writes a plotm.pdf with n_plots pages similar to the ones produced by the MCNP
+    plotter and the JPG pictures that slice_plot.py would produce in SpaceClaim, as
+    expected by combine_plots.py.
+    """
+    import fitz
+
+    folder_path = Path(folder_path)
+    document = fitz.open()
+    for i in range(n_plots):
+        page = document.new_page(width=612, height=792)
+        page.draw_rect(fitz.Rect(81, 82, 533, 532), color=(0, 0, 0), fill=(0, 0.6, 1))
+        page.insert_text(
+            (40, 60),
+            f"basis 1 0 0 0 1 0 origin 0 0 {i} extent 1000 1000",
+            fontsize=8,
+        )
+        pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 400, 400), False)
+        pixmap.set_rect(pixmap.irect, (i * 37 % 256, 128, 200))
+        picture_name = f"{i}; origin [0, 0, {i}]; direction [0, 0, 1]; extent 1000.jpg"
+        pixmap.save(str(folder_path / picture_name), output="jpeg")
+    document.save(str(folder_path / "plotm.pdf"))
+
+
+def write_synthetic_report_inputs(folder_path: str | Path, n_cells: int) -> int:
+    """
+    Writes the CSV and the Original_Pictures and Simplified_Pictures expected by the
+    legacy report_generation.py script. Returns the number of pages of the report.
+    """
+    import fitz
+
+    folder_path = Path(folder_path)
+    csv_filepath = folder_path / "TOKAMAK_COMPLEX_with_MATERIALS.csv"
+    n_rows = write_synthetic_csv(csv_filepath, n_cells)
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 200, 200), False)
+    pixmap.set_rect(pixmap.irect, (200, 200, 200))
+    for folder in ("Original_Pictures", "Simplified_Pictures"):
+        (folder_path / folder).mkdir(exist_ok=True)
+        for i in range(n_rows):
+            # The script joins the paths with a backslash
+            pixmap.save(str(folder_path / f"{folder}\\{i + 2}.jpg"), output="jpeg")
+    return n_rows
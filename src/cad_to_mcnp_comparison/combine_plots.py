@@ -11,6 +11,7 @@ FOLDER_PATH = Path(__file__).parent
 
 TEMPLATE_FILE = FOLDER_PATH / "TEMPLATE.docx"
 PDF_FILE = FOLDER_PATH / "plotm.pdf"
+RENDER_MCNP_PLOTS = False  # Render the MCNP plots with render_slices.py, no plotm.pdf
 
 
 def get_cad_plot_paths():
@@ -71,8 +72,13 @@ def delete_mcnp_plots(plot_paths):
 
 def main():
     cad_plot_paths = get_cad_plot_paths()
-    mcnp_plot_paths = get_mcnp_plot_paths()
-    texts = get_texts()
+    if RENDER_MCNP_PLOTS:
+        from render_slices import render_plots
+
+        mcnp_plot_paths, texts = render_plots()
+    else:
+        mcnp_plot_paths = get_mcnp_plot_paths()
+        texts = get_texts()
 
     atlas = Composer(Document())
 
@@ -0,0 +1,255 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import fitz  # imports the pymupdf library (pip install pymupdf)
+import numpy as np
+import pandas as pd
+
+from slice_plot import read_commands
+
+FOLDER_PATH = Path(__file__).parent
+
+sys.path.insert(0, str(FOLDER_PATH.parent / "csv_based_workflow"))
+import mcnp_geometry as mg  # noqa: E402
+from mcnp_materials_from_csv import CellIdIndex, iter_cards  # noqa: E402
+
+MCNP_INPUT_FILE = FOLDER_PATH / "model.mcnp"
+INSTRUCTIONS_FILE = FOLDER_PATH / "plot_instructions.txt"
+CSV_FILE = FOLDER_PATH / "model.csv"  # Only needed to color by component
+FIRST_CELL_ID = 1
+COLOR_BY = "MATERIAL"  # "MATERIAL" or "COMPONENT"
+RESOLUTION = 450  # Pixels of the side of the plots, as the crop of plotm.pdf
+PROCESSES = os.cpu_count()
+
+VOID_COLOR = (255, 255, 255)
+NOT_FOUND_COLOR = (0, 0, 0)  # Points not in any cell (e.g. a gap in the geometry)
+UNKNOWN_COLOR = (160, 160, 160)  # Cells that cannot be evaluated or not in the csv
+BOUNDARY_COLOR = (0, 0, 0)
+DEFAULT_AXES = {  # Horizontal and vertical axes of the px, py and pz commands
+    0: ([0, 1, 0], [0, 0, 1]),
+    1: ([1, 0, 0], [0, 0, 1]),
+    2: ([1, 0, 0], [0, 1, 0]),
+}
+
+
+class SliceRenderer:
+    """
+    Renders the plots of the plot instructions from the MCNP input file, without
+    running the MCNP plotter. The cell of every pixel of a slice is found by
+    evaluating the cells with NumPy. Only the cells whose bounding box is cut by the
+    slice are evaluated, and only on the pixels inside the box.
+
+    The pixels are colored by the material or csv component of their cell and the
+    cell boundaries are drawn in black. The cells inside universes and the ones with
+    a transformation are not evaluated.
+    """
+
+    def __init__(self):
+        with open(MCNP_INPUT_FILE, errors="replace") as infile:
+            self.geometry = mg.Geometry.from_cards(iter_cards(infile))
+        self.cell_colors = get_cell_colors(self.geometry)
+
+        self.cell_ids = []
+        self.cell_bounds = []
+        for cell_id, node in self.geometry.cells.items():
+            if node is None:
+                continue
+            if self.geometry.cell_parameters[cell_id].get("u", "0") != "0":
+                continue
+            self.cell_ids.append(cell_id)
+            self.cell_bounds.append(self.geometry.get_bounds(cell_id))
+        self.cell_bounds = np.array(self.cell_bounds).reshape(-1, 2, 3)
+
+    def find_cells(self, command) -> np.ndarray:
+        """
+        Returns the cell of every pixel of the plot, 0 where no cell was found and -1
+        where the cell could not be evaluated.
+        """
+        horizontal, vertical = get_plot_axes(command)
+        origin = np.array(command.origin, dtype=np.float64)
+        extent = float(command.extent)
+        centers = (np.arange(RESOLUTION) + 0.5) / RESOLUTION * 2 * extent - extent
+        u, v = np.meshgrid(centers, centers[::-1])
+        points = origin + u.reshape(-1, 1) * horizontal + v.reshape(-1, 1) * vertical
+        cells = np.zeros(len(points), dtype=np.int64)
+
+        bounds = self.cell_bounds - origin
+        low, high = _project_boxes(bounds, np.cross(horizontal, vertical))
+        cut = (low <= 0) & (high >= 0)
+        u_low, u_high = _project_boxes(bounds, horizontal)
+        v_low, v_high = _project_boxes(bounds, vertical)
+        pixel_size = 2 * extent / RESOLUTION
+        for i in np.flatnonzero(cut):
+            cell_id = self.cell_ids[i]
+            columns = _get_pixel_range(u_low[i], u_high[i], extent, pixel_size)
+            # The rows go from the top to the bottom of the plot
+            rows = _get_pixel_range(-v_high[i], -v_low[i], extent, pixel_size)
+            if columns is None or rows is None:
+                continue
+            indices = (
+                np.arange(*rows).reshape(-1, 1) * RESOLUTION + np.arange(*columns)
+            ).ravel()
+            indices = indices[cells[indices] == 0]
+            if len(indices) == 0:
+                continue
+            try:
+                inside = self.geometry.contains(cell_id, points[indices])
+            except ValueError:
+                cells[indices] = -1
+                continue
+            cells[indices[inside]] = cell_id
+        return cells.reshape(RESOLUTION, RESOLUTION)
+
+    def render(self, command, plot_file_path: str) -> None:
+        cells = self.find_cells(command)
+        image = np.empty((RESOLUTION, RESOLUTION, 3), dtype=np.uint8)
+        image[:] = UNKNOWN_COLOR
+        image[cells == 0] = NOT_FOUND_COLOR
+        for cell_id in np.unique(cells[cells > 0]):
+            image[cells == cell_id] = self.cell_colors.get(cell_id, UNKNOWN_COLOR)
+
+        boundaries = np.zeros(cells.shape, dtype=bool)
+        boundaries[:, 1:] |= cells[:, 1:] != cells[:, :-1]
+        boundaries[1:, :] |= cells[1:, :] != cells[:-1, :]
+        image[boundaries] = BOUNDARY_COLOR
+
+        pixmap = fitz.Pixmap(fitz.csRGB, RESOLUTION, RESOLUTION, image.tobytes(), 0)
+        pixmap.save(plot_file_path)
+
+
+def get_plot_axes(command) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the unit horizontal and vertical vectors of the plot as the MCNP plotter
+    does: the vectors of the basis command or the default ones of px, py and pz.
+    """
+    if command.basis is not None:
+        horizontal, vertical = np.array(command.basis, dtype=np.float64)
+    else:
+        direction = np.abs(np.array(command.direction, dtype=np.float64))
+        horizontal, vertical = np.array(DEFAULT_AXES[int(np.argmax(direction))])
+    horizontal = horizontal / np.linalg.norm(horizontal)
+    vertical = vertical - (vertical @ horizontal) * horizontal
+    vertical = vertical / np.linalg.norm(vertical)
+    return horizontal, vertical
+
+
+def get_plot_text(command) -> str:
+    """
+    Returns the description of the plot with the same format as the one read from
+    plotm.pdf by combine_plots.
+    """
+    horizontal, vertical = get_plot_axes(command)
+    basis = " ".join(f"{value:.6g}" for value in (*horizontal, *vertical))
+    origin = " ".join(f"{value:.6g}" for value in command.origin)
+    return f"basis {basis}\norigin {origin}\nextent {command.extent:.6g}"
+
+
+def get_cell_colors(geometry: mg.Geometry) -> dict[int, tuple[int, int, int]]:
+    """
+    Returns the color of each cell according to COLOR_BY. The colors are always the
+    same for the same material or component in all the plots.
+    """
+    cell_ids = np.fromiter(geometry.cells, dtype=np.int64)
+    if COLOR_BY == "MATERIAL":
+        keys = [geometry.cell_materials[cell_id] for cell_id in cell_ids.tolist()]
+    elif COLOR_BY == "COMPONENT":
+        csv = pd.read_csv(CSV_FILE)
+        cell_id_index = CellIdIndex.from_csv(csv, FIRST_CELL_ID - 1)
+        materials = cell_id_index.materials.astype(str)
+        keys = []
+        for position in cell_id_index.find_all(cell_ids).tolist():
+            if position < 0:
+                keys.append(None)
+            elif materials[position] in ("nan", "Void"):
+                keys.append(0)
+            else:
+                keys.append(position + 1)
+    else:
+        raise ValueError(f"COLOR_BY should be MATERIAL or COMPONENT, not {COLOR_BY}!")
+
+    colors = {}
+    for cell_id, key in zip(cell_ids.tolist(), keys):
+        if key is None:
+            colors[cell_id] = UNKNOWN_COLOR
+        elif key == 0:
+            colors[cell_id] = VOID_COLOR
+        else:
+            colors[cell_id] = _get_color(key)
+    return colors
+
+
+def _get_color(key: int) -> tuple[int, int, int]:
+    # Golden ratio steps of the hue give distinct colors to consecutive keys
+    hue = (key * 0.618033988749895) % 1
+    rgb = np.clip(np.abs((hue * 6 + np.array([0, 4, 2])) % 6 - 3) - 1, 0, 1)
+    return tuple(int(value) for value in 60 + rgb * 180)
+
+
+def _project_boxes(
+    bounds: np.ndarray, vector: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the interval covered by the projection of each box on the vector, the
+    infinite limits along the axes perpendicular to the vector are ignored.
+    """
+    with np.errstate(invalid="ignore"):
+        products = np.where(vector == 0, 0.0, bounds * vector)
+    return products.min(axis=1).sum(axis=1), products.max(axis=1).sum(axis=1)
+
+
+def _get_pixel_range(
+    low: float, high: float, extent: float, pixel_size: float
+) -> tuple[int, int] | None:
+    first = np.clip(np.floor((low + extent) / pixel_size), 0, RESOLUTION)
+    last = np.clip(np.ceil((high + extent) / pixel_size), 0, RESOLUTION)
+    if first >= last:
+        return None
+    return int(first), int(last)
+
+
+_worker_renderer: SliceRenderer | None = None
+
+
+def _init_worker(renderer: SliceRenderer) -> None:
+    global _worker_renderer
+    _worker_renderer = renderer
+
+
+def _render(task) -> str:
+    command, plot_file_path = task
+    _worker_renderer.render(command, plot_file_path)
+    return plot_file_path
+
+
+def render_plots() -> tuple[dict[int, str], dict[int, str]]:
+    """
+    Renders the plots of the plot instructions in parallel. Returns the paths of the
+    plots and their descriptions by plot id, as combine_plots reads them from
+    plotm.pdf.
+    """
+    commands = read_commands(INSTRUCTIONS_FILE)
+    renderer = SliceRenderer()
+
+    tasks = [
+        (command, str(FOLDER_PATH / f"{i}_mcnp_plot.png"))
+        for i, command in enumerate(commands)
+    ]
+    with ProcessPoolExecutor(
+        min(PROCESSES, max(len(tasks), 1)),
+        initializer=_init_worker,
+        initargs=(renderer,),
+    ) as executor:
+        plot_paths = dict(enumerate(executor.map(_render, tasks)))
+    texts = {i: get_plot_text(command) for i, command in enumerate(commands)}
+    return plot_paths, texts
+
+
+def main():
+    plot_paths, _ = render_plots()
+    print(f"{len(plot_paths)} plots rendered in {FOLDER_PATH}")
+
+
+if __name__ == "__main__":
+    main()
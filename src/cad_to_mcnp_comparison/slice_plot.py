@@ -12,6 +12,7 @@ class Command:
         self.direction = direction
         self.extent = extent
         self.counter = 0
+        self.basis = None  # Horizontal and vertical vectors of a basis command
 
     def __repr__(self):
         return (
@@ -58,20 +59,24 @@ def read_commands(instructions_file_path):
             elif word == "px":
                 flag_reading_command = True
                 commands[-1].direction = [1, 0, 0]
+                commands[-1].basis = None
                 commands[-1].origin[0] = float(words[i + 1])
             elif word == "py":
                 flag_reading_command = True
                 commands[-1].direction = [0, 1, 0]
+                commands[-1].basis = None
                 commands[-1].origin[1] = float(words[i + 1])
             elif word == "pz":
                 flag_reading_command = True
                 commands[-1].direction = [0, 0, 1]
+                commands[-1].basis = None
                 commands[-1].origin[2] = float(words[i + 1])
             elif word in ["bas", "basis"]:
                 flag_reading_command = True
                 vec1 = [float(words[i + 1]), float(words[i + 2]), float(words[i + 3])]
                 vec2 = [float(words[i + 4]), float(words[i + 5]), float(words[i + 6])]
                 commands[-1].direction = cross_product(vec1, vec2)
+                commands[-1].basis = [vec1, vec2]
 
         if words and words[-1] == "&" and flag_reading_command:
             flag_reading_command = False
@@ -121,4 +126,10 @@ def main():
         plot_a_slice(command, path)
 
 
-main()
+# The plot instructions are also read from CPython by render_slices.py
+try:
+    GetRootPart
+except NameError:
+    pass
+else:
+    main()
@@ -0,0 +1,302 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import mcnp_geometry as mg
+from mcnp_materials_from_csv import CellIdIndex, iter_cards
+
+MCNP_INPUT_FILEPATH = "testing.mcnp"
+CSV_FILEPATH = "testing.csv"
+FIRST_CELL_ID = 1
+N_POINTS = 10_000_000  # Random points sampled in the bounding box of the geometry
+POINTS_PER_TASK = 1_000_000  # Points checked by each task of the process pool
+POINTS_PER_VOXEL = 16  # Sets the size of the grid used to find the points of a cell
+PROCESSES = os.cpu_count()
+SEED = 0
+
+
+@dataclass
+class InputData:
+    """
+    Holds the input data for the checker taking the default values from the module
+    """
+
+    mcnp_input_filepath: str = MCNP_INPUT_FILEPATH
+    csv_filepath: str = CSV_FILEPATH
+    first_cell_id: int = FIRST_CELL_ID
+    n_points: int = N_POINTS
+    processes: int = PROCESSES
+
+    @property
+    def overlaps_filepath(self) -> str:
+        return self.mcnp_input_filepath + "[overlaps].csv"
+
+    @property
+    def gaps_filepath(self) -> str:
+        return self.mcnp_input_filepath + "[gaps].csv"
+
+    @property
+    def components_filepath(self) -> str:
+        return self.mcnp_input_filepath + "[geometry_errors].csv"
+
+
+class GeometryChecker:
+    """
+    Looks for overlaps and gaps in the main geometry of an MCNP input file by
+    sampling random points in its bounding box and finding the cells that contain
+    each of them. A point in two or more cells is an overlap and a point in none is
+    a gap. The points are found by evaluating the cells with NumPy, only on the
+    points inside their bounding boxes.
+
+    The points inside the bounding box of a cell that cannot be evaluated (e.g. with
+    a transformation) are not checked. A gap is attributed to the cell with the
+    smallest bounding box that contains it.
+    """
+
+    def __init__(self, input_data: InputData):
+        self.input_data = input_data
+        self.csv = pd.read_csv(input_data.csv_filepath)
+        self.cell_id_index = CellIdIndex.from_csv(
+            self.csv, input_data.first_cell_id - 1
+        )
+        with open(input_data.mcnp_input_filepath, errors="replace") as infile:
+            self.geometry = mg.Geometry.from_cards(iter_cards(infile))
+        self.world_bounds = self.geometry.get_world_bounds()
+
+        cell_ids = [
+            cell_id
+            for cell_id in self.geometry.cells
+            if self.geometry.cell_parameters[cell_id].get("u", "0") == "0"
+        ]
+        bounds = np.array(
+            [
+                self.geometry.get_bounds(cell_id)
+                if self.geometry.cells[cell_id] is not None
+                else np.array([[-np.inf] * 3, [np.inf] * 3])
+                for cell_id in cell_ids
+            ]
+        ).reshape(-1, 2, 3)
+        bounds[:, 0] = np.maximum(bounds[:, 0], self.world_bounds[0])
+        bounds[:, 1] = np.minimum(bounds[:, 1], self.world_bounds[1])
+        # The largest boxes first so the smallest box of a gap is the last one seen
+        volumes = np.prod(bounds[:, 1] - bounds[:, 0], axis=1)
+        order = np.argsort(-volumes, kind="stable")
+        self.cell_ids = np.array(cell_ids, dtype=np.int64)[order]
+        self.cell_bounds = bounds[order]
+
+    def check(self) -> tuple[pd.DataFrame, pd.DataFrame, int]:
+        """
+        Returns a row per pair of overlapping cells at a point, a row per gap point
+        and the number of points that could not be checked.
+        """
+        n_tasks = -(-self.input_data.n_points // POINTS_PER_TASK)
+        seeds = np.random.SeedSequence(SEED).spawn(n_tasks)
+        tasks = [
+            (seed, min(POINTS_PER_TASK, self.input_data.n_points - i * POINTS_PER_TASK))
+            for i, seed in enumerate(seeds)
+        ]
+        overlaps, gaps = [], []
+        n_unchecked = 0
+        with ProcessPoolExecutor(
+            self.input_data.processes,
+            initializer=_init_worker,
+            initargs=(
+                self.geometry,
+                self.cell_ids,
+                self.cell_bounds,
+                self.world_bounds,
+            ),
+        ) as executor:
+            for task_overlaps, task_gaps, task_unchecked in executor.map(
+                _check_points, tasks
+            ):
+                overlaps.append(task_overlaps)
+                gaps.append(task_gaps)
+                n_unchecked += task_unchecked
+
+        overlaps = pd.DataFrame(
+            np.concatenate(overlaps), columns=["X", "Y", "Z", "CELL A", "CELL B"]
+        )
+        overlaps[["CELL A", "CELL B"]] = overlaps[["CELL A", "CELL B"]].astype(np.int64)
+        overlaps["COMPONENT A"] = self._get_components(overlaps["CELL A"])
+        overlaps["COMPONENT B"] = self._get_components(overlaps["CELL B"])
+        gaps = pd.DataFrame(np.concatenate(gaps), columns=["X", "Y", "Z", "CELL"])
+        gaps["CELL"] = gaps["CELL"].astype(np.int64)
+        gaps["COMPONENT"] = self._get_components(gaps["CELL"])
+        return overlaps, gaps, n_unchecked
+
+    def _get_components(self, cell_ids: pd.Series) -> np.ndarray:
+        positions = self.cell_id_index.find_all(cell_ids.to_numpy())
+        components = np.full(len(positions), "-", dtype=object)
+        found = positions >= 0
+        components[found] = self.cell_id_index.component_ids[positions[found]]
+        return components
+
+    def get_component_table(
+        self, overlaps: pd.DataFrame, gaps: pd.DataFrame
+    ) -> pd.DataFrame:
+        """
+        Returns the number of overlap and gap points of each csv component with
+        errors and its hierarchy, the components with more errors first.
+        """
+        overlap_counts = pd.concat(
+            [overlaps["COMPONENT A"], overlaps["COMPONENT B"]]
+        ).value_counts()
+        components = pd.DataFrame(
+            {"OVERLAPS": overlap_counts, "GAPS": gaps["COMPONENT"].value_counts()}
+        )
+        components = components.fillna(0).astype(int)
+        components.index.name = "Component ID"
+        components = components.reset_index()
+
+        level_keys = [key for key in self.csv.keys() if "Level" in key]
+        hierarchy = self.csv[level_keys + ["Component ID"]]
+        components = components.merge(hierarchy, on="Component ID", how="left")
+        components = components[level_keys + ["Component ID", "OVERLAPS", "GAPS"]]
+        errors = components["OVERLAPS"] + components["GAPS"]
+        return components.iloc[np.argsort(-errors.to_numpy(), kind="stable")]
+
+
+_worker_geometry: mg.Geometry | None = None
+_worker_cell_ids: np.ndarray | None = None
+_worker_cell_bounds: np.ndarray | None = None
+_worker_world_bounds: np.ndarray | None = None
+
+
+def _init_worker(
+    geometry: mg.Geometry,
+    cell_ids: np.ndarray,
+    cell_bounds: np.ndarray,
+    world_bounds: np.ndarray,
+) -> None:
+    global _worker_geometry, _worker_cell_ids, _worker_cell_bounds
+    global _worker_world_bounds
+    _worker_geometry = geometry
+    _worker_cell_ids = cell_ids
+    _worker_cell_bounds = cell_bounds
+    _worker_world_bounds = world_bounds
+
+
+def _check_points(
+    task: tuple[np.random.SeedSequence, int],
+) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Samples the points of a task and returns the overlaps as rows of X, Y, Z and
+    the two cells, the gaps as rows of X, Y, Z and the nearest cell and the number
+    of points that could not be checked.
+    """
+    seed, n_points = task
+    rng = np.random.default_rng(seed)
+    low, high = _worker_world_bounds
+    points = rng.uniform(low, high, size=(n_points, 3))
+    grid = _VoxelGrid(points, low, high)
+
+    owners = np.zeros(n_points, dtype=np.int64)
+    nearest = np.zeros(n_points, dtype=np.int64)
+    unchecked = np.zeros(n_points, dtype=bool)
+    overlaps = []
+    for cell_id, bounds in zip(_worker_cell_ids.tolist(), _worker_cell_bounds):
+        indices = grid.get_points_in_box(bounds)
+        if len(indices) == 0:
+            continue
+        nearest[indices] = cell_id
+        try:
+            inside = _worker_geometry.contains(cell_id, points[indices])
+        except ValueError:
+            unchecked[indices] = True
+            continue
+        indices = indices[inside]
+        overlapping = indices[owners[indices] > 0]
+        if len(overlapping) > 0:
+            overlaps.append(
+                np.column_stack(
+                    [
+                        overlapping,
+                        owners[overlapping],
+                        np.full(len(overlapping), cell_id),
+                    ]
+                )
+            )
+        owners[indices] = np.where(owners[indices] > 0, owners[indices], cell_id)
+
+    # The points of a cell evaluated later may be unchecked, they are removed now
+    overlaps = np.concatenate(overlaps) if overlaps else np.empty((0, 3), np.int64)
+    overlaps = overlaps[~unchecked[overlaps[:, 0]]]
+    overlap_rows = np.column_stack([points[overlaps[:, 0]], overlaps[:, 1:]])
+    gaps = (owners == 0) & ~unchecked
+    gap_rows = np.column_stack([points[gaps], nearest[gaps]])
+    return overlap_rows, gap_rows, int(unchecked.sum())
+
+
+class _VoxelGrid:
+    """
+    Sorts the points by the voxel of a regular grid that contains them, so the
+    points inside a box are found by looking only at the voxels the box touches.
+    """
+
+    def __init__(self, points: np.ndarray, low: np.ndarray, high: np.ndarray):
+        side = round((len(points) / POINTS_PER_VOXEL) ** (1 / 3))
+        self.shape = np.full(3, min(max(side, 1), 256))
+        self.low = low
+        self.voxel_size = (high - low) / self.shape
+        voxels = np.floor((points - low) / self.voxel_size).astype(np.int64)
+        voxels = np.clip(voxels, 0, self.shape - 1)
+        voxel_ids = np.ravel_multi_index(voxels.T, self.shape)
+        self.order = np.argsort(voxel_ids, kind="stable")
+        self.points = points[self.order]
+        self.starts = np.searchsorted(
+            voxel_ids[self.order], np.arange(np.prod(self.shape) + 1)
+        )
+
+    def get_points_in_box(self, bounds: np.ndarray) -> np.ndarray:
+        """
+        Returns the indices of the points inside the box.
+        """
+        if np.any(bounds[0] > bounds[1]):
+            return np.empty(0, dtype=np.int64)
+        first = np.floor((bounds[0] - self.low) / self.voxel_size)
+        last = np.floor((bounds[1] - self.low) / self.voxel_size)
+        first = np.clip(first, 0, self.shape - 1).astype(np.int64)
+        last = np.clip(last, 0, self.shape - 1).astype(np.int64)
+
+        # The voxels of a row along the last axis are contiguous
+        i, j = np.meshgrid(
+            np.arange(first[0], last[0] + 1),
+            np.arange(first[1], last[1] + 1),
+            indexing="ij",
+        )
+        row_starts = self.starts[np.ravel_multi_index((i, j, first[2]), self.shape)]
+        row_ends = self.starts[np.ravel_multi_index((i, j, last[2]), self.shape) + 1]
+        lengths = (row_ends - row_starts).ravel()
+        offsets = np.repeat(row_starts.ravel() - np.cumsum(lengths) + lengths, lengths)
+        sorted_indices = offsets + np.arange(lengths.sum())
+
+        candidates = self.points[sorted_indices]
+        inside = np.all((candidates >= bounds[0]) & (candidates <= bounds[1]), axis=1)
+        return self.order[sorted_indices[inside]]
+
+
+def main():
+    checker = GeometryChecker(InputData())
+    overlaps, gaps, n_unchecked = checker.check()
+    overlaps.to_csv(checker.input_data.overlaps_filepath, index=False)
+    gaps.to_csv(checker.input_data.gaps_filepath, index=False)
+    components = checker.get_component_table(overlaps, gaps)
+    components.to_csv(checker.input_data.components_filepath, index=False)
+
+    print(
+        f"{len(overlaps)} overlaps and {len(gaps)} gaps found in "
+        f"{checker.input_data.n_points} points."
+    )
+    if n_unchecked:
+        print(f"{n_unchecked} points could not be checked.")
+    if not components.empty:
+        print(components.to_string(index=False))
+    print(f"Summary written to {checker.input_data.components_filepath}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import fnmatch
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from mcnp_materials_from_csv import (
+    CELL_ID_BYTES_PATTERN,
+    CellIdIndex,
+    Processor,
+    get_cell_body,
+    iter_mapped_cards,
+)
+from mcnp_materials_from_csv import InputData as ProcessorInputData
+
+MCNP_INPUT_FILEPATH = "testing.mcnp"
+CSV_FILEPATH = "testing.csv"
+MATERIAL_IDS_FILEPATH = "material_ids.csv"
+MATERIAL_LIBRARY_FILEPATH = None  # File with the M and MT cards of the materials
+VARIANTS_FILEPATH = "variants.csv"  # Overrides of the csv components of each variant
+FIRST_CELL_ID = 1
+PROCESSES = os.cpu_count()
+
+PIECES_PER_WRITE = 256  # Texts and headers joined before each write to the file
+
+
+@dataclass
+class InputData:
+    """
+    Holds the input data for the variant generator taking the default values from
+    the module
+    """
+
+    mcnp_input_filepath: str = MCNP_INPUT_FILEPATH
+    csv_filepath: str = CSV_FILEPATH
+    material_ids_filepath: str = MATERIAL_IDS_FILEPATH
+    material_library_filepath: str | None = MATERIAL_LIBRARY_FILEPATH
+    variants_filepath: str = VARIANTS_FILEPATH
+    first_cell_id: int = FIRST_CELL_ID
+    processes: int = PROCESSES
+
+    def get_variant_filepath(self, variant: str) -> str:
+        return self.mcnp_input_filepath + f"[materials_added][{variant}]"
+
+
+@dataclass
+class DeckTemplate:
+    """
+    The new MCNP file split at the headers of the cells present in the csv (material
+    id, density and comment), already stripped of the GEOUNED comments and encoded.
+    A variant is written as texts[0] + header of components[0] + texts[1] + ... +
+    texts[-1], so only the headers depend on the csv.
+    """
+
+    texts: list[bytes]
+    components: np.ndarray  # Position in the csv index of the cell of each header
+    cell_ids: np.ndarray
+
+    @classmethod
+    def compile(
+        cls, mcnp_input_filepath: str, cell_id_index: CellIdIndex
+    ) -> "DeckTemplate":
+        """
+        Scans the memory-mapped MCNP file once, as the mapped mode of the processor.
+        The cards that are not modified are kept byte for byte.
+        """
+        texts, components, cell_ids = [], [], []
+        pieces = []  # Text since the last header
+        with (
+            open(mcnp_input_filepath, "rb") as infile,
+            mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as deck,
+        ):
+            for block, spans in iter_mapped_cards(deck):
+                card_definition = b"".join(deck[start:end] for start, end in spans)
+                match = None
+                if block == "cell":
+                    match = CELL_ID_BYTES_PATTERN.match(card_definition)
+                component = None
+                if match is not None:
+                    cell_id = int(match.group(1))
+                    component = cell_id_index.find(cell_id)
+                if component is None:
+                    pieces.append(card_definition)
+                    continue
+
+                pieces.append(f"{cell_id} ".encode())
+                texts.append(b"".join(pieces))
+                body = get_cell_body(card_definition.decode(errors="replace"))
+                pieces = [body.encode()]
+                components.append(component)
+                cell_ids.append(cell_id)
+        texts.append(b"".join(pieces))
+        return cls(
+            texts,
+            np.array(components, dtype=np.int64),
+            np.array(cell_ids, dtype=np.int64),
+        )
+
+    def get_first_cells(self) -> dict[int, int]:
+        """
+        Returns the first cell of each component that has a header in the template.
+        """
+        components, first = np.unique(self.components, return_index=True)
+        return dict(zip(components.tolist(), self.cell_ids[first].tolist()))
+
+    def render(self, headers: dict[int, bytes], output_filepath: str) -> None:
+        # The texts are shared by all the variants, only the list of pieces is new
+        pieces = [b""] * (2 * len(self.texts) - 1)
+        pieces[::2] = self.texts
+        pieces[1::2] = map(headers.__getitem__, self.components.tolist())
+        with open(output_filepath, "wb") as outfile:
+            for start in range(0, len(pieces), PIECES_PER_WRITE):
+                outfile.write(b"".join(pieces[start : start + PIECES_PER_WRITE]))
+
+
+class DeckVariantGenerator:
+    """
+    Writes a new MCNP file for every variant of a parametric study (e.g. another
+    coolant or scaled densities of some components). The MCNP file and the csv are
+    read once and the MCNP file is compiled into a template where only the headers
+    of the cells change from one variant to another. Each variant then costs the
+    headers of its components and writing its file.
+
+    The variants file has a row per override with the columns VARIANT, Component ID
+    (a pattern such as Coolant* selects several components), MATERIAL,
+    DENSITY [g/cm3] and DENSITY FACTOR. Empty values are not overridden and the
+    factor multiplies the density after the new one is set.
+    """
+
+    def __init__(self, input_data: InputData):
+        self.input_data = input_data
+        self.processor = Processor(
+            ProcessorInputData(
+                mcnp_input_filepath=input_data.mcnp_input_filepath,
+                csv_filepath=input_data.csv_filepath,
+                material_ids_filpath=input_data.material_ids_filepath,
+                material_library_filepath=input_data.material_library_filepath,
+                first_cell_id=input_data.first_cell_id,
+            )
+        )
+        self.variants = pd.read_csv(input_data.variants_filepath, dtype=str).fillna("")
+        self.template = DeckTemplate.compile(
+            input_data.mcnp_input_filepath, self.processor.cell_id_index
+        )
+
+    def get_variant_names(self) -> list[str]:
+        return list(dict.fromkeys(self.variants["VARIANT"].str.strip()))
+
+    def get_cell_id_index(self, variant: str) -> CellIdIndex:
+        """
+        Returns the csv index with the overrides of the variant applied. Only the
+        columns that change are copied.
+        """
+        cell_id_index = self.processor.cell_id_index
+        component_ids = cell_id_index.component_ids.astype(str).tolist()
+        materials = cell_id_index.materials.copy()
+        densities = cell_id_index.densities.copy()
+        density_texts = cell_id_index.density_texts.copy()
+        invalid_densities = np.equal(density_texts, None)
+        modified_densities = np.zeros(len(cell_id_index), dtype=bool)
+
+        overrides = self.variants[self.variants["VARIANT"].str.strip() == variant]
+        for override in overrides.to_dict("records"):
+            pattern = override["Component ID"].strip()
+            selected = np.isin(component_ids, fnmatch.filter(component_ids, pattern))
+            if not selected.any():
+                print(f"No component matches {pattern} in the variant {variant}.")
+                continue
+            if material := override.get("MATERIAL", "").strip():
+                materials[selected] = material
+            if density := override.get("DENSITY [g/cm3]", "").strip():
+                densities[selected] = _to_float(density, variant)
+                invalid_densities[selected] = False
+                modified_densities |= selected
+            if factor := override.get("DENSITY FACTOR", "").strip():
+                densities[selected] *= _to_float(factor, variant)
+                modified_densities |= selected
+
+        # Same format as CellIdIndex.from_csv
+        dcfs = cell_id_index.dcfs[modified_densities]
+        density_texts[modified_densities] = np.char.mod(
+            "-%.4e", densities[modified_densities] * dcfs
+        ).astype(object)
+        density_texts[invalid_densities] = None
+        return CellIdIndex(
+            starts=cell_id_index.starts,
+            ends=cell_id_index.ends,
+            component_ids=cell_id_index.component_ids,
+            materials=materials,
+            densities=densities,
+            dcfs=cell_id_index.dcfs,
+            density_texts=density_texts,
+            comments=cell_id_index.comments,
+        )
+
+    def get_variant_processor(self, variant: str) -> tuple[Processor, dict[int, bytes]]:
+        """
+        Returns the processor of the variant and the header of each component in
+        the template. The new material ids are assigned here, in the order of the
+        variants, so they do not depend on which variant is written first.
+        """
+        processor = self.processor.for_cell_id_index(self.get_cell_id_index(variant))
+        headers = {
+            component: processor.get_cell_header(cell_id).encode()
+            for component, cell_id in self.template.get_first_cells().items()
+        }
+        return processor, headers
+
+    def write_variants(self) -> list[tuple[str, dict[str, int]]]:
+        """
+        Writes the MCNP file of every variant, split among a pool of processes.
+        Returns the path and the employed materials of each of them.
+        """
+        tasks = []
+        for variant in self.get_variant_names():
+            processor, headers = self.get_variant_processor(variant)
+            output_filepath = self.input_data.get_variant_filepath(variant)
+            tasks.append((processor, headers, output_filepath))
+
+        processes = min(self.input_data.processes, len(tasks))
+        if processes <= 1:
+            _init_worker(self.template)
+            outputs = [_write_variant(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(
+                processes, initializer=_init_worker, initargs=(self.template,)
+            ) as executor:
+                outputs = list(executor.map(_write_variant, tasks))
+        return [
+            (output_filepath, processor.employed_materials)
+            for output_filepath, (processor, _, _) in zip(outputs, tasks)
+        ]
+
+
+def _to_float(text: str, variant: str) -> float:
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f"Invalid value {text} in the variant {variant}!") from None
+
+
+_worker_template: DeckTemplate | None = None
+
+
+def _init_worker(template: DeckTemplate) -> None:
+    global _worker_template
+    _worker_template = template
+
+
+def _write_variant(task: tuple[Processor, dict[int, bytes], str]) -> str:
+    processor, headers, output_filepath = task
+    _worker_template.render(headers, output_filepath)
+    processor.add_material_cards(output_filepath)
+    return output_filepath
+
+
+def main():
+    start = time.perf_counter()
+    generator = DeckVariantGenerator(InputData())
+    print(
+        f"{generator.input_data.mcnp_input_filepath} compiled into a template with "
+        f"{len(generator.template.components)} cell headers in "
+        f"{time.perf_counter() - start:.1f} s."
+    )
+
+    start = time.perf_counter()
+    variants = generator.write_variants()
+    for output_filepath, employed_materials in variants:
+        print(f"{output_filepath}: {employed_materials}")
+    print(f"{len(variants)} variants written in {time.perf_counter() - start:.1f} s.")
+
+
+if __name__ == "__main__":
+    main()
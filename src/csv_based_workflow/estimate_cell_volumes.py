@@ -0,0 +1,192 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import mcnp_geometry as mg
+from mcnp_materials_from_csv import iter_cards
+from stochastic_volumes_from_output import StochasticVolumeReader
+
+MCNP_INPUT_FILEPATH = "testing.mcnp"
+CSV_FILEPATH = "testing.csv"
+FIRST_CELL_ID = 1
+TARGET_RELATIVE_ERROR = 0.01  # Sampling of a cell stops when its error is below it
+MAX_SAMPLES = 10_000_000  # Maximum random points per cell
+MIN_BATCH_SIZE = 1_000  # Random points evaluated at once in the smallest cells
+MAX_BATCH_SIZE = 100_000  # Random points evaluated at once, limits the memory used
+PROCESSES = os.cpu_count()
+SEED = 0
+
+
+@dataclass
+class InputData:
+    """
+    Holds the input data for the estimator taking the default values from the module
+    """
+
+    mcnp_input_filepath: str = MCNP_INPUT_FILEPATH
+    csv_filepath: str = CSV_FILEPATH
+    first_cell_id: int = FIRST_CELL_ID
+    target_relative_error: float = TARGET_RELATIVE_ERROR
+    processes: int = PROCESSES
+
+
+class CellVolumeEstimator(StochasticVolumeReader):
+    """
+    Estimates the volume of the cells of the csv components by sampling random
+    points in their bounding boxes instead of running MCNP. The volumes are written
+    to the STOCHASTIC VOLUME and DCF=ORG/STOCH columns of the csv as done with the
+    volumes read from an MCNP output.
+
+    Only the cells of the main geometry are estimated. The cells of a universe, the
+    ones that cannot be evaluated and the ones where no point was found get a volume
+    of 0 and their components are not updated.
+    """
+
+    def __init__(self, input_data: InputData):
+        super().__init__(input_data)
+        with open(input_data.mcnp_input_filepath, errors="replace") as infile:
+            self.geometry = mg.Geometry.from_cards(iter_cards(infile))
+        self.world_bounds = self.geometry.get_world_bounds()
+        self.world_volume = float(np.prod(self.world_bounds[1] - self.world_bounds[0]))
+
+    def get_sampling_boxes(self) -> dict[int, np.ndarray | None]:
+        """
+        Returns the box where the points of each cell of the csv components are
+        sampled, or None if the volume of the cell cannot be estimated.
+        """
+        cell_ids = np.fromiter(self.geometry.cells, dtype=np.int64)
+        cell_ids = cell_ids[self.cell_id_index.find_all(cell_ids) >= 0]
+        boxes = {}
+        for cell_id in cell_ids.tolist():
+            boxes[cell_id] = None
+            if self.geometry.cells[cell_id] is None:
+                continue
+            if self.geometry.cell_parameters[cell_id].get("u", "0") != "0":
+                continue
+            box = self.geometry.get_bounds(cell_id)
+            box = np.array(
+                [
+                    np.maximum(box[0], self.world_bounds[0]),
+                    np.minimum(box[1], self.world_bounds[1]),
+                ]
+            )
+            if np.all(box[0] < box[1]):
+                boxes[cell_id] = box
+        return boxes
+
+    def get_first_batch_size(self, box: np.ndarray) -> int:
+        """
+        Returns the number of points of the first batch of a cell, MAX_BATCH_SIZE
+        scaled by the fraction of the world taken by its sampling box. The next
+        batches depend on the points still needed to reach the target error.
+        """
+        box_fraction = float(np.prod(box[1] - box[0])) / self.world_volume
+        batch_size = int(np.ceil(MAX_BATCH_SIZE * box_fraction))
+        return min(max(batch_size, MIN_BATCH_SIZE), MAX_BATCH_SIZE)
+
+    def estimate_volumes(self) -> pd.DataFrame:
+        """
+        Returns a row per cell with its estimated volume, relative error and number
+        of points sampled. The cells are distributed among a pool of processes.
+        """
+        boxes = self.get_sampling_boxes()
+        seeds = np.random.SeedSequence(SEED).spawn(len(boxes))
+        tasks = [
+            (cell_id, box, self.get_first_batch_size(box), seed)
+            for (cell_id, box), seed in zip(boxes.items(), seeds)
+            if box is not None
+        ]
+        results = {cell_id: (0.0, 0.0, 0) for cell_id in boxes}
+        with ProcessPoolExecutor(
+            self.input_data.processes,
+            initializer=_init_worker,
+            initargs=(self.geometry, self.input_data.target_relative_error),
+        ) as executor:
+            for cell_id, volume, error, n_samples in executor.map(
+                _estimate_cell_volume, tasks, chunksize=max(1, len(tasks) // 1000)
+            ):
+                results[cell_id] = (volume, error, n_samples)
+
+        return pd.DataFrame(
+            {
+                "CELL": list(results),
+                "VOLUME": [result[0] for result in results.values()],
+                "ERROR": [result[1] for result in results.values()],
+                "SAMPLES": [result[2] for result in results.values()],
+            }
+        )
+
+
+_worker_geometry: mg.Geometry | None = None
+_worker_target_relative_error = TARGET_RELATIVE_ERROR
+
+
+def _init_worker(geometry: mg.Geometry, target_relative_error: float) -> None:
+    global _worker_geometry, _worker_target_relative_error
+    _worker_geometry = geometry
+    _worker_target_relative_error = target_relative_error
+
+
+def _estimate_cell_volume(
+    task: tuple[int, np.ndarray, int, np.random.SeedSequence],
+) -> tuple[int, float, float, int]:
+    """
+    Samples batches of points in the box until the relative error of the fraction of
+    points inside the cell is below the target or MAX_SAMPLES is reached. After each
+    batch, the next one has the points that the fraction found so far needs to reach
+    the target, so a cell is not sampled much more than its error requires.
+    """
+    cell_id, box, batch_size, seed = task
+    rng = np.random.default_rng(seed)
+    box_volume = float(np.prod(box[1] - box[0]))
+    target = _worker_target_relative_error
+    hits = n_samples = 0
+    error = np.inf
+    while n_samples < MAX_SAMPLES and error > target:
+        points = rng.uniform(box[0], box[1], size=(batch_size, 3))
+        try:
+            hits += int(np.count_nonzero(_worker_geometry.contains(cell_id, points)))
+        except ValueError:
+            return cell_id, 0.0, 0.0, n_samples
+        n_samples += batch_size
+        if hits > 0:
+            # Relative error of a binomial fraction hits / n_samples
+            fraction = hits / n_samples
+            error = np.sqrt((1 - fraction) / hits)
+            needed = int(np.ceil((1 - fraction) / (fraction * target**2))) - n_samples
+        else:
+            needed = n_samples  # Doubles the points until one is inside the cell
+        batch_size = min(max(needed, MIN_BATCH_SIZE), MAX_BATCH_SIZE)
+        batch_size = min(batch_size, MAX_SAMPLES - n_samples)
+    if hits == 0:
+        return cell_id, 0.0, 0.0, n_samples
+    return cell_id, box_volume * hits / n_samples, float(error), n_samples
+
+
+def main():
+    estimator = CellVolumeEstimator(InputData())
+    cells = estimator.estimate_volumes()
+    not_estimated = cells[cells["VOLUME"] <= 0]
+    print(f"The volume of {len(cells) - len(not_estimated)} cells was estimated.")
+    if not not_estimated.empty:
+        print(
+            f"{len(not_estimated)} cells could not be estimated: "
+            f"{not_estimated['CELL'].tolist()}"
+        )
+    components = estimator.get_component_volumes(cells)
+    estimator.update_csv(components)
+    print(f"The volume of {len(components)} components was written to the csv.")
+
+    # Only the cells that reached MAX_SAMPLES can be above the target
+    target = estimator.input_data.target_relative_error
+    uncertain = components[components["ERROR"] > target]
+    if not uncertain.empty:
+        print(f"Components with a relative error above {target}:")
+        print(uncertain.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+import re
+import textwrap
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+import mcnp_geometry as mg
+from mcnp_card_index import CardIndex
+from mcnp_materials_from_csv import CellIdIndex, iter_cards
+
+MCNP_INPUT_FILEPATH = "testing.mcnp"
+CSV_FILEPATH = "testing.csv"
+FIRST_CELL_ID = 1
+LEVEL = "Level 1"  # Column of the csv where ASSEMBLY is looked for
+ASSEMBLY = "Coils"  # Value of the LEVEL column of the components to extract
+COMPONENT_IDS = []  # If not empty, these components are extracted instead
+SPHERE_MARGIN = 10.0  # cm between the extracted cells and the graveyard sphere
+DEBUG_SOURCE = True  # Flood the sub-model with void particles from the sphere
+NPS = 1_000_000  # Histories of the debug source
+
+# Data cards copied as they are, by their name without numbers or particles
+COPIED_DATA_CARDS = ("mode", "phys", "cut", "dbcn", "prdmp", "print", "rand", "lost")
+SOURCE_DATA_CARDS = ("sdef", "si", "sp", "sb", "ds", "sc", "kcode", "ksrc", "nps")
+DATA_CARD_PREFIX_PATTERN = re.compile(r"[a-z]+")
+LIKE_PATTERN = re.compile(r"\s*\d+\s+like\s+(\d+)\s", re.IGNORECASE)
+
+
+@dataclass
+class InputData:
+    """
+    Holds the input data for the extraction taking the default values from the
+    module
+    """
+
+    mcnp_input_filepath: str = MCNP_INPUT_FILEPATH
+    csv_filepath: str = CSV_FILEPATH
+    first_cell_id: int = FIRST_CELL_ID
+    level: str = LEVEL
+    assembly: str = ASSEMBLY
+    component_ids: list[str] = field(default_factory=lambda: list(COMPONENT_IDS))
+    debug_source: bool = DEBUG_SOURCE
+
+    @property
+    def output_filepath(self) -> str:
+        return self.mcnp_input_filepath + "[submodel]"
+
+
+@dataclass
+class SubModel:
+    """
+    Cards of the MCNP input file needed by the extracted cells, in the order of the
+    file. added_cells are the cells that were not selected but are used by the
+    selected ones (LIKE n BUT, #n or the universes they are filled with).
+    """
+
+    cells: dict[int, list[str]] = field(default_factory=dict)
+    surfaces: dict[int, list[str]] = field(default_factory=dict)
+    data_cards: list[list[str]] = field(default_factory=list)
+    added_cells: list[int] = field(default_factory=list)
+    missing_cells: list[int] = field(default_factory=list)
+    missing_surfaces: list[int] = field(default_factory=list)
+    geometry: mg.Geometry = field(default_factory=mg.Geometry)
+
+
+class SubModelExtractor:
+    """
+    Writes a self-contained MCNP input file with only the cells of some csv
+    components, the surfaces they reference, the materials and transformations they
+    use and a void cell and a graveyard around them. The cards are read with the card
+    index of the MCNP file, so only the extracted cards are read.
+
+    The importances must be given in the cell cards, as GEOUNED writes them, and the
+    tallies, importances and other data cards that refer to cells are not copied.
+    """
+
+    def __init__(self, input_data: InputData):
+        self.input_data = input_data
+        self.csv = pd.read_csv(input_data.csv_filepath)
+        self.cell_id_index = CellIdIndex.from_csv(
+            self.csv, input_data.first_cell_id - 1
+        )
+        self.card_index = CardIndex.for_deck(input_data.mcnp_input_filepath)
+
+    def get_selected_cells(self) -> list[int]:
+        """
+        Returns the cells of the components of the assembly or of the COMPONENT_IDS
+        that are in the MCNP file.
+        """
+        if self.input_data.component_ids:
+            selected = set(self.input_data.component_ids)
+        else:
+            levels = self.csv.set_index("Component ID")[self.input_data.level]
+            selected = set(levels.index[levels.astype(str) == self.input_data.assembly])
+        if not selected:
+            raise ValueError("No component of the csv was selected!")
+
+        cell_ids = []
+        for position in np.flatnonzero(
+            np.isin(self.cell_id_index.component_ids, list(selected))
+        ):
+            first = int(self.cell_id_index.starts[position])
+            last = int(self.cell_id_index.ends[position])
+            cell_ids += [
+                cell_id
+                for cell_id in range(first, last + 1)
+                if self.card_index.find("cell", cell_id) is not None
+            ]
+        return cell_ids
+
+    def extract(self, cell_ids: list[int]) -> SubModel:
+        """
+        Reads the cards of the cells and of everything they depend on.
+        """
+        sub_model = SubModel()
+        geometry = sub_model.geometry
+        selected = set(cell_ids)
+        pending = set(cell_ids)
+        universes_found = set()
+        while pending:
+            texts = self._read_cards("cell", pending)
+            pending = set()
+            filling_universes = set()
+            for cell_id, card_lines in texts.items():
+                if card_lines is None:
+                    sub_model.missing_cells.append(cell_id)
+                    continue
+                sub_model.cells[cell_id] = card_lines
+                if cell_id not in selected:
+                    sub_model.added_cells.append(cell_id)
+                geometry.add_cell(card_lines)
+                pending.update(_get_referenced_cells(card_lines, geometry))
+                fill = geometry.cell_parameters[cell_id].get("fill", "")
+                if fill.lstrip("-").isdigit():
+                    filling_universes.add(int(fill.lstrip("-")))
+            filling_universes -= universes_found
+            if filling_universes:
+                pending.update(self._find_universe_cells(filling_universes))
+                universes_found |= filling_universes
+            pending -= sub_model.cells.keys() | set(sub_model.missing_cells)
+
+        sub_model.cells = self._sort_by_position("cell", sub_model.cells)
+        surface_ids = set()
+        for cell_id, card_lines in sub_model.cells.items():
+            node = geometry.cells[cell_id]
+            if node is None:  # The geometry of cells with TRCL is not parsed
+                surface_ids.update(mg.get_cell_surfaces(card_lines))
+            else:
+                surface_ids.update(_get_node_numbers(node, "surface"))
+        for surface_id, card_lines in self._read_cards("surface", surface_ids).items():
+            if card_lines is None:
+                sub_model.missing_surfaces.append(surface_id)
+                continue
+            sub_model.surfaces[surface_id] = card_lines
+            surface = mg.parse_surface_card(card_lines)
+            if surface is not None:
+                geometry.surfaces[surface_id] = surface
+        sub_model.surfaces = self._sort_by_position("surface", sub_model.surfaces)
+
+        sub_model.data_cards = self._get_data_cards(geometry)
+        return sub_model
+
+    def _read_cards(
+        self, block: str, card_ids: set[int]
+    ) -> dict[int, list[str] | None]:
+        texts = self.card_index.read_cards(
+            self.input_data.mcnp_input_filepath, block, card_ids
+        )
+        return {
+            card_id: None if text is None else text.splitlines(keepends=True)
+            for card_id, text in texts.items()
+        }
+
+    def _sort_by_position(
+        self, block: str, cards: dict[int, list[str]]
+    ) -> dict[int, list[str]]:
+        order = sorted(cards, key=lambda card_id: self.card_index.find(block, card_id))
+        return {card_id: cards[card_id] for card_id in order}
+
+    def _find_universe_cells(self, universes: set[int]) -> set[int]:
+        """
+        Returns the cells of the universes. The cell block is read once as the
+        universe of a cell is not in the card index.
+        """
+        cell_ids = set()
+        with open(self.input_data.mcnp_input_filepath, errors="replace") as infile:
+            for block, card_lines in iter_cards(infile):
+                if block in ("surface", "data"):
+                    break
+                if block != "cell":
+                    continue
+                universe = mg.get_cell_parameters(card_lines).get("u", "0")
+                if universe.lstrip("-").isdigit() and abs(int(universe)) in universes:
+                    cell_ids.add(mg.get_card_number(card_lines))
+        return cell_ids
+
+    def _get_data_cards(self, geometry: mg.Geometry) -> list[list[str]]:
+        """
+        Returns the data cards of the materials and transformations used by the
+        cells and surfaces and the COPIED_DATA_CARDS, in the order of the file.
+        """
+        materials = {
+            material for material in geometry.cell_materials.values() if material
+        }
+        transformations = set()
+        for surface in geometry.surfaces.values():
+            if surface.transformation:
+                transformations.add(surface.transformation)
+        for parameters in geometry.cell_parameters.values():
+            for key in ("trcl", "*trcl"):
+                if parameters.get(key, "").isdigit():
+                    transformations.add(int(parameters[key]))
+
+        copied = set(COPIED_DATA_CARDS)
+        if not self.input_data.debug_source:
+            copied |= set(SOURCE_DATA_CARDS)
+        positions = []
+        for i, (block, card_id) in enumerate(
+            zip(self.card_index.blocks, self.card_index.card_ids)
+        ):
+            if block != "data":
+                continue
+            name = card_id.split(":", 1)[0]
+            prefix = DATA_CARD_PREFIX_PATTERN.match(name).group()
+            number = name[len(prefix) :]
+            if prefix in copied:
+                positions.append(i)
+            elif number.isdigit() and (
+                (prefix in ("m", "mt", "mx") and int(number) in materials)
+                or (prefix == "tr" and int(number) in transformations)
+            ):
+                positions.append(i)
+
+        card_ids = [self.card_index.card_ids[i] for i in positions]
+        texts = self.card_index.read_cards(
+            self.input_data.mcnp_input_filepath, "data", card_ids
+        )
+        return [texts[card_id].splitlines(keepends=True) for card_id in card_ids]
+
+    def get_sphere(self, sub_model: SubModel) -> tuple[np.ndarray, float]:
+        """
+        Returns the center and radius of a sphere around the cells of the main
+        geometry of the sub-model. The cells whose extent cannot be computed (e.g.
+        with TRCL) are assumed to be inside the extent of the surfaces of the
+        sub-model, SPHERE_MARGIN should be larger if they are moved outside it.
+        """
+        geometry = sub_model.geometry
+        world_bounds = geometry.get_world_bounds()
+        boxes = []
+        for cell_id, node in geometry.cells.items():
+            if geometry.cell_parameters[cell_id].get("u", "0") != "0":
+                continue
+            box = world_bounds if node is None else geometry.get_bounds(cell_id)
+            boxes.append(
+                [
+                    np.maximum(box[0], world_bounds[0]),
+                    np.minimum(box[1], world_bounds[1]),
+                ]
+            )
+        boxes = np.array(boxes).reshape(-1, 2, 3)
+        low, high = boxes[:, 0].min(axis=0), boxes[:, 1].max(axis=0)
+        center = (low + high) / 2
+        return center, float(np.linalg.norm(high - low) / 2 + SPHERE_MARGIN)
+
+    def write_submodel(self, sub_model: SubModel) -> None:
+        """
+        Writes the sub-model with a void cell between the extracted cells and the
+        sphere and the graveyard outside it. With DEBUG_SOURCE the sphere is the
+        source of void particles going inwards, which are lost at the gaps and
+        overlaps of the cells.
+        """
+        geometry = sub_model.geometry
+        main_cells = [
+            cell_id
+            for cell_id in sub_model.cells
+            if geometry.cell_parameters[cell_id].get("u", "0") == "0"
+        ]
+        if not main_cells:
+            raise ValueError(
+                "None of the extracted cells is in the main geometry (universe 0), "
+                "the sub-model cannot be placed inside the graveyard sphere!"
+            )
+        first_parameters = geometry.cell_parameters[main_cells[0]]
+        importances = [key for key in first_parameters if "imp" in key]
+        if not importances:
+            raise ValueError(
+                "The importances must be in the cell cards to write the sub-model!"
+            )
+        center, radius = self.get_sphere(sub_model)
+        void_cell = max(sub_model.cells) + 1
+        graveyard = void_cell + 1
+        sphere = max(sub_model.surfaces, default=0) + 1
+
+        with open(self.input_data.output_filepath, "w") as outfile:
+            outfile.write(f"Sub-model of {self.input_data.mcnp_input_filepath}\n")
+            for card_lines in sub_model.cells.values():
+                outfile.writelines(card_lines)
+            outfile.write("c Void around the sub-model and graveyard\n")
+            complements = " ".join(f"#{cell_id}" for cell_id in main_cells)
+            void_importances = " ".join(f"{key}=1" for key in importances)
+            _write_wrapped(
+                f"{void_cell} 0 -{sphere} {complements} {void_importances}", outfile
+            )
+            graveyard_importances = " ".join(f"{key}=0" for key in importances)
+            outfile.write(f"{graveyard} 0 {sphere} {graveyard_importances}\n")
+            outfile.write("\n")
+
+            for card_lines in sub_model.surfaces.values():
+                outfile.writelines(card_lines)
+            x, y, z = center
+            outfile.write(f"{sphere} S {x:.6e} {y:.6e} {z:.6e} {radius:.6e}\n")
+            outfile.write("\n")
+
+            for card_lines in sub_model.data_cards:
+                outfile.writelines(card_lines)
+            if self.input_data.debug_source:
+                outfile.write("VOID\n")
+                outfile.write(f"SDEF SUR={sphere} NRM=-1\n")
+                outfile.write(f"NPS {NPS}\n")
+
+
+def _get_referenced_cells(card_lines: list[str], geometry: mg.Geometry) -> set[int]:
+    """
+    Returns the cells a cell card refers to, with LIKE n BUT or complements (#n).
+    """
+    if match := LIKE_PATTERN.match(card_lines[0]):
+        return {int(match.group(1))}
+    node = geometry.cells.get(mg.get_card_number(card_lines))
+    if node is None:  # With TRCL
+        return {
+            int(token.text)
+            for token in mg.iter_cell_geometry(card_lines)
+            if token.kind == "cell"
+        }
+    return _get_node_numbers(node, "cell")
+
+
+def _get_node_numbers(node: mg.GeometryNode, kind: str) -> set[int]:
+    if node.kind == kind:
+        return {abs(node.number)}
+    numbers = set()
+    for child in node.children:
+        numbers.update(_get_node_numbers(child, kind))
+    return numbers
+
+
+def _write_wrapped(text: str, outfile) -> None:
+    lines = textwrap.wrap(
+        text,
+        width=mg.MAX_LINE_LENGTH,
+        subsequent_indent="     ",
+        break_long_words=False,
+        break_on_hyphens=False,
+    )
+    outfile.writelines(line + "\n" for line in lines)
+
+
+def main():
+    extractor = SubModelExtractor(InputData())
+    cell_ids = extractor.get_selected_cells()
+    sub_model = extractor.extract(cell_ids)
+    if sub_model.missing_cells:
+        print(f"Cells not found in the MCNP file: {sub_model.missing_cells}")
+    if sub_model.missing_surfaces:
+        print(f"Surfaces not found in the MCNP file: {sub_model.missing_surfaces}")
+    if sub_model.added_cells:
+        print(
+            "Cells added as they are used by the selected ones: "
+            f"{sub_model.added_cells}"
+        )
+    extractor.write_submodel(sub_model)
+    print(
+        f"Sub-model with {len(sub_model.cells)} cells, {len(sub_model.surfaces)} "
+        f"surfaces and {len(sub_model.data_cards)} data cards written to "
+        f"{extractor.input_data.output_filepath}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import mcnp_geometry as mg
+from mcnp_materials_from_csv import CellIdIndex, iter_cards
+
+MCNP_INPUT_FILEPATH = "testing.mcnp"
+CSV_FILEPATH = "testing.csv"
+POINTS_FILEPATH = "lost_particles.csv"  # The first three columns are X, Y, Z in cm
+FIRST_CELL_ID = 1
+SEARCH_DISTANCE = 0.1  # cm, cells whose bounding box is closer are candidates
+TOP_COMPONENTS = 20  # Number of components printed in the console
+
+LEAF_SIZE = 8  # Maximum boxes in a leaf of the bounding volume hierarchy
+BATCH_SIZE = 1_000_000  # Points searched at once, limits the memory used
+
+
+@dataclass
+class InputData:
+    """
+    Holds the input data for the attribution taking the default values from the
+    module
+    """
+
+    mcnp_input_filepath: str = MCNP_INPUT_FILEPATH
+    csv_filepath: str = CSV_FILEPATH
+    points_filepath: str = POINTS_FILEPATH
+    first_cell_id: int = FIRST_CELL_ID
+
+    @property
+    def located_filepath(self) -> str:
+        return self.points_filepath + "[located].csv"
+
+    @property
+    def components_filepath(self) -> str:
+        return self.points_filepath + "[components].csv"
+
+
+class BoundingVolumeHierarchy:
+    """
+    Binary tree of axis-aligned boxes. Every node has the box that contains the boxes
+    below it, so a search only visits the branches whose box is close to the point.
+    The tree is stored in arrays and searched for many points at once.
+    """
+
+    def __init__(self, boxes: np.ndarray):
+        self.boxes = boxes
+        self.order = np.arange(len(boxes))
+        node_bounds, children, ranges = [], [], []
+
+        # Each node is split at the median of the centers along its longest side
+        centers = boxes.mean(axis=1)
+        stack = [(0, len(boxes), -1, 0)]  # start, end, parent, child slot
+        while stack:
+            start, end, parent, slot = stack.pop()
+            node = len(node_bounds)
+            if parent >= 0:
+                children[parent][slot] = node
+            items = self.order[start:end]
+            node_bounds.append(
+                [boxes[items, 0].min(axis=0), boxes[items, 1].max(axis=0)]
+            )
+            children.append([-1, -1])
+            ranges.append((start, end))
+            if end - start <= LEAF_SIZE:
+                continue
+            axis = np.argmax(np.ptp(centers[items], axis=0))
+            middle = (end - start) // 2
+            partition = np.argpartition(centers[items, axis], middle)
+            self.order[start:end] = items[partition]
+            stack.append((start, start + middle, node, 0))
+            stack.append((start + middle, end, node, 1))
+
+        self.node_bounds = np.array(node_bounds).reshape(-1, 2, 3)
+        self.children = np.array(children, dtype=np.int64).reshape(-1, 2)
+        self.ranges = np.array(ranges, dtype=np.int64).reshape(-1, 2)
+
+    def query(
+        self, points: np.ndarray, distance: float
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the pairs of point and box indices where the box is closer than the
+        distance to the point. All the points go down the tree together, one level
+        per iteration.
+        """
+        if len(self.boxes) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        point_indices = np.arange(len(points))
+        nodes = np.zeros(len(points), dtype=np.int64)
+        found_points, found_boxes = [], []
+        while len(nodes) > 0:
+            close = _are_close(self.node_bounds[nodes], points[point_indices], distance)
+            point_indices, nodes = point_indices[close], nodes[close]
+
+            leaves = self.children[nodes, 0] < 0
+            starts, ends = self.ranges[nodes[leaves]].T
+            lengths = ends - starts
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+            found_points.append(np.repeat(point_indices[leaves], lengths))
+            found_boxes.append(self.order[offsets + np.arange(lengths.sum())])
+
+            point_indices = np.repeat(point_indices[~leaves], 2)
+            nodes = self.children[nodes[~leaves]].ravel()
+
+        point_indices = np.concatenate(found_points)
+        boxes = np.concatenate(found_boxes)
+        close = _are_close(self.boxes[boxes], points[point_indices], distance)
+        return point_indices[close], boxes[close]
+
+
+class LostParticleLocator:
+    """
+    Finds the cell and csv component where each lost particle was lost. The
+    candidates of a point are the cells whose bounding box is close to it, found with
+    a bounding volume hierarchy. The cell that contains the point is preferred, else
+    the candidate with the smallest bounding box. Points far from every cell are
+    searched again with a larger distance until a candidate is found.
+    """
+
+    def __init__(self, input_data: InputData):
+        self.input_data = input_data
+        self.csv = pd.read_csv(input_data.csv_filepath)
+        self.cell_id_index = CellIdIndex.from_csv(
+            self.csv, input_data.first_cell_id - 1
+        )
+        with open(input_data.mcnp_input_filepath, errors="replace") as infile:
+            self.geometry = mg.Geometry.from_cards(iter_cards(infile))
+        world_bounds = self.geometry.get_world_bounds()
+        self.max_distance = float(np.linalg.norm(world_bounds[1] - world_bounds[0]))
+
+        # Cells that are not evaluated are left out, their box is unknown
+        cell_ids = [
+            cell_id
+            for cell_id, node in self.geometry.cells.items()
+            if node is not None
+            and self.geometry.cell_parameters[cell_id].get("u", "0") == "0"
+        ]
+        boxes = np.array(
+            [self.geometry.get_bounds(cell_id) for cell_id in cell_ids]
+        ).reshape(-1, 2, 3)
+        boxes[:, 0] = np.maximum(boxes[:, 0], world_bounds[0])
+        boxes[:, 1] = np.minimum(boxes[:, 1], world_bounds[1])
+        self.cell_ids = np.array(cell_ids, dtype=np.int64)
+        self.box_volumes = np.prod(boxes[:, 1] - boxes[:, 0], axis=1)
+        self.hierarchy = BoundingVolumeHierarchy(boxes)
+
+    def read_points(self) -> pd.DataFrame:
+        points = pd.read_csv(self.input_data.points_filepath, usecols=[0, 1, 2])
+        points.columns = ["X", "Y", "Z"]
+        return points.astype(np.float64)
+
+    def locate(self, points: pd.DataFrame) -> pd.DataFrame:
+        """
+        Returns the points with their cell, component and whether the point is
+        inside the cell or only close to it.
+        """
+        coordinates = points[["X", "Y", "Z"]].to_numpy()
+        cells = np.zeros(len(coordinates), dtype=np.int64)
+        inside = np.zeros(len(coordinates), dtype=bool)
+        for start in range(0, len(coordinates), BATCH_SIZE):
+            batch = slice(start, start + BATCH_SIZE)
+            cells[batch], inside[batch] = self._locate_batch(coordinates[batch])
+
+        points = points.copy()
+        points["CELL"] = cells
+        points["INSIDE"] = inside
+        positions = self.cell_id_index.find_all(cells)
+        components = np.full(len(cells), "-", dtype=object)
+        found = positions >= 0
+        components[found] = self.cell_id_index.component_ids[positions[found]]
+        points["COMPONENT"] = components
+        return points
+
+    def _locate_batch(self, coordinates: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        point_indices, boxes = self._find_candidates(coordinates)
+
+        # Each cell is evaluated once on all its candidate points
+        inside = np.zeros(len(boxes), dtype=bool)
+        order = np.argsort(boxes, kind="stable")
+        unique_boxes, starts = np.unique(boxes[order], return_index=True)
+        for box, pairs in zip(unique_boxes, np.split(order, starts[1:])):
+            try:
+                inside[pairs] = self.geometry.contains(
+                    self.cell_ids[box], coordinates[point_indices[pairs]]
+                )
+            except ValueError:
+                pass
+
+        # The best candidate of each point is the first after sorting
+        order = np.lexsort((self.box_volumes[boxes], ~inside, point_indices))
+        point_indices, boxes, inside = point_indices[order], boxes[order], inside[order]
+        first = np.flatnonzero(np.r_[True, point_indices[1:] != point_indices[:-1]])
+        cells = np.zeros(len(coordinates), dtype=np.int64)
+        cells[point_indices[first]] = self.cell_ids[boxes[first]]
+        located = np.zeros(len(coordinates), dtype=bool)
+        located[point_indices[first]] = inside[first]
+        return cells, located
+
+    def _find_candidates(
+        self, coordinates: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        distance = SEARCH_DISTANCE
+        remaining = np.arange(len(coordinates))
+        found_points, found_boxes = [], []
+        while len(remaining) > 0:
+            point_indices, boxes = self.hierarchy.query(
+                coordinates[remaining], distance
+            )
+            found_points.append(remaining[point_indices])
+            found_boxes.append(boxes)
+            remaining = np.setdiff1d(remaining, remaining[point_indices])
+            if distance > self.max_distance:
+                break
+            distance *= 4
+        return np.concatenate(found_points), np.concatenate(found_boxes)
+
+    def get_component_histogram(self, points: pd.DataFrame) -> pd.DataFrame:
+        """
+        Returns the number of lost particles of each csv component with its
+        hierarchy, the components with more lost particles first.
+        """
+        counts = points.groupby("COMPONENT").agg(
+            LOST=("CELL", "size"), INSIDE=("INSIDE", "sum")
+        )
+        counts.index.name = "Component ID"
+        counts = counts.reset_index()
+        level_keys = [key for key in self.csv.keys() if "Level" in key]
+        hierarchy = self.csv[level_keys + ["Component ID", "MATERIAL"]]
+        components = hierarchy.merge(counts, on="Component ID", how="right")
+        return components.sort_values("LOST", ascending=False, kind="stable")
+
+
+def _are_close(boxes: np.ndarray, points: np.ndarray, distance: float) -> np.ndarray:
+    return np.all(
+        (points >= boxes[:, 0] - distance) & (points <= boxes[:, 1] + distance), axis=1
+    )
+
+
+def main():
+    locator = LostParticleLocator(InputData())
+    points = locator.locate(locator.read_points())
+    points.to_csv(locator.input_data.located_filepath, index=False)
+    components = locator.get_component_histogram(points)
+    components.to_csv(locator.input_data.components_filepath, index=False)
+
+    print(
+        f"{len(points)} lost particles located, {points['INSIDE'].sum()} of them "
+        "inside a cell."
+    )
+    print("Components with most lost particles:")
+    print(components.head(TOP_COMPONENTS).to_string(index=False))
+    print(f"Histogram written to {locator.input_data.components_filepath}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import argparse
+import json
+import mmap
+import os
+import re
+import shutil
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+import mcnp_geometry as mg
+from mcnp_materials_from_csv import iter_mapped_cards, read_mapped_line
+
+MCNP_INPUT_FILEPATH = "testing.mcnp"
+
+CARD_INDEX_SUFFIX = ".index.json"
+INDEXED_BLOCKS = ("cell", "surface", "data")
+DATA_CARD_NAME_PATTERN = re.compile(r"\*?([a-z]+\d*(?::[^\s=]+)?)")
+COPY_BUFFER_SIZE = 16 * 1024**2  # Bytes copied at once when a card changes length
+
+
+@dataclass
+class CardIndex:
+    """
+    Position in bytes of every cell, surface and data card of an MCNP input file, so
+    a single card can be read or replaced with a seek instead of parsing the whole
+    file. The cells and surfaces are indexed by their number and the data cards by
+    their name in lowercase (e.g. m1, f4:n, mode). A data card can also be found by
+    its name without the particle designator (f4) if there is no card with that
+    name.
+
+    The index is saved next to the MCNP file with the suffix .index.json and built
+    again when the size or modification time of the file change.
+    """
+
+    deck_size: int = -1
+    deck_mtime_ns: int = -1
+    blocks: list[str] = field(default_factory=list)
+    card_ids: list[str] = field(default_factory=list)
+    starts: list[int] = field(default_factory=list)
+    lengths: list[int] = field(default_factory=list)
+
+    def __post_init__(self):
+        # The first card wins if an id is repeated, as the error MCNP would raise
+        self._positions: dict[tuple[str, str], int] = {}
+        for i, key in enumerate(zip(self.blocks, self.card_ids)):
+            self._positions.setdefault(key, i)
+        for i, (block, card_id) in enumerate(zip(self.blocks, self.card_ids)):
+            if block == "data" and ":" in card_id:
+                self._positions.setdefault((block, card_id.split(":", 1)[0]), i)
+
+    @classmethod
+    def build(cls, mcnp_input_filepath: str) -> "CardIndex":
+        """
+        Scans the memory-mapped MCNP file once and records its cards.
+        """
+        stat = os.stat(mcnp_input_filepath)
+        index = cls(stat.st_size, stat.st_mtime_ns)
+        if stat.st_size == 0:
+            return index
+        with (
+            open(mcnp_input_filepath, "rb") as infile,
+            mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as deck,
+        ):
+            for block, spans in iter_mapped_cards(deck):
+                if block not in INDEXED_BLOCKS:
+                    continue
+                start, end = spans[0][0], spans[-1][1]
+                # The id is in the first line of the card
+                card_id = get_card_id(block, [read_mapped_line(deck, start)])
+                if card_id is None:
+                    continue
+                index.blocks.append(block)
+                index.card_ids.append(card_id)
+                index.starts.append(start)
+                index.lengths.append(end - start)
+        index.__post_init__()
+        return index
+
+    @classmethod
+    def load(cls, index_filepath: str) -> "CardIndex | None":
+        try:
+            with open(index_filepath) as infile:
+                return cls(**json.load(infile))
+        except (FileNotFoundError, json.JSONDecodeError, TypeError):
+            return None
+
+    @classmethod
+    def for_deck(cls, mcnp_input_filepath: str) -> "CardIndex":
+        """
+        Returns the saved index of the MCNP file, or builds and saves a new one if
+        there is none or the file changed since it was built.
+        """
+        index_filepath = mcnp_input_filepath + CARD_INDEX_SUFFIX
+        index = cls.load(index_filepath)
+        if index is None or not index.matches_deck(mcnp_input_filepath):
+            index = cls.build(mcnp_input_filepath)
+            index.save(index_filepath)
+        return index
+
+    def save(self, index_filepath: str) -> None:
+        columns = {
+            key: value for key, value in vars(self).items() if not key.startswith("_")
+        }
+        with open(index_filepath, "w") as outfile:
+            json.dump(columns, outfile)
+
+    def matches_deck(self, mcnp_input_filepath: str) -> bool:
+        stat = os.stat(mcnp_input_filepath)
+        return (stat.st_size, stat.st_mtime_ns) == (self.deck_size, self.deck_mtime_ns)
+
+    def find(self, block: str, card_id: int | str) -> tuple[int, int] | None:
+        """
+        Returns the start and length in bytes of the card, None if it is not in the
+        MCNP file.
+        """
+        i = self._get_position(block, card_id)
+        if i is None:
+            return None
+        return self.starts[i], self.lengths[i]
+
+    def read_card(
+        self, mcnp_input_filepath: str, block: str, card_id: int | str
+    ) -> str:
+        """
+        Returns the text of the card, with its comment and continuation lines.
+        """
+        start, length = self._find_or_raise(block, card_id)
+        with open(mcnp_input_filepath, "rb") as infile:
+            infile.seek(start)
+            return infile.read(length).decode(errors="replace")
+
+    def read_cards(
+        self, mcnp_input_filepath: str, block: str, card_ids: Iterable[int | str]
+    ) -> dict[int | str, str | None]:
+        """
+        Returns the text of each of the cards, None for the ones not in the MCNP
+        file. The cards are read in the order of the file so the reads only go
+        forward.
+        """
+        texts = {card_id: None for card_id in card_ids}
+        spans = sorted(
+            (span, card_id)
+            for card_id in texts
+            if (span := self.find(block, card_id)) is not None
+        )
+        with open(mcnp_input_filepath, "rb") as infile:
+            for (start, length), card_id in spans:
+                infile.seek(start)
+                texts[card_id] = infile.read(length).decode(errors="replace")
+        return texts
+
+    def replace_card(
+        self, mcnp_input_filepath: str, block: str, card_id: int | str, text: str
+    ) -> None:
+        """
+        Replaces the card in the MCNP file with the text and updates the saved index.
+        A card of the same length is overwritten in place, otherwise the rest of the
+        file is copied after the new card and the following cards are shifted in
+        the index without scanning the file again.
+        """
+        if not self.matches_deck(mcnp_input_filepath):
+            raise ValueError(
+                f"The index of {mcnp_input_filepath} is outdated, build it again!"
+            )
+        if not text.endswith("\n"):
+            text += "\n"
+        new_card = text.encode()
+        start, length = self._find_or_raise(block, card_id)
+
+        if len(new_card) == length:
+            with open(mcnp_input_filepath, "r+b") as outfile:
+                outfile.seek(start)
+                outfile.write(new_card)
+        else:
+            temporary_filepath = mcnp_input_filepath + ".tmp"
+            with (
+                open(mcnp_input_filepath, "rb") as infile,
+                open(temporary_filepath, "wb") as outfile,
+            ):
+                _copy_bytes(infile, outfile, start)
+                outfile.write(new_card)
+                infile.seek(start + length)
+                shutil.copyfileobj(infile, outfile, COPY_BUFFER_SIZE)
+            os.replace(temporary_filepath, mcnp_input_filepath)
+
+        shift = len(new_card) - length
+        i = self._get_position(block, card_id)
+        self.lengths[i] = len(new_card)
+        if shift:
+            self.starts[i + 1 :] = [offset + shift for offset in self.starts[i + 1 :]]
+
+        # The new text may have another number or name
+        new_id = get_card_id(block, text.splitlines(keepends=True))
+        if new_id is not None and new_id != self.card_ids[i]:
+            self.card_ids[i] = new_id
+            self.__post_init__()
+
+        stat = os.stat(mcnp_input_filepath)
+        self.deck_size, self.deck_mtime_ns = stat.st_size, stat.st_mtime_ns
+        self.save(mcnp_input_filepath + CARD_INDEX_SUFFIX)
+
+    def _get_position(self, block: str, card_id: int | str) -> int | None:
+        card_id = str(card_id).strip()
+        if block == "data":
+            card_id = card_id.lower().lstrip("*")
+        return self._positions.get((block, card_id))
+
+    def _find_or_raise(self, block: str, card_id: int | str) -> tuple[int, int]:
+        span = self.find(block, card_id)
+        if span is None:
+            raise KeyError(f"There is no {block} card {card_id} in the MCNP file!")
+        return span
+
+
+def get_card_id(block: str, card_lines: list[str]) -> str | None:
+    """
+    Returns the id of a card in the index: the number of a cell or surface card and
+    the name of a data card.
+    """
+    if block == "data":
+        match = DATA_CARD_NAME_PATTERN.match(card_lines[0].lstrip().lower())
+        return match.group(1) if match else None
+    number = mg.get_card_number(card_lines)
+    return None if number is None else str(number)
+
+
+def _copy_bytes(infile, outfile, n_bytes: int) -> None:
+    while n_bytes > 0:
+        chunk = infile.read(min(n_bytes, COPY_BUFFER_SIZE))
+        if not chunk:
+            return
+        outfile.write(chunk)
+        n_bytes -= len(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Prints or replaces single cards of an MCNP input file using an "
+        "index of their positions, which is built the first time and every time the "
+        "file changes."
+    )
+    parser.add_argument("mcnp_input", nargs="?", default=MCNP_INPUT_FILEPATH)
+    parser.add_argument("--block", choices=INDEXED_BLOCKS, default="cell")
+    parser.add_argument(
+        "--card", action="append", default=[], help="id of a card, can be repeated"
+    )
+    parser.add_argument(
+        "--replace",
+        metavar="TEXT_FILE",
+        help="file with the new text of the card given with --card",
+    )
+    args = parser.parse_args()
+
+    index = CardIndex.for_deck(args.mcnp_input)
+    counts = {block: index.blocks.count(block) for block in INDEXED_BLOCKS}
+    print(
+        f"{args.mcnp_input}: {counts['cell']} cells, {counts['surface']} surfaces and "
+        f"{counts['data']} data cards indexed."
+    )
+    if args.replace is not None:
+        if len(args.card) != 1:
+            parser.error("--replace needs exactly one --card")
+        with open(args.replace) as infile:
+            index.replace_card(args.mcnp_input, args.block, args.card[0], infile.read())
+        print(f"The {args.block} card {args.card[0]} was replaced.")
+        return
+    texts = index.read_cards(args.mcnp_input, args.block, args.card)
+    for card_id, text in texts.items():
+        if text is None:
+            print(f"There is no {args.block} card {card_id}.")
+        else:
+            print(text, end="")
+
+
+if __name__ == "__main__":
+    main()
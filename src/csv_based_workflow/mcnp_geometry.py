@@ -0,0 +1,795 @@
+"""
+Parsing of the geometry of MCNP input files: surface cards and the surfaces
+referenced by the cell cards. Used by mcnp_materials_from_csv.py and the tools that
+analyse the decks it produces.
+
+The functions work on the lines of a single card, as grouped by
+mcnp_materials_from_csv.iter_cards, and keep the layout of the text when they
+rewrite it.
+"""
+
+import re
+from collections.abc import Collection, Iterable, Iterator
+from dataclasses import dataclass
+from typing import NamedTuple
+
+import numpy as np
+
+MAX_LINE_LENGTH = 80
+
+COMMENT_LINE_PATTERN = re.compile(r" {0,4}[cC](\s|$)")
+TOKEN_PATTERN = re.compile(r"[():#]|[^\s():#&]+")
+SURFACE_REFERENCE_PATTERN = re.compile(r"([+-]?)(\d+)(\.\d+)?")
+PARAMETER_PATTERN = re.compile(
+    r"(\*?[a-z]+(?::[a-z,/]+)?)\s*=?\s*(\([^)]*\)|[^\s=()]+)"
+)
+# Data cards whose entries are surfaces: surface current and flux tallies (F1, F2,
+# F11...), tally segment surfaces (FSn), surface flagging (SFn) and the surfaces of
+# the surface source write (SSW). The SUR of SDEF is read apart.
+SURFACE_DATA_CARD_PATTERN = re.compile(r"[*+]?f\d*[12]|fs\d+|sf\d+|ssw", re.I)
+SOURCE_SURFACE_PATTERN = re.compile(r"\bsur\s*=?\s*([+-]?\d+)", re.I)
+
+# Number of coefficients of the surfaces supported by evaluate_surface
+EVALUATED_SURFACES = {
+    "P": (4,),
+    "S": (4,),
+    "C/X": (3,),
+    "C/Y": (3,),
+    "C/Z": (3,),
+    "K/X": (4, 5),
+    "K/Y": (4, 5),
+    "K/Z": (4, 5),
+    "SQ": (10,),
+    "GQ": (10,),
+    "TX": (6,),
+    "TY": (6,),
+    "TZ": (6,),
+    "RPP": (6,),
+    "SPH": (4,),
+    "RCC": (7,),
+}
+
+# Surfaces that are a special case of a more general one: mnemonic of the general
+# surface and the function that returns its coefficients
+SURFACE_ALIASES = {
+    "SO": ("S", lambda c: (0, 0, 0, *c)),
+    "SX": ("S", lambda c: (c[0], 0, 0, *c[1:])),
+    "SY": ("S", lambda c: (0, c[0], 0, *c[1:])),
+    "SZ": ("S", lambda c: (0, 0, *c)),
+    "CX": ("C/X", lambda c: (0, 0, *c)),
+    "CY": ("C/Y", lambda c: (0, 0, *c)),
+    "CZ": ("C/Z", lambda c: (0, 0, *c)),
+    "KX": ("K/X", lambda c: (c[0], 0, 0, *c[1:])),
+    "KY": ("K/Y", lambda c: (0, c[0], 0, *c[1:])),
+    "KZ": ("K/Z", lambda c: (0, 0, *c)),
+    "PX": ("P", lambda c: (1, 0, 0, *c)),
+    "PY": ("P", lambda c: (0, 1, 0, *c)),
+    "PZ": ("P", lambda c: (0, 0, 1, *c)),
+}
+
+
+@dataclass
+class Surface:
+    """
+    Surface card of an MCNP input file. The prefix is "*" for reflecting surfaces,
+    "+" for white boundaries and "" otherwise.
+    """
+
+    number: int
+    mnemonic: str
+    coefficients: tuple[float, ...]
+    transformation: int | None = None
+    prefix: str = ""
+
+
+class GeometryToken(NamedTuple):
+    """
+    Token of the geometry of a cell card and its position in the lines of the card.
+    The kind is "surface", "cell" (complement of a cell, #n) or "operator".
+    """
+
+    line: int
+    start: int
+    end: int
+    text: str
+    kind: str
+
+
+def parse_surface_card(card_lines: Iterable[str]) -> Surface | None:
+    """
+    Returns the surface defined by the card or None if it cannot be read, for
+    example because it uses the nR, nI or nJ shortcuts of MCNP.
+    """
+    tokens = [text for _, _, _, text in _iter_tokens(card_lines)]
+    match = re.fullmatch(r"([*+]?)(\d+)", tokens[0]) if tokens else None
+    if match is None or len(tokens) < 2:
+        return None
+    prefix, number = match.group(1), int(match.group(2))
+
+    transformation = None
+    position = 1
+    if re.fullmatch(r"-?\d+", tokens[1]):
+        transformation = int(tokens[1])
+        position = 2
+    if position >= len(tokens):
+        return None
+    try:
+        coefficients = tuple(float(token) for token in tokens[position + 1 :])
+    except ValueError:
+        return None
+    return Surface(
+        number, tokens[position].upper(), coefficients, transformation, prefix
+    )
+
+
+def get_card_number(card_lines: Iterable[str]) -> int | None:
+    """
+    Returns the number of a cell or surface card.
+    """
+    for _, _, _, text in _iter_tokens(card_lines):
+        match = re.fullmatch(r"[*+]?(\d+)", text)
+        return int(match.group(1)) if match else None
+    return None
+
+
+def get_surface_key(
+    surface: Surface, tolerance: float
+) -> tuple[tuple, int] | None:
+    """
+    Returns a key that is equal for the surfaces that are the same within the
+    tolerance, and the sense of the surface relative to the one described by the key
+    (1 or -1). Planes (and quadrics) whose coefficients are all negated are the same
+    surface with the opposite sense. Returns None for the surfaces that should never
+    be merged: reflecting, white boundary or periodic surfaces and the ones whose
+    coefficients do not match their mnemonic.
+    """
+    if surface.prefix or (surface.transformation or 0) < 0:
+        return None
+    mnemonic, coefficients = surface.mnemonic, surface.coefficients
+    try:
+        if mnemonic in SURFACE_ALIASES:
+            mnemonic, get_coefficients = SURFACE_ALIASES[mnemonic]
+            coefficients = get_coefficients(coefficients)
+    except IndexError:
+        return None
+
+    sense = 1
+    if mnemonic == "P":
+        if len(coefficients) != 4:  # Plane defined by three points
+            return None
+        norm = sum(c**2 for c in coefficients[:3]) ** 0.5
+        if norm == 0:
+            return None
+        sense = _get_sign(coefficients[:3])
+        coefficients = tuple(c * sense / norm for c in coefficients)
+    elif mnemonic == "GQ" or mnemonic == "SQ":
+        # The last three coefficients of a SQ are its center, they are not scaled
+        scaled = 10 if mnemonic == "GQ" else 7
+        if len(coefficients) != 10:
+            return None
+        norm = max(abs(c) for c in coefficients[:scaled])
+        if norm == 0:
+            return None
+        sense = _get_sign(coefficients[:scaled])
+        coefficients = (
+            tuple(c * sense / norm for c in coefficients[:scaled])
+            + coefficients[scaled:]
+        )
+
+    quantized = tuple(round(c / tolerance) for c in coefficients)
+    return (surface.transformation, mnemonic, quantized), sense
+
+
+def _get_sign(coefficients: tuple[float, ...]) -> int:
+    """
+    Returns the sign of the first non zero coefficient.
+    """
+    first = next(c for c in coefficients if c != 0)
+    return 1 if first > 0 else -1
+
+
+def find_duplicate_surfaces(
+    surfaces: Iterable[Surface | None],
+    tolerance: float,
+    kept_surfaces: Collection[int] = (),
+) -> dict[int, int]:
+    """
+    Returns a dictionary that maps the number of every duplicated surface to the
+    number of the surface that replaces it, negative if its sense is the opposite.
+    Of every group of equal surfaces the one with the lowest number is kept, as well
+    as the kept_surfaces (e.g. those referenced by the data cards). The surfaces that
+    a periodic surface points to are never merged, nor used to replace others.
+    """
+    surfaces = [surface for surface in surfaces if surface is not None]
+    periodic_partners = {
+        -surface.transformation
+        for surface in surfaces
+        if (surface.transformation or 0) < 0
+    }
+    groups: dict[tuple, list[tuple[int, int]]] = {}
+    for surface in surfaces:
+        if surface.number in periodic_partners:
+            continue
+        key = get_surface_key(surface, tolerance)
+        if key is not None:
+            groups.setdefault(key[0], []).append((surface.number, key[1]))
+
+    replacements = {}
+    for group in groups.values():
+        if len(group) < 2:
+            continue
+        kept_number, kept_sense = min(group)
+        for number, sense in group:
+            if number != kept_number and number not in kept_surfaces:
+                replacements[number] = kept_number * sense * kept_sense
+    return replacements
+
+
+def iter_cell_geometry(card_lines: list[str]) -> Iterator[GeometryToken]:
+    """
+    Yields the tokens of the geometry of a cell card: the surfaces, the complemented
+    cells and the operators (parentheses, ":" and "#"). Nothing is yielded for
+    LIKE n BUT cards.
+    """
+    return _iter_geometry_tokens(_iter_tokens(card_lines))
+
+
+def _iter_geometry_tokens(
+    tokens: Iterator[tuple[int, int, int, str]],
+) -> Iterator[GeometryToken]:
+    next(tokens, None)  # cell id
+    material = next(tokens, None)
+    if material is None or material[3].lower() == "like":
+        return
+    if material[3] != "0":
+        next(tokens, None)  # density
+
+    previous = None
+    for line, start, end, text in tokens:
+        if text in ("(", ")", ":", "#"):
+            kind = "operator"
+        elif SURFACE_REFERENCE_PATTERN.fullmatch(text):
+            complement = previous is not None and previous.text == "#"
+            kind = "cell" if complement else "surface"
+        else:  # First cell parameter
+            return
+        previous = GeometryToken(line, start, end, text, kind)
+        yield previous
+
+
+def get_cell_surfaces(card_lines: list[str]) -> list[int]:
+    """
+    Returns the numbers of the surfaces referenced by the geometry of a cell card.
+    """
+    return [
+        int(SURFACE_REFERENCE_PATTERN.fullmatch(token.text).group(2))
+        for token in iter_cell_geometry(card_lines)
+        if token.kind == "surface"
+    ]
+
+
+def get_data_card_surfaces(card_lines: list[str]) -> set[int]:
+    """
+    Returns the numbers of the surfaces referenced by a data card, e.g. the surfaces
+    of an F2 tally or the SUR of SDEF. Surfaces given through a distribution of the
+    source (SUR=Dn) are not returned.
+    """
+    texts = [text for _, _, _, text in _iter_tokens(card_lines)]
+    if not texts:
+        return set()
+    if texts[0].lower() == "sdef":
+        match = SOURCE_SURFACE_PATTERN.search(" ".join(texts[1:]))
+        return {abs(int(match.group(1)))} if match else set()
+    if not SURFACE_DATA_CARD_PATTERN.fullmatch(texts[0]):
+        return set()
+    surfaces = set()
+    for text in texts[1:]:
+        match = SURFACE_REFERENCE_PATTERN.fullmatch(text)
+        if match is not None:
+            surfaces.add(int(match.group(2)))
+    return surfaces
+
+
+def get_cell_parameters(card_lines: list[str]) -> dict[str, str]:
+    """
+    Returns the parameters of a cell card (e.g. {"imp:n": "1", "u": "2"}) with their
+    names in lower case. Only the first value of each parameter is returned.
+    """
+    tokens = list(_iter_tokens(card_lines))
+    n_geometry_tokens = sum(1 for _ in _iter_geometry_tokens(iter(tokens)))
+    return _get_cell_parameters(card_lines, tokens, n_geometry_tokens)
+
+
+def _get_cell_parameters(
+    card_lines: list[str],
+    tokens: list[tuple[int, int, int, str]],
+    n_geometry_tokens: int,
+) -> dict[str, str]:
+    texts = [token[3].lower() for token in tokens]
+    if len(texts) > 1 and texts[1] == "like":
+        start = texts.index("but") + 1 if "but" in texts else len(texts)
+    else:
+        header = 2 if len(texts) > 1 and texts[1] == "0" else 3
+        start = header + n_geometry_tokens
+    if start >= len(tokens):
+        return {}
+
+    line, column = tokens[start][:2]
+    code = [card_lines[line].split("$", 1)[0][column:]]
+    for following_line in card_lines[line + 1 :]:
+        if not COMMENT_LINE_PATTERN.match(following_line):
+            code.append(following_line.split("$", 1)[0])
+    text = " ".join(code).replace("&", " ").lower()
+    parameters = {}
+    for match in PARAMETER_PATTERN.finditer(text):
+        parameters.setdefault(match.group(1), match.group(2))
+    return parameters
+
+
+class GeometryNode(NamedTuple):
+    """
+    Node of the Boolean expression of the geometry of a cell. The kind is "surface"
+    (the number has the sign of the sense and facet is the facet of a macrobody, 0
+    for the whole body), "cell" (the region of another cell, for complements), "and",
+    "or" or "not" (complement of its only child).
+    """
+
+    kind: str
+    number: int = 0
+    children: tuple["GeometryNode", ...] = ()
+    facet: int = 0
+
+
+def parse_cell_geometry(tokens: list[GeometryToken]) -> GeometryNode | None:
+    """
+    Returns the Boolean expression of the geometry tokens of a cell, as given by
+    iter_cell_geometry, or None if there are no tokens. Union has the lowest
+    precedence, then intersection and then complement.
+    """
+    if not tokens:
+        return None
+    node, position = _parse_union(tokens, 0)
+    if position < len(tokens):
+        raise ValueError(f"Unbalanced parenthesis in line {tokens[position].line}!")
+    return node
+
+
+def _parse_union(
+    tokens: list[GeometryToken], position: int
+) -> tuple[GeometryNode, int]:
+    node, position = _parse_intersection(tokens, position)
+    terms = [node]
+    while position < len(tokens) and tokens[position].text == ":":
+        node, position = _parse_intersection(tokens, position + 1)
+        terms.append(node)
+    return _combine("or", terms), position
+
+
+def _parse_intersection(
+    tokens: list[GeometryToken], position: int
+) -> tuple[GeometryNode, int]:
+    factors = []
+    while position < len(tokens) and tokens[position].text not in (":", ")"):
+        node, position = _parse_factor(tokens, position)
+        factors.append(node)
+    return _combine("and", factors), position
+
+
+def _parse_factor(
+    tokens: list[GeometryToken], position: int
+) -> tuple[GeometryNode, int]:
+    if position >= len(tokens):
+        raise ValueError("Incomplete cell geometry!")
+    token = tokens[position]
+    if token.text == "#":
+        node, position = _parse_factor(tokens, position + 1)
+        return GeometryNode("not", children=(node,)), position
+    if token.text == "(":
+        node, position = _parse_union(tokens, position + 1)
+        return node, position + 1  # closing parenthesis
+    if token.kind == "cell":
+        return GeometryNode("cell", int(token.text)), position + 1
+    sign, number, facet = SURFACE_REFERENCE_PATTERN.fullmatch(token.text).groups()
+    number = -int(number) if sign == "-" else int(number)
+    node = GeometryNode("surface", number, facet=int(facet[1:]) if facet else 0)
+    return node, position + 1
+
+
+def _combine(kind: str, nodes: list[GeometryNode]) -> GeometryNode:
+    if not nodes:
+        raise ValueError("Empty term in a cell geometry!")
+    return nodes[0] if len(nodes) == 1 else GeometryNode(kind, children=tuple(nodes))
+
+
+def get_geometry_depth(node: GeometryNode | None) -> int:
+    """
+    Returns the depth of the Boolean expression of the geometry of a cell: 0 for a
+    single surface, 1 for an intersection or union of surfaces, 2 for a union of
+    intersections... Complements add a level too.
+    """
+    if node is None or not node.children:
+        return 0
+    return 1 + max(get_geometry_depth(child) for child in node.children)
+
+
+def renumber_cell_surfaces(
+    card_lines: list[str], replacements: dict[int, int]
+) -> list[str]:
+    """
+    Returns the lines of the cell card with the surfaces of its geometry replaced as
+    given by find_duplicate_surfaces. The lines that become too long are split.
+    """
+    changes: dict[int, list[tuple[int, int, str]]] = {}
+    for token in iter_cell_geometry(card_lines):
+        if token.kind != "surface":
+            continue
+        sign, number, facet = SURFACE_REFERENCE_PATTERN.fullmatch(token.text).groups()
+        replacement = replacements.get(int(number))
+        if replacement is None:
+            continue
+        if sign == "-":
+            replacement = -replacement
+        new_sign = "-" if replacement < 0 else sign.replace("-", "")
+        text = f"{new_sign}{abs(replacement)}{facet or ''}"
+        changes.setdefault(token.line, []).append((token.start, token.end, text))
+
+    if not changes:
+        return card_lines
+    new_lines = []
+    for i, line in enumerate(card_lines):
+        if i not in changes:
+            new_lines.append(line)
+            continue
+        for start, end, text in reversed(changes[i]):
+            line = line[:start] + text + line[end:]
+        new_lines += _split_long_line(line)
+    return new_lines
+
+
+def intersect_cell_geometry(card_lines: list[str], geometry: str) -> list[str]:
+    """
+    Returns the lines of the cell card with its geometry intersected with the given
+    one, e.g. "(old geometry) 10".
+    """
+    tokens = list(iter_cell_geometry(card_lines))
+    if not tokens:
+        raise ValueError("The cell card has no geometry to intersect!")
+    first, last = tokens[0], tokens[-1]
+    lines = list(card_lines)
+    line = lines[last.line]
+    lines[last.line] = f"{line[: last.end]}) {geometry}{line[last.end :]}"
+    line = lines[first.line]
+    lines[first.line] = f"{line[: first.start]}({line[first.start :]}"
+    new_lines = []
+    for i, line in enumerate(lines):
+        changed = i == first.line or i == last.line
+        new_lines += _split_long_line(line) if changed else [line]
+    return new_lines
+
+
+def replace_card_number(card_lines: list[str], number: int) -> list[str]:
+    """
+    Returns the lines of the card with its cell or surface number replaced.
+    """
+    for i, line in enumerate(card_lines):
+        if COMMENT_LINE_PATTERN.match(line):
+            continue
+        match = re.match(r"(\s*[*+]?)(\d+)", line)
+        if match is None:
+            break
+        # Keeps the alignment of the rest of the line when there is room for it
+        rest = line[match.end() :]
+        extra = len(str(number)) - len(match.group(2))
+        if 0 < extra < len(rest) - len(rest.lstrip(" ")):
+            rest = rest[extra:]
+        new_line = f"{match.group(1)}{number}{rest}"
+        return card_lines[:i] + _split_long_line(new_line) + card_lines[i + 1 :]
+    raise ValueError("The card has no number to replace!")
+
+
+def _split_long_line(line: str) -> list[str]:
+    """
+    Splits a line longer than MAX_LINE_LENGTH at a space before the limit, the rest
+    goes to a continuation line (5 leading spaces).
+    """
+    content = line.rstrip("\r\n")
+    if len(content) <= MAX_LINE_LENGTH:
+        return [line]
+    code_end = content.find("$")
+    limit = min(MAX_LINE_LENGTH, code_end if code_end >= 0 else len(content))
+    split = content.rfind(" ", 6, limit)
+    if split < 0 or not content[:split].strip():
+        return [line]
+    newline = line[len(content) :] or "\n"
+    rest = "     " + line[split:].lstrip(" ")
+    return [content[:split] + newline] + _split_long_line(rest)
+
+
+def _iter_tokens(card_lines: Iterable[str]) -> Iterator[tuple[int, int, int, str]]:
+    """
+    Yields the line, start, end and text of the tokens of a card, skipping comment
+    lines, $ comments and the & continuation marks.
+    """
+    for i, line in enumerate(card_lines):
+        if COMMENT_LINE_PATTERN.match(line):
+            continue
+        code = line.split("$", 1)[0]
+        for match in TOKEN_PATTERN.finditer(code):
+            yield i, match.start(), match.end(), match.group()
+
+
+def evaluate_surface(surface: Surface, points: np.ndarray) -> np.ndarray:
+    """
+    Returns the value of the equation of the surface at the points (an n x 3 array),
+    negative on the side of the negative sense. Raises ValueError for the surfaces
+    that are not supported: planes defined by points and macrobodies other than RPP,
+    SPH and RCC.
+    """
+    mnemonic, c = _get_general_form(surface)
+    x, y, z = points[:, 0], points[:, 1], points[:, 2]
+    if mnemonic == "P":
+        return c[0] * x + c[1] * y + c[2] * z - c[3]
+    if mnemonic in ("S", "SPH"):
+        return (x - c[0]) ** 2 + (y - c[1]) ** 2 + (z - c[2]) ** 2 - c[3] ** 2
+    if mnemonic == "GQ":
+        return (
+            c[0] * x**2
+            + c[1] * y**2
+            + c[2] * z**2
+            + c[3] * x * y
+            + c[4] * y * z
+            + c[5] * z * x
+            + c[6] * x
+            + c[7] * y
+            + c[8] * z
+            + c[9]
+        )
+    if mnemonic == "SQ":
+        dx, dy, dz = x - c[7], y - c[8], z - c[9]
+        return (
+            c[0] * dx**2
+            + c[1] * dy**2
+            + c[2] * dz**2
+            + 2 * (c[3] * dx + c[4] * dy + c[5] * dz)
+            + c[6]
+        )
+    if mnemonic == "RPP":
+        return np.maximum.reduce(
+            [c[0] - x, x - c[1], c[2] - y, y - c[3], c[4] - z, z - c[5]]
+        )
+    if mnemonic == "RCC":
+        base, height, radius = np.array(c[:3]), np.array(c[3:6]), c[6]
+        relative = points - base
+        t = relative @ height / (height @ height)
+        radial = np.linalg.norm(relative - np.outer(t, height), axis=1)
+        length = np.linalg.norm(height)
+        return np.maximum.reduce([-t * length, (t - 1) * length, radial - radius])
+
+    axis = "XYZ".index(mnemonic[-1])
+    axial = points[:, axis] - c[axis] if mnemonic[0] != "C" else None
+    u_axis, v_axis = [i for i in range(3) if i != axis]
+    if mnemonic[0] == "C":  # C/X: center in the other two axes and radius
+        u, v = points[:, u_axis] - c[0], points[:, v_axis] - c[1]
+        return u**2 + v**2 - c[2] ** 2
+    u, v = points[:, u_axis] - c[u_axis], points[:, v_axis] - c[v_axis]
+    if mnemonic[0] == "K":  # K/X: vertex, t squared and optional sheet
+        values = u**2 + v**2 - c[3] * axial**2
+        sheet = c[4] if len(c) > 4 else 0
+        if sheet:  # Points in the other sheet are outside
+            values = np.where(axial * sheet >= 0, values, 1.0)
+        return values
+    # Torus: center, major radius and axial and radial minor radii
+    radial = np.sqrt(u**2 + v**2) - c[3]
+    return axial**2 / c[4] ** 2 + radial**2 / c[5] ** 2 - 1
+
+
+def get_surface_bounds(surface: Surface, sense: int) -> np.ndarray:
+    """
+    Returns the axis-aligned box (2 x 3 array with the minimum and maximum corners)
+    that contains the side of the surface given by the sense. The sides that are
+    not bounded, or whose bounds are not computed, have infinite limits.
+    """
+    bounds = np.array([[-np.inf] * 3, [np.inf] * 3])
+    try:
+        mnemonic, c = _get_general_form(surface)
+    except ValueError:
+        return bounds
+
+    if mnemonic == "P":
+        normal = np.array(c[:3], dtype=float)
+        axes = np.flatnonzero(normal)
+        if len(axes) == 1:
+            axis = axes[0]
+            limit = c[3] / normal[axis]
+            bounds[0 if sense * normal[axis] > 0 else 1, axis] = limit
+        return bounds
+    if sense > 0:
+        return bounds
+
+    if mnemonic in ("S", "SPH"):
+        center = np.array(c[:3], dtype=float)
+        return np.array([center - c[3], center + c[3]])
+    if mnemonic == "RPP":
+        return np.array([c[0::2], c[1::2]], dtype=float)
+    if mnemonic == "RCC":
+        ends = np.array([c[:3], np.add(c[:3], c[3:6])], dtype=float)
+        return np.array([ends.min(axis=0) - c[6], ends.max(axis=0) + c[6]])
+    if mnemonic[:2] in ("C/", "TX", "TY", "TZ"):
+        axis = "XYZ".index(mnemonic[-1])
+        others = [i for i in range(3) if i != axis]
+        if mnemonic[0] == "C":
+            center, radius = c[:2], c[2]
+        else:
+            center, radius = [c[i] for i in others], c[3] + c[5]
+            bounds[:, axis] = c[axis] - c[4], c[axis] + c[4]
+        bounds[0, others] = np.subtract(center, radius)
+        bounds[1, others] = np.add(center, radius)
+    return bounds
+
+
+def _get_general_form(surface: Surface) -> tuple[str, tuple[float, ...]]:
+    mnemonic, coefficients = surface.mnemonic, surface.coefficients
+    if surface.transformation:
+        raise ValueError(f"Surface {surface.number} has a transformation!")
+    if mnemonic in SURFACE_ALIASES:
+        mnemonic, get_coefficients = SURFACE_ALIASES[mnemonic]
+        coefficients = get_coefficients(coefficients)
+    expected = EVALUATED_SURFACES.get(mnemonic)
+    if expected is None or len(coefficients) not in expected:
+        raise ValueError(f"Surface {surface.number} ({mnemonic}) is not supported!")
+    return mnemonic, coefficients
+
+
+class Geometry:
+    """
+    Surfaces and cells of an MCNP input file that can be evaluated on arrays of
+    points with NumPy, to sample them without running MCNP. Transformations,
+    macrobody facets and LIKE n BUT cards with TRCL are not supported, the cells
+    that use them raise ValueError when evaluated.
+    """
+
+    def __init__(self):
+        self.surfaces: dict[int, Surface] = {}
+        self.cells: dict[int, GeometryNode | None] = {}
+        self.cell_parameters: dict[int, dict[str, str]] = {}
+        self.cell_materials: dict[int, int | None] = {}
+        self.like_cells: dict[int, int] = {}  # Cell copied by each LIKE n BUT card
+        self._surface_bounds: dict[int, np.ndarray] = {}
+
+    @classmethod
+    def from_cards(cls, cards: Iterable[tuple[str, list[str]]]) -> "Geometry":
+        """
+        Reads the cards as yielded by mcnp_materials_from_csv.iter_cards.
+        """
+        geometry = cls()
+        for block, card_lines in cards:
+            if block == "surface":
+                surface = parse_surface_card(card_lines)
+                if surface is not None:
+                    geometry.surfaces[surface.number] = surface
+            elif block == "cell":
+                geometry.add_cell(card_lines)
+        return geometry
+
+    def add_cell(self, card_lines: list[str]) -> None:
+        number = get_card_number(card_lines)
+        if number is None:
+            return
+        # The card is split in tokens once for the geometry and the parameters
+        card_tokens = list(_iter_tokens(card_lines))
+        geometry_tokens = list(_iter_geometry_tokens(iter(card_tokens)))
+        parameters = _get_cell_parameters(
+            card_lines, card_tokens, len(geometry_tokens)
+        )
+        tokens = [token[3].lower() for token in card_tokens]
+        node = None
+        if len(tokens) > 2 and tokens[1] == "like":
+            self.like_cells[number] = int(tokens[2])
+            if "trcl" not in parameters and "*trcl" not in parameters:
+                node = GeometryNode("cell", int(tokens[2]))
+            material = parameters.get("mat", self.cell_materials.get(int(tokens[2])))
+        else:
+            if "trcl" not in parameters and "*trcl" not in parameters:
+                node = parse_cell_geometry(geometry_tokens)
+            material = tokens[1] if len(tokens) > 1 and tokens[1].isdigit() else None
+        self.cells[number] = node
+        self.cell_parameters[number] = parameters
+        self.cell_materials[number] = None if material is None else int(material)
+
+    def contains(self, cell_id: int, points: np.ndarray) -> np.ndarray:
+        """
+        Returns a boolean array that is True for the points inside the cell.
+        """
+        return self._evaluate(self._get_node(cell_id), points, {})
+
+    def _get_node(self, cell_id: int) -> GeometryNode:
+        node = self.cells.get(cell_id)
+        if node is None:
+            raise ValueError(f"The geometry of cell {cell_id} is not supported!")
+        return node
+
+    def _evaluate(
+        self, node: GeometryNode, points: np.ndarray, senses: dict[int, np.ndarray]
+    ) -> np.ndarray:
+        if node.kind == "surface":
+            if node.facet:
+                raise ValueError("Macrobody facets are not supported!")
+            number = abs(node.number)
+            if number not in senses:
+                surface = self.surfaces.get(number)
+                if surface is None:
+                    raise ValueError(f"Surface {number} is not defined!")
+                senses[number] = evaluate_surface(surface, points) > 0
+            return senses[number] if node.number > 0 else ~senses[number]
+        if node.kind == "cell":
+            return self._evaluate(self._get_node(node.number), points, senses)
+        if node.kind == "not":
+            return ~self._evaluate(node.children[0], points, senses)
+        values = [self._evaluate(child, points, senses) for child in node.children]
+        if node.kind == "and":
+            return np.logical_and.reduce(values)
+        return np.logical_or.reduce(values)
+
+    def get_bounds(self, cell_id: int) -> np.ndarray:
+        """
+        Returns an axis-aligned box that contains the cell, computed from the
+        surfaces of its geometry. The limits that cannot be computed are infinite.
+        """
+        return self._get_node_bounds(self._get_node(cell_id))
+
+    def _get_node_bounds(self, node: GeometryNode) -> np.ndarray:
+        unbounded = np.array([[-np.inf] * 3, [np.inf] * 3])
+        if node.kind == "surface":
+            surface = self.surfaces.get(abs(node.number))
+            if surface is None or node.facet:
+                return unbounded
+            # Most surfaces are shared by several cells
+            if node.number not in self._surface_bounds:
+                self._surface_bounds[node.number] = get_surface_bounds(
+                    surface, 1 if node.number > 0 else -1
+                )
+            return self._surface_bounds[node.number]
+        if node.kind == "cell":
+            child = self.cells.get(node.number)
+            return unbounded if child is None else self._get_node_bounds(child)
+        if node.kind == "not":
+            return unbounded
+        bounds = np.array([self._get_node_bounds(child) for child in node.children])
+        if node.kind == "and":
+            return np.array([bounds[:, 0].max(axis=0), bounds[:, 1].min(axis=0)])
+        return np.array([bounds[:, 0].min(axis=0), bounds[:, 1].max(axis=0)])
+
+    def get_world_bounds(self) -> np.ndarray:
+        """
+        Returns the axis-aligned box that contains all the finite surfaces and axis
+        planes of the geometry, usually the sphere of the graveyard.
+        """
+        limits = np.array(
+            [
+                get_surface_bounds(surface, sense)
+                for surface in self.surfaces.values()
+                for sense in (-1, 1)
+            ]
+        ).reshape(-1, 3)
+        limits = np.where(np.isfinite(limits), limits, np.nan)
+        if np.isnan(limits).all(axis=0).any():
+            raise ValueError("The extent of the geometry cannot be found!")
+        return np.array([np.nanmin(limits, axis=0), np.nanmax(limits, axis=0)])
+
+    def sample_bounds(
+        self,
+        cell_id: int,
+        region: np.ndarray,
+        n_samples: int,
+        rng: np.random.Generator,
+    ) -> np.ndarray | None:
+        """
+        Returns the box that contains the points of the cell among n_samples random
+        points in the region (a finite box), or None if none of them is in the cell.
+        The box may be smaller than the cell, it should be enlarged by a margin.
+        """
+        points = rng.uniform(region[0], region[1], size=(n_samples, 3))
+        inside = points[self.contains(cell_id, points)]
+        if len(inside) == 0:
+            return None
+        return np.array([inside.min(axis=0), inside.max(axis=0)])
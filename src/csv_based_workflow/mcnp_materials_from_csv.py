@@ -1,14 +1,81 @@
+import argparse
+import asyncio
+import copy
+import csv
+import filecmp
+import glob
+import hashlib
+import heapq
+import io
+import json
+import mmap
+import os
 import re
-from dataclasses import dataclass
-from math import isclose
+import shutil
+import time
+import tracemalloc
+from bisect import bisect_right
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from dataclasses import dataclass, field, replace
+from itertools import chain, islice
 
+import numpy as np
 import pandas as pd
 from numjuggler import parser as mp
 
+import mcnp_geometry as mg
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 MCNP_INPUT_FILEPATH = "testing.mcnp"
 CSV_FILEPATH = "testing.csv"
 MATERIAL_IDS_FILEPATH = "material_ids.csv"
+MATERIAL_LIBRARY_FILEPATH = None  # File with the M and MT cards of the materials
 FIRST_CELL_ID = 1
+STREAMING = False  # Read, rewrite and strip the comments of the deck in a single pass
+PROCESSES = 1  # More than 1 splits the cell block among a pool of processes
+MEMORY_MAP = False  # Scan the deck memory-mapped, cards not modified are copied as is
+INCREMENTAL = False  # Only regenerate the cards whose csv component or card changed
+STATS = False  # Write the time, memory and counters of each stage to a JSON file
+DEDUPLICATE_SURFACES = False  # Remove the surfaces equal to another one
+SPLIT_ASSEMBLIES = False  # Write the cells of each assembly in a READ include file
+ASSEMBLY_LEVEL = "Level 1"  # Column of the csv with the assemblies of SPLIT_ASSEMBLIES
+
+PARALLEL_CHUNK_SIZE = 8 * 1024**2  # Bytes of the cell block processed by each task
+WATCH_INTERVAL = 0.2  # Seconds between checks of the csv and MCNP files in watch mode
+SURFACE_TOLERANCE = 1e-6  # Two surfaces are equal if their coefficients differ less
+
+GEOUNED_COMMENT_PATTERN = re.compile(r"^\s*\$")
+CELL_ID_PATTERN = re.compile(r"\s*(\d+)\s")
+CELL_ID_BYTES_PATTERN = re.compile(rb"\s*(\d+)\s")
+LINE_HEAD_SIZE = 128  # Bytes of a mapped line needed to know its role in the card
+# Lines of a memory-mapped deck, with the same rules as iter_block_cards: the tabs
+# before the fifth column make a continuation line
+_BLANK_LINE = rb"[ \t\r\f\v]*\n|[ \t\r\f\v]+\Z"
+_GEOUNED_LINE = rb"[ \t\r\f\v]*\$[^\n]*\n?"
+_CONTINUATION_LINE = rb"(?: {5}| {0,4}\t)[ \t\r\f\v]*[^\s$][^\n]*\n?"
+_COMMENT_LINE = rb" {0,4}[cC](?:[ \t\r\f\v][^\n]*)?(?:\n|\Z)"
+MAPPED_LINE_BYTES_PATTERN = re.compile(
+    rb"(?P<blank>%s)|(?P<geouned>%s)|(?P<continuation>%s)|(?P<comment>%s)"
+    rb"|(?P<card>[^\n]+\n?)"
+    % (_BLANK_LINE, _GEOUNED_LINE, _CONTINUATION_LINE, _COMMENT_LINE)
+)
+# Continuation lines of a card and the comments among them
+MAPPED_CARD_TAIL_BYTES_PATTERN = re.compile(
+    rb"(?:(?:%s|%s)*%s)*" % (_COMMENT_LINE, _GEOUNED_LINE, _CONTINUATION_LINE)
+)
+DECK_BLOCKS = ("cell", "surface", "data")
+BLANK_LINE_BYTES_PATTERN = re.compile(rb"^[ \t\r]*\n", re.MULTILINE)
+MATERIAL_CARD_PATTERN = re.compile(r"(\s*\*?)(m|mt|mx|mpn)(\d+)(?=\s)", re.IGNORECASE)
+MATERIAL_LIBRARY_INDEX_SUFFIX = ".index.json"
+INCLUDE_NAME_PATTERN = re.compile(r"[^\w.-]+")
 
 
 @dataclass
@@ -20,7 +87,383 @@ class InputData:
     mcnp_input_filepath: str = MCNP_INPUT_FILEPATH
     csv_filepath: str = CSV_FILEPATH
     material_ids_filpath: str = MATERIAL_IDS_FILEPATH
+    material_library_filepath: str | None = MATERIAL_LIBRARY_FILEPATH
     first_cell_id: int = FIRST_CELL_ID
+    streaming: bool = STREAMING
+    processes: int = PROCESSES
+    memory_map: bool = MEMORY_MAP
+    incremental: bool = INCREMENTAL
+    stats: bool = STATS
+    deduplicate_surfaces: bool = DEDUPLICATE_SURFACES
+    split_assemblies: bool = SPLIT_ASSEMBLIES
+    assembly_level: str = ASSEMBLY_LEVEL
+
+    @property
+    def output_filepath(self) -> str:
+        return self.mcnp_input_filepath + "[materials_added]"
+
+    def get_include_filepath(self, assembly: str) -> str:
+        # MCNP reads the file name until the first space
+        name = INCLUDE_NAME_PATTERN.sub("_", assembly)
+        return self.output_filepath + f".{name}.cells"
+
+    @property
+    def stats_filepath(self) -> str:
+        return self.output_filepath + ".stats.json"
+
+    @property
+    def manifest_filepath(self) -> str:
+        return self.output_filepath + ".manifest.json"
+
+
+@dataclass
+class DeckManifest:
+    """
+    Record of a run of write_mcnp_with_materials_incremental. The cards are stored
+    column by column: block, position in the input and output files, hash of the
+    input text and, for cell cards, the cell id, the csv component and the hash of
+    the header it received. components holds the header hash of every component.
+    The size, modification time and hash of the output file are recorded too, as
+    the cards are copied from it in the next run.
+    """
+
+    deck_size: int = -1
+    deck_mtime_ns: int = -1
+    output_size: int = -1
+    output_mtime_ns: int = -1
+    output_hash: str = ""
+    blocks: list[str] = field(default_factory=list)
+    input_starts: list[int] = field(default_factory=list)
+    input_ends: list[int] = field(default_factory=list)
+    output_starts: list[int] = field(default_factory=list)
+    output_ends: list[int] = field(default_factory=list)
+    card_hashes: list[str] = field(default_factory=list)
+    cell_ids: list[int | None] = field(default_factory=list)
+    component_ids: list[str | None] = field(default_factory=list)
+    header_hashes: list[str | None] = field(default_factory=list)
+    components: dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, manifest_filepath: str) -> "DeckManifest | None":
+        try:
+            with open(manifest_filepath) as infile:
+                return cls(**json.load(infile))
+        except (FileNotFoundError, json.JSONDecodeError, TypeError):
+            return None
+
+    def save(self, manifest_filepath: str) -> None:
+        # vars instead of asdict, which would deep copy every column
+        with open(manifest_filepath, "w") as outfile:
+            json.dump(vars(self), outfile)
+
+    def matches_deck(self, mcnp_input_filepath: str) -> bool:
+        stat = os.stat(mcnp_input_filepath)
+        return (stat.st_size, stat.st_mtime_ns) == (self.deck_size, self.deck_mtime_ns)
+
+    def record_output(self, output_filepath: str) -> None:
+        stat = os.stat(output_filepath)
+        self.output_size, self.output_mtime_ns = stat.st_size, stat.st_mtime_ns
+        self.output_hash = _hash_file(output_filepath)
+
+    def matches_output(self, output_filepath: str) -> bool:
+        """
+        Returns whether the output file is the one written by the run of the
+        manifest, i.e. it was not overwritten by another mode or edited since.
+        """
+        signature = _get_file_signature(output_filepath)
+        if signature != (self.output_size, self.output_mtime_ns):
+            return False
+        return _hash_file(output_filepath) == self.output_hash
+
+    def add_card(
+        self,
+        block: str,
+        input_span: tuple[int, int],
+        output_span: tuple[int, int],
+        card_hash: str,
+        cell_id: int | None = None,
+        component_id: str | None = None,
+        header_hash: str | None = None,
+    ) -> None:
+        self.blocks.append(block)
+        self.input_starts.append(input_span[0])
+        self.input_ends.append(input_span[1])
+        self.output_starts.append(output_span[0])
+        self.output_ends.append(output_span[1])
+        self.card_hashes.append(card_hash)
+        self.cell_ids.append(cell_id)
+        self.component_ids.append(component_id)
+        self.header_hashes.append(header_hash)
+
+
+class MaterialIdRegistry:
+    """
+    Material ids by material name, backed by the material ids csv. A new material
+    gets the next free id (the largest one + 1, kept up to date, and never 0 as it
+    is the id of Void) and is appended to the csv at once, while the csv is locked.
+    Runs on other decks at the same time read the rows appended by the others before
+    assigning a new id, so all of them agree on the ids. Only the part of the csv
+    appended since the last read is read.
+
+    Without a file (invalid material ids csv) the ids are only kept in memory.
+    """
+
+    def __init__(self, filepath: str | None, ids: dict[str, int] | None = None):
+        self.filepath = filepath
+        self.ids = {"Void": 0} if ids is None else ids
+        self.next_id = max(self.ids.values(), default=0) + 1
+        self._columns: list[str] = ["MATERIAL", "ID"]
+        self._read_size = 0
+
+    @classmethod
+    def from_csv(cls, filepath: str) -> "MaterialIdRegistry":
+        registry = cls(filepath, {})
+        with _locked(filepath):
+            registry._read_new_rows()
+        return registry
+
+    def __contains__(self, material_name: str) -> bool:
+        return material_name in self.ids
+
+    def __getitem__(self, material_name: str) -> int:
+        return self.ids[material_name]
+
+    def get_id(self, material_name: str) -> int:
+        """
+        Returns the id of the material, assigning a new one if it has none.
+        """
+        material_id = self.ids.get(material_name)
+        if material_id is None:
+            self.allocate([material_name])
+            material_id = self.ids[material_name]
+        return material_id
+
+    def allocate(self, material_names: Iterable[str]) -> None:
+        """
+        Assigns ids to the materials that have none, in the given order, locking
+        the csv once for all of them.
+        """
+        new_names = [name for name in dict.fromkeys(material_names) if name not in self]
+        if not new_names:
+            return
+        if self.filepath is None:
+            for material_name in new_names:
+                self._add(material_name, self.next_id)
+            return
+
+        with _locked(self.filepath):
+            self._read_new_rows()
+            new_rows = []
+            for material_name in new_names:
+                if material_name not in self:  # Assigned by another run
+                    new_rows.append((material_name, self.next_id))
+                    self._add(material_name, self.next_id)
+            self._append_rows(new_rows)
+
+    def _add(self, material_name: str, material_id: int) -> None:
+        self.ids[material_name] = material_id
+        self.next_id = max(self.next_id, material_id + 1)
+
+    def _read_new_rows(self) -> None:
+        size = os.path.getsize(self.filepath) if os.path.exists(self.filepath) else 0
+        if size == self._read_size:
+            return
+        if size < self._read_size:  # Rewritten by someone else, read from the start
+            self._read_size = 0
+        with open(self.filepath, "rb") as infile:
+            infile.seek(self._read_size)
+            text = infile.read(size - self._read_size).decode()
+        rows = csv.reader(io.StringIO(text))
+        if self._read_size == 0:
+            self._columns = next(rows, ["MATERIAL", "ID"])
+        name_column = self._columns.index("MATERIAL")
+        id_column = self._columns.index("ID") if "ID" in self._columns else None
+        if id_column is None:
+            raise KeyError("ID")
+        for row in rows:
+            if row:
+                self._add(row[name_column], int(row[id_column]))
+        self._read_size = size
+
+    def _append_rows(self, rows: list[tuple[str, int]]) -> None:
+        if self._read_size == 0:  # New file, the ids assigned so far are written too
+            rows = list(self.ids.items())
+        lines = io.StringIO()
+        writer = csv.writer(lines, lineterminator="\n")
+        if self._read_size == 0:
+            writer.writerow(self._columns)
+        for material_name, material_id in rows:
+            row = [""] * len(self._columns)
+            row[self._columns.index("MATERIAL")] = material_name
+            row[self._columns.index("ID")] = material_id
+            writer.writerow(row)
+
+        with open(self.filepath, "ab+") as outfile:
+            if self._read_size > 0:
+                outfile.seek(self._read_size - 1)
+                if outfile.read(1) != b"\n":
+                    outfile.write(b"\n")
+            outfile.write(lines.getvalue().encode())
+            self._read_size = outfile.tell()
+
+
+@contextmanager
+def _locked(filepath: str) -> Iterator[None]:
+    """
+    Holds an exclusive lock on a file next to the given one, with the .lock suffix,
+    so only one process at a time reads and writes the file. The operating system
+    releases the lock if the process dies.
+    """
+    with open(filepath + ".lock", "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after 10 seconds
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@dataclass
+class MaterialLibrary:
+    """
+    Index of a file with the M, MT, MX and MPN cards of many materials, so only the
+    cards of the employed materials are read. The name of a material is the $
+    comment of its M card or, if there is none, the comment line just before it,
+    e.g. "c 316L". The MT, MX and MPN cards with the same number belong to the same
+    material. Names are compared without case and surrounding spaces.
+
+    The position in bytes of the cards is saved next to the library with the suffix
+    .index.json and built again when the size or modification time of the library
+    change.
+    """
+
+    library_size: int = -1
+    library_mtime_ns: int = -1
+    names: list[str] = field(default_factory=list)
+    starts: list[int] = field(default_factory=list)
+    lengths: list[int] = field(default_factory=list)
+
+    def __post_init__(self):
+        self._spans: dict[str, list[tuple[int, int]]] = {}
+        for name, start, length in zip(self.names, self.starts, self.lengths):
+            self._spans.setdefault(name, []).append((start, length))
+
+    @classmethod
+    def build(cls, library_filepath: str) -> "MaterialLibrary":
+        stat = os.stat(library_filepath)
+        library = cls(stat.st_size, stat.st_mtime_ns)
+        if stat.st_size == 0:
+            return library
+        cards = []  # Number, whether it is the M card, name and span of each card
+        with (
+            open(library_filepath, "rb") as infile,
+            mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as deck,
+        ):
+            comment_name = None
+            lines = (line for line in iter_mapped_lines(deck) if line.strip())
+            for block, card_lines in iter_block_cards(lines, "data"):
+                if block == "comment":
+                    comment_name = card_lines[-1].strip()[1:].strip()
+                    continue
+                first_line = card_lines[0]
+                match = MATERIAL_CARD_PATTERN.match(first_line)
+                if match is not None:
+                    text = deck[first_line.start : first_line.end].decode(
+                        errors="replace"
+                    )
+                    name = text.split("$", 1)[1] if "$" in text else comment_name
+                    span = (first_line.start, card_lines[-1].end)
+                    is_m_card = match.group(2).lower() == "m"
+                    cards.append((int(match.group(3)), is_m_card, name, span))
+                comment_name = None
+
+        names = {
+            number: _normalize_material_name(name)
+            for number, is_m_card, name, _ in cards
+            if is_m_card and name
+        }
+        # The M card first, then the rest in the order of the library
+        for number, _, _, (start, end) in sorted(cards, key=lambda card: not card[1]):
+            if number in names:
+                library.names.append(names[number])
+                library.starts.append(start)
+                library.lengths.append(end - start)
+        library.__post_init__()
+        return library
+
+    @classmethod
+    def load(cls, index_filepath: str) -> "MaterialLibrary | None":
+        try:
+            with open(index_filepath) as infile:
+                return cls(**json.load(infile))
+        except (FileNotFoundError, json.JSONDecodeError, TypeError):
+            return None
+
+    @classmethod
+    def for_library(cls, library_filepath: str) -> "MaterialLibrary":
+        """
+        Returns the saved index of the library, or builds and saves a new one if
+        there is none or the library changed since it was built.
+        """
+        index_filepath = library_filepath + MATERIAL_LIBRARY_INDEX_SUFFIX
+        library = cls.load(index_filepath)
+        if library is None or not library.matches_library(library_filepath):
+            library = cls.build(library_filepath)
+            library.save(index_filepath)
+        return library
+
+    def save(self, index_filepath: str) -> None:
+        columns = {
+            key: value for key, value in vars(self).items() if not key.startswith("_")
+        }
+        with open(index_filepath, "w") as outfile:
+            json.dump(columns, outfile)
+
+    def matches_library(self, library_filepath: str) -> bool:
+        stat = os.stat(library_filepath)
+        return (stat.st_size, stat.st_mtime_ns) == (
+            self.library_size,
+            self.library_mtime_ns,
+        )
+
+    def __contains__(self, material_name: str) -> bool:
+        return _normalize_material_name(material_name) in self._spans
+
+    def get_cards(
+        self, library_filepath: str, material_name: str, material_id: int
+    ) -> str | None:
+        """
+        Returns the cards of the material renumbered with the material id, or None
+        if the material is not in the library.
+        """
+        spans = self._spans.get(_normalize_material_name(material_name))
+        if spans is None:
+            return None
+        cards = []
+        with open(library_filepath, "rb") as infile:
+            for start, length in spans:
+                infile.seek(start)
+                card = infile.read(length).decode(errors="replace")
+                cards.append(
+                    MATERIAL_CARD_PATTERN.sub(
+                        lambda match: f"{match.group(1)}{match.group(2)}{material_id}",
+                        card,
+                        count=1,
+                    )
+                )
+        return "".join(cards)
 
 
 class Processor:
@@ -31,42 +474,187 @@ class Processor:
 
     def __init__(self, input_data: InputData):
         self.input_data = input_data
-        self.material_ids = self.get_material_ids()
-        self.cell_ids_dict = self.get_cell_id_info()
+        self.statistics = RunStatistics(trace_memory=input_data.stats)
+        with self.statistics.stage("csv_load"):
+            self.material_ids = self.get_material_ids()
+            self.cell_id_index = self.get_cell_id_info()
+        self.material_library = self.get_material_library()
         self.employed_materials = {}
+        # Header of the cells (without the cell id) computed once per component
+        self._cell_headers: list[str | None] = [None] * len(self.cell_id_index)
+
+    def for_deck(self, mcnp_input_filepath: str, first_cell_id: int) -> "Processor":
+        """
+        Returns a processor for another MCNP input file that reuses the csv and
+        material ids already read by this one. The CELL IDs ranges are shifted by the
+        difference between both first cell ids.
+        """
+        processor = copy.copy(self)
+        processor.input_data = replace(
+            self.input_data,
+            mcnp_input_filepath=mcnp_input_filepath,
+            first_cell_id=first_cell_id,
+        )
+        processor.statistics = RunStatistics(trace_memory=self.input_data.stats)
+        processor.material_ids = self.material_ids
+        processor.cell_id_index = self.cell_id_index.shifted(
+            first_cell_id - self.input_data.first_cell_id
+        )
+        processor.employed_materials = {}
+        processor._cell_headers = [None] * len(self.cell_id_index)
+        return processor
 
-    def get_cell_id_info(self) -> dict[int, pd.Series]:
+    def for_cell_id_index(self, cell_id_index: "CellIdIndex") -> "Processor":
         """
-        Returns a dictionary where the key is the cell id and the value is the row of
-        the csv with the information.
+        Returns a processor for the same MCNP input file with other csv components
+        (e.g. a variant of the csv with other materials). The material ids and the
+        material library are shared.
+        """
+        processor = copy.copy(self)
+        processor.statistics = RunStatistics(trace_memory=self.input_data.stats)
+        processor.cell_id_index = cell_id_index
+        processor.employed_materials = {}
+        processor._cell_headers = [None] * len(cell_id_index)
+        return processor
+
+    def get_cell_header(self, cell_id: int) -> str | None:
+        """
+        Returns the material id, density and comment that replace the material and
+        density of the cell, None if the cell is not in the csv.
+        """
+        component = self.cell_id_index.find(cell_id)
+        if component is None:
+            return None
+        return self._get_cell_header(component, cell_id)
+
+    def run(self) -> None:
+        """
+        Writes the new MCNP file with the mode selected in the input data.
+        """
+        if self.input_data.split_assemblies:
+            # The surfaces are not deduplicated, the cells of the include files
+            # would keep the removed ones
+            self.write_mcnp_with_materials_split()
+            if self.input_data.stats:
+                self.write_statistics()
+            return
+
+        if self.input_data.processes > 1:
+            self.write_mcnp_with_materials_parallel()
+        elif self.input_data.incremental:
+            self.write_mcnp_with_materials_incremental()
+        elif self.input_data.memory_map:
+            self.write_mcnp_with_materials_mapped()
+        elif self.input_data.streaming:
+            self.write_mcnp_with_materials_streaming()
+        else:
+            self.write_mcnp_with_materials()
+            self.remove_geouned_comments()
+
+        if self.input_data.deduplicate_surfaces:
+            self.deduplicate_surfaces()
+        self.add_material_cards()
+        if self.input_data.stats:
+            self.write_statistics()
+
+    def get_cell_id_info(self) -> "CellIdIndex":
+        """
+        Returns an index that finds the component of the csv whose CELL IDs range
+        contains a given cell id.
         """
         # If the first cell was 100 the cellID will be 1 + 99
         cell_id_modifier = self.input_data.first_cell_id - 1
 
         csv = pd.read_csv(self.input_data.csv_filepath)
-        csv = csv[csv["CELL IDs"].str.contains(r"\[\d+, \d+\]")]
-        cell_ids_dict = {}
-        for _, row in csv.iterrows():
-            span = re.findall(r"\d+", row["CELL IDs"])
-            span = [int(i) + cell_id_modifier for i in span]
-            for cell_id in range(span[0], span[1] + 1):
-                cell_ids_dict[cell_id] = row
-        return cell_ids_dict
+        return CellIdIndex.from_csv(csv, cell_id_modifier)
 
-    def get_material_ids(self) -> dict[str, int]:
+    def get_material_ids(self) -> "MaterialIdRegistry":
         """
-        Returns a dictionary with the material name as the key and the material id as
-        the value.
+        Returns the registry of the material ids by material name, backed by the
+        material ids file. New ids are written to the file as they are assigned.
         """
-        try:
-            material_ids = pd.read_csv(self.input_data.material_ids_filpath)
-            return dict(zip(material_ids["MATERIAL"], material_ids["ID"]))
-        except FileNotFoundError:
+        material_ids_filepath = self.input_data.material_ids_filpath
+        if not os.path.isfile(material_ids_filepath):
             print("Material ids file not found! Creating all IDs automatically.")
-            return {"Void": 0}
-        except KeyError:
+            return MaterialIdRegistry(material_ids_filepath)
+        try:
+            return MaterialIdRegistry.from_csv(material_ids_filepath)
+        except (KeyError, ValueError):
             print("Invalid material ids file! Creating all IDs automatically.")
-            return {"Void": 0}
+            return MaterialIdRegistry(None)
+
+    def get_material_library(self) -> "MaterialLibrary | None":
+        """
+        Returns the index of the material library, built again if the library
+        changed since the last run, or None if no library was given or it is missing.
+        """
+        library_filepath = self.input_data.material_library_filepath
+        if library_filepath is None:
+            return None
+        if not os.path.isfile(library_filepath):
+            print("Material library not found! The material cards are not added.")
+            return None
+        return MaterialLibrary.for_library(library_filepath)
+
+    def add_material_cards(self, output_filepath: str | None = None) -> None:
+        """
+        Adds to the end of the data block of the new MCNP file (or the given one) the
+        cards of the employed materials read from the material library, with the
+        material ids assigned in this run. The materials that already have an M card
+        in the file are skipped.
+        """
+        if self.material_library is None or not self.employed_materials:
+            return
+        if output_filepath is None:
+            output_filepath = self.input_data.output_filepath
+        library_filepath = self.input_data.material_library_filepath
+        with self.statistics.stage("material_cards"):
+            data_block = find_data_block(output_filepath)
+            if data_block is None:
+                print("The new MCNP file has no data block, no material card added.")
+                return
+            existing_materials = _get_material_card_ids(output_filepath, *data_block)
+
+            material_cards, not_found = [], []
+            for material_name, material_id in sorted(
+                self.employed_materials.items(), key=lambda item: item[1]
+            ):
+                if material_id in existing_materials:
+                    continue
+                cards = self.material_library.get_cards(
+                    library_filepath, material_name, material_id
+                )
+                if cards is None:
+                    not_found.append(material_name)
+                else:
+                    material_cards.append(cards)
+            cards_moved = False
+            if material_cards:
+                output_size = os.path.getsize(output_filepath)
+                cards_moved = data_block[1] < output_size
+                _insert_text(output_filepath, data_block[1], "".join(material_cards))
+
+        if material_cards and output_filepath == self.input_data.output_filepath:
+            # The cards after the data block were moved, the manifest no longer
+            # matches. Otherwise only the record of the output file is updated.
+            if cards_moved:
+                self._remove_manifest()
+            else:
+                self._update_manifest_output()
+        self.statistics.counters["material_cards_added"] = len(material_cards)
+        print(f"{len(material_cards)} materials were added from the library.")
+        if not_found:
+            print(f"Materials not found in the library: {not_found}")
+
+    def _remove_manifest(self) -> None:
+        if os.path.exists(self.input_data.manifest_filepath):
+            os.remove(self.input_data.manifest_filepath)
+
+    def _update_manifest_output(self) -> None:
+        manifest = DeckManifest.load(self.input_data.manifest_filepath)
+        if manifest is not None:
+            manifest.record_output(self.input_data.output_filepath)
+            manifest.save(self.input_data.manifest_filepath)
 
     def write_mcnp_with_materials(self) -> None:
         """
@@ -76,68 +664,499 @@ class Processor:
         """
         mcnp_input_filepath = self.input_data.mcnp_input_filepath
         cards = mp.get_cards(mcnp_input_filepath)
-        with open(mcnp_input_filepath + "[materials_added]", "w") as infile:
+        cards = self.statistics.timed(cards, "numjuggler_parsing")
+        self._remove_manifest()
+        with (
+            self.statistics.stage("card_rewrite"),
+            open(mcnp_input_filepath, errors="replace") as rawfile,
+            open(self.input_data.output_filepath, "w") as infile,
+        ):
             for card in cards:
+                self.statistics.counters["cards"] += 1
+                # numjuggler replaces the tabs, the lines are copied from the file as
+                # they are, as in the other modes
+                card_definition = "".join(islice(rawfile, len(card.lines)))
                 if card.ctype == mp.CID.cell:
-                    card_definition = self._process_cell_card(card)
-                else:
-                    card_definition = card.card()
+                    card_definition = self._process_cell_text(card_definition)
                 infile.write(card_definition)
-        
+
+        print(f"The employed materials were: {self.employed_materials}")
+
+    def write_mcnp_with_materials_streaming(self) -> None:
+        """
+        Same cards as write_mcnp_with_materials followed by remove_geouned_comments
+        but the input file is read line by line and the output is written in a single
+        pass. Only one card is held in memory at a time.
+
+        Unlike write_mcnp_with_materials, the text after the blank line that closes
+        the data block is kept, as in the other modes based on this one.
+        """
+        self._remove_manifest()
+        with (
+            self.statistics.stage("card_rewrite"),
+            open(self.input_data.mcnp_input_filepath, errors="replace") as infile,
+            open(self.input_data.output_filepath, "w") as outfile,
+        ):
+            lines = _strip_geouned_comments(infile)
+            cards = self.statistics.timed(iter_cards(lines), "card_scanning")
+            for block, card_lines in cards:
+                self.statistics.counters["cards"] += 1
+                card_definition = "".join(card_lines)
+                if block == "cell":
+                    card_definition = self._process_cell_text(card_definition)
+                outfile.write(card_definition)
+
+        print(f"The employed materials were: {self.employed_materials}")
+
+    def write_mcnp_with_materials_mapped(self) -> None:
+        """
+        Same result as write_mcnp_with_materials_streaming but the input file is
+        memory-mapped instead of read. The cards are found classifying the bytes of
+        each line and only the cells present in the csv are decoded and rewritten.
+        The rest of the text is copied byte for byte from the map, joining the
+        consecutive cards that are not modified in a single write.
+        """
+        self._remove_manifest()
+        with (
+            self.statistics.stage("card_rewrite"),
+            open(self.input_data.mcnp_input_filepath, "rb") as infile,
+            mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as deck,
+            memoryview(deck) as deck_view,
+            open(self.input_data.output_filepath, "wb") as outfile,
+        ):
+            copy_start = copy_end = 0  # Text copied as is, not written yet
+            cards = self.statistics.timed(iter_mapped_cards(deck), "card_scanning")
+            for block, spans in cards:
+                self.statistics.counters["cards"] += 1
+                card_definition = None
+                if block == "cell":
+                    card_definition = self._process_mapped_cell(deck, spans)
+                if card_definition is not None:
+                    outfile.write(deck_view[copy_start:copy_end])
+                    copy_start = copy_end = 0
+                    outfile.write(card_definition.encode())
+                    continue
+                for start, end in spans:
+                    if start != copy_end:
+                        outfile.write(deck_view[copy_start:copy_end])
+                        copy_start = start
+                    copy_end = end
+            outfile.write(deck_view[copy_start:copy_end])
+
+        print(f"The employed materials were: {self.employed_materials}")
+
+    def _write_mapped_card(
+        self,
+        deck_view: memoryview,
+        block: str,
+        spans: list[tuple[int, int]],
+        outfile: io.BufferedWriter,
+    ) -> None:
+        if block == "cell":
+            card_definition = self._process_mapped_cell(deck_view.obj, spans)
+            if card_definition is not None:
+                outfile.write(card_definition.encode())
+                return
+        for start, end in spans:
+            outfile.write(deck_view[start:end])
+
+    def write_mcnp_with_materials_incremental(
+        self, previous: DeckManifest | None = None
+    ) -> DeckManifest:
+        """
+        Same result as write_mcnp_with_materials_mapped but the cards that did not
+        change since the last run are copied from the previous output file. A
+        manifest next to the output file records, for every card, its position in
+        the input and output files, the hash of its text and the hash of the header
+        given by its csv component. If the output file is not the one recorded in
+        the manifest (e.g. it was written by another mode), every card is regenerated.
+
+        If the input file did not change, it is not even scanned: only the cells
+        whose header changed are read and rewritten. Otherwise the cards are matched
+        with the previous run by the hash of their text.
+
+        The manifest of the previous run is read from its file unless it is given.
+        Returns the manifest of this run.
+        """
+        mcnp_input_filepath = self.input_data.mcnp_input_filepath
+        output_filepath = self.input_data.output_filepath
+        if previous is None:
+            previous = DeckManifest.load(self.input_data.manifest_filepath)
+        if previous is None or not previous.matches_output(output_filepath):
+            previous = DeckManifest()
+        deck_unchanged = previous.matches_deck(mcnp_input_filepath)
+        previous_cards = {
+            card_hash: i for i, card_hash in enumerate(previous.card_hashes)
+        }
+
+        stat = os.stat(mcnp_input_filepath)
+        manifest = DeckManifest(stat.st_size, stat.st_mtime_ns)
+        regenerated_cards = 0
+        temporary_filepath = output_filepath + ".tmp"
+        with (
+            self.statistics.stage("card_rewrite"),
+            open(mcnp_input_filepath, "rb") as infile,
+            mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as deck,
+            memoryview(deck) as deck_view,
+            open(temporary_filepath, "wb") as outfile,
+            _open_previous_output(output_filepath) as previous_output,
+        ):
+            if deck_unchanged:
+                cards = (
+                    (block, (start, end), card_hash)
+                    for block, start, end, card_hash in zip(
+                        previous.blocks,
+                        previous.input_starts,
+                        previous.input_ends,
+                        previous.card_hashes,
+                    )
+                )
+            else:
+                cards = _scan_mapped_cards(deck)
+
+            output_offset = 0
+            copy_span = (0, 0)
+            cards = self.statistics.timed(cards, "card_scanning")
+            for block, input_span, card_hash in cards:
+                self.statistics.counters["cards"] += 1
+                cell_id = component_id = header_hash = None
+                if block == "cell":
+                    cell_id, component_id, header_hash = self._get_cell_state(
+                        deck, input_span[0]
+                    )
+                i = previous_cards.get(card_hash)
+                up_to_date = i is not None and (
+                    previous.component_ids[i],
+                    previous.header_hashes[i],
+                ) == (component_id, header_hash)
+
+                # Consecutive cards copied from the previous output are written at once
+                if up_to_date:
+                    start, end = previous.output_starts[i], previous.output_ends[i]
+                    if copy_span[1] != start:
+                        outfile.write(previous_output[copy_span[0] : copy_span[1]])
+                        copy_span = (start, start)
+                    copy_span = (copy_span[0], end)
+                    output_span = (output_offset, output_offset + end - start)
+                else:
+                    outfile.write(previous_output[copy_span[0] : copy_span[1]])
+                    copy_span = (0, 0)
+                    spans = get_mapped_card_spans(deck, *input_span)
+                    self._write_mapped_card(deck_view, block, spans, outfile)
+                    output_span = (output_offset, outfile.tell())
+                    regenerated_cards += block == "cell"
+                output_offset = output_span[1]
+                manifest.add_card(
+                    block,
+                    input_span,
+                    output_span,
+                    card_hash,
+                    cell_id,
+                    component_id,
+                    header_hash,
+                )
+            outfile.write(previous_output[copy_span[0] : copy_span[1]])
+
+        os.replace(temporary_filepath, output_filepath)
+        manifest.components = self._get_component_hashes()
+        manifest.record_output(output_filepath)
+        manifest.save(self.input_data.manifest_filepath)
+
+        print(f"{regenerated_cards} cell cards were regenerated.")
+        if previous.components:
+            changed_components = [
+                component_id
+                for component_id, header_hash in manifest.components.items()
+                if previous.components.get(component_id) != header_hash
+            ]
+            print(f"The components that changed were: {changed_components}")
         print(f"The employed materials were: {self.employed_materials}")
+        return manifest
 
-    def _process_cell_card(self, card: mp.Card) -> str:
-        card.get_values()
-        cell_id = card.values[0][0]
-        if cell_id not in self.cell_ids_dict:
-            return card.card()
-        row = self.cell_ids_dict[cell_id]
+    def write_mcnp_with_materials_split(self) -> None:
+        """
+        Same result as write_mcnp_with_materials_streaming but the cells of each
+        assembly of the csv (the value of the assembly level column of their
+        component) are written to an include file. The new MCNP file, the master,
+        has a READ card in place of the first cell of each assembly. The cells not in
+        the csv are kept in the master.
 
-        density_correction_factor = self._get_density_correction_factor(row)
+        The files are written to temporary files first and only replace the ones of
+        the previous run that changed, so the files of the unchanged assemblies are
+        not modified. The include files of assemblies no longer in the csv are
+        removed.
+        """
+        output_filepath = self.input_data.output_filepath
+        component_includes = self._get_include_filepaths()
+        includes: dict[str, io.TextIOWrapper] = {}
+        temporary_filepath = output_filepath + ".tmp"
+        # The READ cards would be copied into the cell block by an incremental run
+        self._remove_manifest()
+        with (
+            self.statistics.stage("card_rewrite"),
+            open(self.input_data.mcnp_input_filepath, errors="replace") as infile,
+            open(temporary_filepath, "w") as outfile,
+            ExitStack() as include_files,
+        ):
+            lines = _strip_geouned_comments(infile)
+            cards = self.statistics.timed(iter_cards(lines), "card_scanning")
+            in_cell_block = False
+            comments = []  # Comment cards go to the file of the next cell
+            for block, card_lines in cards:
+                self.statistics.counters["cards"] += 1
+                card_definition = "".join(card_lines)
+                if block == "title":
+                    in_cell_block = True
+                elif block == "blank":
+                    in_cell_block = False
+                if in_cell_block and block == "comment":
+                    comments.append(card_definition)
+                    continue
+                destination = outfile
+                if block == "cell":
+                    match = CELL_ID_PATTERN.match(card_definition)
+                    card_definition = self._process_cell_text(card_definition)
+                    component = None
+                    if match is not None:
+                        component = self.cell_id_index.find(int(match.group(1)))
+                    if component is not None:
+                        filepath = component_includes[component]
+                        if filepath not in includes:
+                            name = os.path.basename(filepath)
+                            outfile.write(f"READ FILE={name} NOECHO\n")
+                            includes[filepath] = include_files.enter_context(
+                                open(filepath + ".tmp", "w")
+                            )
+                        destination = includes[filepath]
+                destination.writelines(comments)
+                comments = []
+                destination.write(card_definition)
+            outfile.writelines(comments)
+
+        self.add_material_cards(temporary_filepath)
+        rewritten = [
+            os.path.basename(filepath)
+            for filepath in includes
+            if _replace_if_changed(filepath + ".tmp", filepath)
+        ]
+        if _replace_if_changed(temporary_filepath, output_filepath):
+            rewritten.insert(0, os.path.basename(output_filepath))
+        for filepath in glob.glob(glob.escape(output_filepath) + ".*.cells"):
+            if filepath not in includes:
+                os.remove(filepath)
+                print(f"{os.path.basename(filepath)} was removed.")
+
+        print(f"The cells were split in {len(includes)} include files.")
+        print(f"The files that changed were: {rewritten}")
+        print(f"The employed materials were: {self.employed_materials}")
 
-        material_id, density = self._get_material_id_and_density(
-            row, cell_id, density_correction_factor
+    def _get_include_filepaths(self) -> list[str]:
+        """
+        Returns the include file of each component of the csv index, given by its
+        assembly (the value of the assembly level column).
+        """
+        level = self.input_data.assembly_level
+        csv = pd.read_csv(self.input_data.csv_filepath)
+        if level not in csv:
+            raise ValueError(f"The csv has no {level} column!")
+        assemblies = dict(zip(csv["Component ID"], csv[level].astype(str)))
+        return [
+            self.input_data.get_include_filepath(assemblies[component_id])
+            for component_id in self.cell_id_index.component_ids
+        ]
+
+    def reload_csv(self) -> list[str]:
+        """
+        Reads the csv again keeping the material ids already assigned. Returns the
+        components that were added, removed or whose CELL IDs, material, density or
+        comment changed.
+        """
+        previous_index = self.cell_id_index
+        with self.statistics.stage("csv_load"):
+            self.cell_id_index = self.get_cell_id_info()
+        self._cell_headers = [None] * len(self.cell_id_index)
+
+        previous_components = _get_component_rows(previous_index)
+        components = _get_component_rows(self.cell_id_index)
+        return [
+            component_id
+            for component_id in {**previous_components, **components}
+            if previous_components.get(component_id) != components.get(component_id)
+        ]
+
+    def _get_cell_state(
+        self, deck: mmap.mmap, start: int
+    ) -> tuple[int | None, str | None, str | None]:
+        """
+        Returns the cell id of the cell card that starts at the given byte, the
+        component it belongs to and the hash of the header it receives.
+        """
+        match = CELL_ID_BYTES_PATTERN.match(deck, start)
+        if match is None:
+            return None, None, None
+        cell_id = int(match.group(1))
+        component = self.cell_id_index.find(cell_id)
+        if component is None:
+            self.statistics.counters["cells_unmatched"] += 1
+            return cell_id, None, None
+        self.statistics.counters["cells_matched"] += 1
+        header = self._get_cell_header(component, cell_id)
+        component_id = str(self.cell_id_index.component_ids[component])
+        return cell_id, component_id, _hash_text(header.encode())
+
+    def _get_component_hashes(self) -> dict[str, str]:
+        # Only the components whose header was needed in this run
+        return {
+            str(self.cell_id_index.component_ids[component]): _hash_text(
+                header.encode()
+            )
+            for component, header in enumerate(self._cell_headers)
+            if header is not None
+        }
+
+    def _process_mapped_cell(
+        self, deck: mmap.mmap, spans: list[tuple[int, int]]
+    ) -> str | None:
+        """
+        Returns the new definition of the cell card or None if it is not modified.
+        """
+        match = CELL_ID_BYTES_PATTERN.match(deck, spans[0][0], spans[0][1])
+        if match is None:
+            return None
+        cell_id = int(match.group(1))
+        component = self.cell_id_index.find(cell_id)
+        if component is None:
+            self.statistics.counters["cells_unmatched"] += 1
+            return None
+        self.statistics.counters["cells_matched"] += 1
+        card_definition = b"".join(deck[start:end] for start, end in spans)
+        return self._rewrite_cell_card(
+            cell_id, component, card_definition.decode(errors="replace")
         )
 
-        cell_comment = self._get_comment(row, density_correction_factor)
+    def write_mcnp_with_materials_parallel(self) -> None:
+        """
+        Same result as write_mcnp_with_materials_streaming but the cell block is split
+        in chunks at card boundaries that are processed by a pool of processes and
+        written back in their original order.
 
-        header = f"{cell_id} {material_id} {density} $ {cell_comment}"
-        split = [header] + card.card().split("\n")
-        if split[1].split()[1] == "0":  # void cell
-            split[1] = "          " + " ".join(split[1].split()[2:])
-        else:  # card that previously had a material and density
-            split[1] = "          " + " ".join(split[1].split()[3:])
-        card_definition = "\n".join(split)
+        New material IDs are assigned before starting, following the order of the
+        CELL IDs of the csv components, so they do not depend on which chunk finishes
+        first.
+        """
+        mcnp_input_filepath = self.input_data.mcnp_input_filepath
+        cell_block = find_cell_block(mcnp_input_filepath)
+        if cell_block is None:  # Continue run, there is no cell block
+            self.write_mcnp_with_materials_streaming()
+            return
 
-        return card_definition
+        start, end = cell_block
+        chunks = split_cell_block(mcnp_input_filepath, start, end, PARALLEL_CHUNK_SIZE)
+        self._allocate_material_ids()
 
-    def _get_density_correction_factor(self, row: pd.Series) -> float:
-        try:
-            density_correction_factor = float(row["DCF=ORG/STOCH"])
-            assert pd.notna(density_correction_factor)
-        except (ValueError, AssertionError):
-            density_correction_factor = 1.0
-        return density_correction_factor
-
-    def _get_material_id_and_density(
-        self, row: pd.Series, cell_id: int, density_correction_factor: float
-    ):
-        material_name = str(row["MATERIAL"])
+        self._remove_manifest()
+        with (
+            self.statistics.stage("card_rewrite"),
+            open(mcnp_input_filepath, "rb") as infile,
+            open(self.input_data.output_filepath, "w") as outfile,
+            ProcessPoolExecutor(
+                self.input_data.processes,
+                initializer=_init_worker,
+                initargs=(self,),
+            ) as executor,
+        ):
+            head = io.TextIOWrapper(io.BytesIO(infile.read(start)), errors="replace")
+            outfile.writelines(_strip_geouned_comments(head))
+
+            for card_definitions, employed_materials, counters in executor.map(
+                _process_cell_chunk, chunks
+            ):
+                outfile.write(card_definitions)
+                for material_name, material_id in employed_materials.items():
+                    self.employed_materials.setdefault(material_name, material_id)
+                self.statistics.counters.update(counters)
+
+            infile.seek(end)
+            tail = io.TextIOWrapper(infile, errors="replace")
+            outfile.writelines(_strip_geouned_comments(tail))
+
+        print(f"The employed materials were: {self.employed_materials}")
+
+    def _process_cell_chunk(
+        self, start: int, end: int
+    ) -> tuple[str, dict[str, int], Counter]:
+        """
+        Processes the cards between the start and end bytes of the cell block. Returns
+        their new definition, the materials employed by them and the counters of the
+        statistics.
+        """
+        with open(self.input_data.mcnp_input_filepath, "rb") as infile:
+            infile.seek(start)
+            data = infile.read(end - start)
+        lines = io.TextIOWrapper(io.BytesIO(data), errors="replace")
+
+        self.employed_materials = {}
+        self._cell_headers = [None] * len(self.cell_id_index)
+        self.statistics.counters = Counter()
+        card_definitions = []
+        lines = _strip_geouned_comments(lines)
+        for block, card_lines in iter_block_cards(lines, "cell"):
+            self.statistics.counters["cards"] += 1
+            card_definition = "".join(card_lines)
+            if block == "cell":
+                card_definition = self._process_cell_text(card_definition)
+            card_definitions.append(card_definition)
+
+        counters = self.statistics.counters
+        return "".join(card_definitions), self.employed_materials, counters
+
+    def _allocate_material_ids(self) -> None:
+        material_names = (str(name) for name in self.cell_id_index.materials)
+        self.material_ids.allocate(
+            name for name in material_names if name not in ("nan", "Void")
+        )
+
+    def _process_cell_text(self, card_definition: str) -> str:
+        match = CELL_ID_PATTERN.match(card_definition)
+        if match is None:
+            return card_definition
+        cell_id = int(match.group(1))
+        component = self.cell_id_index.find(cell_id)
+        if component is None:
+            self.statistics.counters["cells_unmatched"] += 1
+            return card_definition
+        self.statistics.counters["cells_matched"] += 1
+        return self._rewrite_cell_card(cell_id, component, card_definition)
+
+    def _rewrite_cell_card(
+        self, cell_id: int, component: int, card_definition: str
+    ) -> str:
+        header = f"{cell_id} {self._get_cell_header(component, cell_id)}"
+        return header + get_cell_body(card_definition)
+
+    def _get_cell_header(self, component: int, cell_id: int) -> str:
+        header = self._cell_headers[component]
+        if header is not None:
+            self.statistics.counters["header_cache_hits"] += 1
+        else:
+            self.statistics.counters["header_cache_misses"] += 1
+            material_id, density = self._get_material_id_and_density(component, cell_id)
+            comment = self.cell_id_index.comments[component]
+            header = f"{material_id} {density} $ {comment}"
+            self._cell_headers[component] = header
+        return header
+
+    def _get_material_id_and_density(self, component: int, cell_id: int):
+        material_name = str(self.cell_id_index.materials[component])
 
         # Void material
         if material_name in ("nan", "Void"):
             return "0", ""
 
-        # If the material is not in the dictionary, add it
-        if material_name not in self.material_ids:
-            self.material_ids[material_name] = max(self.material_ids.values()) + 1
-
         # Get the material id and density
-        material_id = self.material_ids[material_name]
-        try:
-            density = float(row["DENSITY [g/cm3]"]) * density_correction_factor
-            density = f"-{density:.4e}"
-        except ValueError:
+        material_id = self._get_material_id(material_name)
+        density = self.cell_id_index.density_texts[component]
+        if density is None:
             raise ValueError(f"Invalid density value for cell {cell_id}!")
 
         # Update the employed materials for tracking
@@ -146,42 +1165,1128 @@ class Processor:
 
         return material_id, density
 
-    def _get_comment(self, row: pd.Series, density_correction_factor: float) -> str:
-        component_name = row["Component ID"]
+    def _get_material_id(self, material_name: str) -> int:
+        return self.material_ids.get_id(material_name)
 
-        last_tree_name = ""
-        level_keys = [key for key in row.keys() if "Level" in key]
-        for key in level_keys:
-            tree_name = row[key]
-            if tree_name not in ["-", "nan"]:
-                last_tree_name = tree_name
+    def remove_geouned_comments(self):
+        """
+        Removes the lines that contain only a $ comment, that is, the geouned automatic
+        comments.
+        """
+        file_path = self.input_data.output_filepath
+        with self.statistics.stage("comment_stripping"):
+            with open(file_path) as infile:
+                lines = infile.readlines()
 
-        comment = f"{component_name} - {last_tree_name}"
+            with open(file_path, "w") as infile:
+                for line in lines:
+                    if not GEOUNED_COMMENT_PATTERN.match(line):
+                        infile.write(line)
 
-        if not isclose(density_correction_factor, 1.0):
-            comment += f" - DCF={density_correction_factor:.3f}"
+    def deduplicate_surfaces(self) -> None:
+        """
+        Removes from the new MCNP file the surfaces equal to another one (within
+        SURFACE_TOLERANCE), including planes with the opposite sense, and replaces
+        them in the geometry of the cells. Surfaces referenced in the data cards (e.g.
+        surface tallies, SFn or the SUR of SDEF) are kept, as the data cards are not
+        renumbered.
 
-        return comment
+        The manifest of the incremental mode is removed as it no longer matches the
+        new MCNP file.
+        """
+        output_filepath = self.input_data.output_filepath
+        temporary_filepath = output_filepath + ".tmp"
+        with self.statistics.stage("surface_deduplication"):
+            surfaces, data_surfaces = [], set()
+            with open(output_filepath) as infile:
+                for block, card_lines in iter_cards(infile):
+                    if block == "surface":
+                        surfaces.append(mg.parse_surface_card(card_lines))
+                    elif block == "data":
+                        data_surfaces |= mg.get_data_card_surfaces(card_lines)
+            replacements = mg.find_duplicate_surfaces(
+                surfaces, SURFACE_TOLERANCE, data_surfaces
+            )
 
-    def remove_geouned_comments(self):
+            with (
+                open(output_filepath) as infile,
+                open(temporary_filepath, "w") as outfile,
+            ):
+                for block, card_lines in iter_cards(infile):
+                    if block == "cell":
+                        card_lines = mg.renumber_cell_surfaces(card_lines, replacements)
+                    elif block == "surface":
+                        if mg.get_card_number(card_lines) in replacements:
+                            continue
+                    outfile.writelines(card_lines)
+            os.replace(temporary_filepath, output_filepath)
+
+        self._remove_manifest()
+        self.statistics.counters["surfaces_removed"] = len(replacements)
+        print(f"{len(replacements)} duplicated surfaces were removed.")
+
+    def write_statistics(self) -> None:
         """
-        Removes the lines that contain only a $ comment, that is, the geouned automatic
-        comments.
+        Writes the wall time and peak memory of each stage and the counters of the
+        processed cards to a JSON file next to the new MCNP file.
+        """
+        report = self.statistics.get_report()
+        rewrite_time = report["stages"].get("card_rewrite", {}).get("wall_time")
+        if rewrite_time:
+            report["cards_per_second"] = report["counters"]["cards"] / rewrite_time
+        report["employed_materials"] = self.employed_materials
+        with open(self.input_data.stats_filepath, "w") as outfile:
+            json.dump(report, outfile, indent=2)
+        print(f"Statistics written to {self.input_data.stats_filepath}")
+
+
+class RunStatistics:
+    """
+    Wall time of each stage of a run and counters of the processed cards. The peak
+    memory allocated during each stage is only measured if trace_memory is True, as
+    tracemalloc slows down the run. The memory of the processes of the parallel mode
+    is not measured.
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.stages: dict[str, dict[str, float]] = {}
+        self.counters: Counter = Counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {"wall_time": 0.0})
+            stage["wall_time"] += time.perf_counter() - start
+            if self.trace_memory:
+                peak_memory = tracemalloc.get_traced_memory()[1] - start_memory
+                stage["peak_memory"] = max(stage.get("peak_memory", 0), peak_memory)
+
+    def timed(self, iterable: Iterable, name: str) -> Iterable:
+        """
+        Adds to the stage the time spent producing the items of the iterable, for
+        example parsing the cards. Only when tracing, to not slow down normal runs.
         """
-        file_path = self.input_data.mcnp_input_filepath + "[materials_added]"
-        with open(file_path) as infile:
-            lines = infile.readlines()
+        if not self.trace_memory:
+            return iterable
+        return self._timed(iterable, name)
+
+    def _timed(self, iterable: Iterable, name: str) -> Iterator:
+        stage = self.stages.setdefault(name, {"wall_time": 0.0})
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                stage["wall_time"] += time.perf_counter() - start
+            yield item
 
-        with open(file_path, "w") as infile:
-            for line in lines:
-                if not re.match(r"^\s*\$", line):
-                    infile.write(line)
+    def get_report(self) -> dict:
+        return {"stages": self.stages, "counters": dict(self.counters)}
+
+
+def _split_overlapping_spans(
+    starts: np.ndarray, ends: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Splits the spans of cell ids of the csv rows so every cell id belongs to the last
+    row that includes it. Returns the sorted starts and ends of the new spans and the
+    row of each one.
+    """
+    order = np.argsort(starts, kind="stable")
+    bounds = np.unique(np.concatenate([starts, ends + 1]))
+    new_starts, new_ends, rows = [], [], []
+    active = []  # Heap of the rows that include the current bound, last row first
+    next_row = 0
+    for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        while next_row < len(order) and starts[order[next_row]] == start:
+            heapq.heappush(active, -order[next_row])
+            next_row += 1
+        while active and ends[-active[0]] < start:
+            heapq.heappop(active)
+        if not active:
+            continue
+        row = -active[0]
+        if rows and rows[-1] == row and new_ends[-1] == start - 1:
+            new_ends[-1] = stop - 1
+        else:
+            new_starts.append(start)
+            new_ends.append(stop - 1)
+            rows.append(row)
+    return (
+        np.array(new_starts, dtype=np.int64),
+        np.array(new_ends, dtype=np.int64),
+        np.array(rows, dtype=np.int64),
+    )
+
+
+class CellIdIndex:
+    """
+    Maps the cell ids to the csv components. Only the first and last cell id of each
+    component are stored, sorted, and a lookup is a binary search over them. The
+    information of the components is stored column by column in NumPy arrays that are
+    accessed with the position returned by find.
+
+    The density (with the DCF applied) and the comment of the cells of each component
+    are formatted for all the components at once when the index is built. Invalid
+    densities are stored as None.
+    """
+
+    def __init__(
+        self,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        component_ids: np.ndarray,
+        materials: np.ndarray,
+        densities: np.ndarray,
+        dcfs: np.ndarray,
+        density_texts: np.ndarray,
+        comments: np.ndarray,
+    ):
+        self.starts = starts
+        self.ends = ends
+        self.component_ids = component_ids
+        self.materials = materials
+        self.densities = densities
+        self.dcfs = dcfs
+        self.density_texts = density_texts
+        self.comments = comments
+        self._last_found = 0
+
+    @classmethod
+    def from_csv(cls, csv: pd.DataFrame, cell_id_modifier: int = 0) -> "CellIdIndex":
+        csv = csv[csv["CELL IDs"].str.contains(r"\[\d+, \d+\]", na=False)]
+        spans = csv["CELL IDs"].str.extract(r"\[(\d+), (\d+)\]").astype(np.int64)
+        spans += cell_id_modifier
+
+        starts = spans[0].to_numpy()
+        ends = spans[1].to_numpy()
+        order = np.argsort(starts, kind="stable")
+        overlapping = np.flatnonzero(starts[order][1:] <= ends[order][:-1])
+        if overlapping.size > 0:
+            component = csv["Component ID"].iloc[order[overlapping[0] + 1]]
+            print(
+                f"The CELL IDs of {component} overlap with another component! The "
+                "cells take the values of the last row of the csv that includes them."
+            )
+            starts, ends, order = _split_overlapping_spans(starts, ends)
+        else:
+            starts, ends = starts[order], ends[order]
+        csv = csv.iloc[order]
+
+        # Same criteria as float() but vectorized, invalid or empty DCFs become 1.0
+        dcfs = pd.to_numeric(csv["DCF=ORG/STOCH"], errors="coerce").fillna(1.0)
+        dcfs = dcfs.to_numpy(dtype=np.float64)
+        # Empty densities are kept as NaN, only text that is not a number is invalid
+        raw_densities = csv["DENSITY [g/cm3]"]
+        densities = pd.to_numeric(raw_densities, errors="coerce")
+        invalid_densities = (densities.isna() & raw_densities.notna()).to_numpy()
+        densities = densities.to_numpy(dtype=np.float64)
+
+        density_texts = np.char.mod("-%.4e", densities * dcfs).astype(object)
+        density_texts[invalid_densities] = None
+
+        component_ids = csv["Component ID"].to_numpy(dtype=object)
+        level_keys = [key for key in csv.keys() if "Level" in key]
+        comments = cls._get_comments(
+            component_ids, csv[level_keys].to_numpy(dtype=object), dcfs
+        )
+
+        return cls(
+            starts=starts,
+            ends=ends,
+            component_ids=component_ids,
+            materials=csv["MATERIAL"].to_numpy(dtype=object),
+            densities=densities,
+            dcfs=dcfs,
+            density_texts=density_texts,
+            comments=comments,
+        )
+
+    @staticmethod
+    def _get_comments(
+        component_ids: np.ndarray, levels: np.ndarray, dcfs: np.ndarray
+    ) -> np.ndarray:
+        """
+        The comment is the component name, the last non empty Level column and the
+        DCF if it is not 1.
+        """
+        last_tree_names = np.full(len(component_ids), "", dtype=object)
+        if levels.shape[1] > 0:
+            filled = ~np.isin(levels, ["-", "nan"])
+            last_filled = levels.shape[1] - 1 - np.argmax(filled[:, ::-1], axis=1)
+            has_filled = filled.any(axis=1)
+            rows = np.flatnonzero(has_filled)
+            last_tree_names[rows] = levels[rows, last_filled[rows]]
+
+        comments = [
+            f"{component_name} - {last_tree_name}"
+            for component_name, last_tree_name in zip(component_ids, last_tree_names)
+        ]
+        comments = np.array(comments, dtype=object)
+
+        # Same tolerance as math.isclose
+        dcf_applied = np.abs(dcfs - 1.0) > 1e-9 * np.maximum(np.abs(dcfs), 1.0)
+        for i in np.flatnonzero(dcf_applied):
+            comments[i] += f" - DCF={dcfs[i]:.3f}"
+        return comments
+
+    def shifted(self, cell_id_modifier: int) -> "CellIdIndex":
+        """
+        Returns an index of the same components with their cell ids moved by the
+        modifier. The information of the components is shared, not copied.
+        """
+        return CellIdIndex(
+            starts=self.starts + cell_id_modifier,
+            ends=self.ends + cell_id_modifier,
+            component_ids=self.component_ids,
+            materials=self.materials,
+            densities=self.densities,
+            dcfs=self.dcfs,
+            density_texts=self.density_texts,
+            comments=self.comments,
+        )
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __contains__(self, cell_id: int) -> bool:
+        return self.find(cell_id) is not None
+
+    def find(self, cell_id: int) -> int | None:
+        """
+        Returns the position of the component that contains the cell id or None if
+        the cell id is not in any range. Consecutive cells usually belong to the same
+        component, so the last match is checked before doing the binary search.
+        """
+        last = self._last_found
+        if last < len(self.starts) and self.starts[last] <= cell_id <= self.ends[last]:
+            return last
+
+        position = bisect_right(self.starts, cell_id) - 1
+        if position < 0 or cell_id > self.ends[position]:
+            return None
+        self._last_found = position
+        return position
+
+    def find_all(self, cell_ids: np.ndarray) -> np.ndarray:
+        """
+        Vectorized version of find. Returns the positions of the components that
+        contain the cell ids, -1 for the cell ids that are not in any range.
+        """
+        cell_ids = np.asarray(cell_ids, dtype=np.int64)
+        if len(self.starts) == 0:
+            return np.full(cell_ids.shape, -1, dtype=np.int64)
+        positions = np.searchsorted(self.starts, cell_ids, side="right") - 1
+        outside = (positions < 0) | (cell_ids > self.ends[np.maximum(positions, 0)])
+        positions[outside] = -1
+        return positions
+
+
+def get_cell_body(card_definition: str) -> str:
+    """
+    Returns the cell card without its cell id, material and density, starting with
+    the line break that follows the new header of the cell.
+    """
+    split = card_definition.split("\n")
+    if split[0].split()[1] == "0":  # void cell
+        split[0] = "          " + " ".join(split[0].split()[2:])
+    else:  # card that previously had a material and density
+        split[0] = "          " + " ".join(split[0].split()[3:])
+    return "\n" + "\n".join(split)
+
+
+def iter_cards(lines: Iterable[str]) -> Iterator[tuple[str, list[str]]]:
+    """
+    Groups the lines of an MCNP input into cards following the same rules as
+    numjuggler but without building a Card object for each of them. Yields tuples of
+    the block name ("message", "title", "cell", "surface", "data", "comment", "blank"
+    or "end" for anything after the data block) and the lines of the card.
+    """
+    lines = iter(lines)
+    line = next(lines, None)
+    if line is None:
+        return
+
+    if line.lstrip()[:8].lower() == "message:":
+        message = [line]
+        for line in lines:
+            if _is_blank_line(line):
+                break
+            message.append(line)
+        yield "message", message
+        yield "blank", [line]
+        line = next(lines, None)
+        if line is None:
+            return
+
+    block_index = 0
+    if line.lstrip()[:8].lower() == "continue":
+        block_index = DECK_BLOCKS.index("data")
+        lines = chain([line], lines)
+    else:
+        yield "title", [line]
+
+    for block in DECK_BLOCKS[block_index:]:
+        delimiter = []
+        yield from iter_block_cards(_until_blank_line(lines, delimiter), block)
+        if not delimiter:
+            return
+        yield "blank", delimiter
+
+    for line in lines:
+        yield "end", [line]
+
+
+def iter_block_cards(
+    lines: Iterable[str], block: str
+) -> Iterator[tuple[str, list[str]]]:
+    """
+    Groups into cards lines that belong to a single block, that is, there is no blank
+    line among them. Yields the same tuples as iter_cards.
+    """
+    card, comments = [], []
+    continuation = False
+    for line in lines:
+        # The tabs only count as spaces to find the columns, the lines are kept as
+        # they are
+        head = line.expandtabs() if "\t" in line else line
+        if head[:5] == "     " or continuation:
+            card += comments
+            comments = []
+            card.append(line)
+            continuation = _has_continuation_mark(head)
+        elif _is_comment_line(head):
+            comments.append(line)
+        else:
+            if card:
+                yield block, card
+            if comments:
+                yield "comment", comments
+                comments = []
+            card = [line]
+            continuation = _is_card_continued(head)
+
+    if card:
+        yield block, card
+    if comments:
+        yield "comment", comments
+
+
+def _until_blank_line(lines: Iterator[str], delimiter: list[str]) -> Iterator[str]:
+    """
+    Yields the lines until a blank one is found, which is appended to delimiter.
+    """
+    for line in lines:
+        if _is_blank_line(line):
+            delimiter.append(line)
+            return
+        yield line
+
+
+def find_cell_block(mcnp_input_filepath: str) -> tuple[int, int] | None:
+    """
+    Returns the first and last byte of the cell block (the latter not included) or
+    None if the input is a continue run without cell block.
+    """
+    with open(mcnp_input_filepath, "rb") as infile:
+        offset = 0
+        line = infile.readline()
+        if line.lstrip()[:8].lower() == b"message:":
+            while line.strip():
+                offset += len(line)
+                line = infile.readline()
+            offset += len(line)
+            line = infile.readline()
+        if line.lstrip()[:8].lower() == b"continue":
+            return None
+
+        offset += len(line)  # title
+        start = offset
+        for line in infile:
+            if not line.strip():
+                break
+            offset += len(line)
+    return start, offset
+
+
+def find_data_block(mcnp_input_filepath: str) -> tuple[int, int] | None:
+    """
+    Returns the start and end bytes of the data block (the end is the blank line
+    after it or the end of the file) or None if the input has no data block. Only
+    the blank lines are searched, the cards are not read.
+    """
+    with (
+        open(mcnp_input_filepath, "rb") as infile,
+        mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as deck,
+    ):
+        n_blocks = len(DECK_BLOCKS)
+        if deck[:LINE_HEAD_SIZE].lstrip()[:8].lower() == b"message:":
+            n_blocks += 1
+        elif deck[:LINE_HEAD_SIZE].lstrip()[:8].lower() == b"continue":
+            n_blocks = 1
+
+        delimiters = []
+        for match in BLANK_LINE_BYTES_PATTERN.finditer(deck):
+            delimiters.append(match)
+            if len(delimiters) == n_blocks:
+                break
+        if len(delimiters) < n_blocks - 1:
+            return None
+        start = delimiters[n_blocks - 2].end() if n_blocks > 1 else 0
+        if len(delimiters) == n_blocks:
+            end = delimiters[n_blocks - 1].start()
+        else:  # The file ends with the data block
+            end = len(deck)
+        return start, end
+
+
+def split_cell_block(
+    mcnp_input_filepath: str, start: int, end: int, chunk_size: int
+) -> list[tuple[int, int]]:
+    """
+    Splits the cell block in chunks of approximately chunk_size bytes. Every chunk
+    starts at the first line of a card.
+    """
+    bounds = [start]
+    with open(mcnp_input_filepath, "rb") as infile:
+        while bounds[-1] + chunk_size < end:
+            infile.seek(bounds[-1] + chunk_size)
+            infile.readline()  # Probably half a line
+            last_card_line = infile.readline().decode(errors="replace")
+            offset = infile.tell()
+            while offset < end:
+                raw_line = infile.readline()
+                line = raw_line.decode(errors="replace").expandtabs()
+                if GEOUNED_COMMENT_PATTERN.match(line) or _is_comment_line(line):
+                    pass
+                elif line[:5] != "     " and not _has_continuation_mark(
+                    last_card_line
+                ):
+                    break
+                else:
+                    last_card_line = line
+                offset += len(raw_line)
+            if offset >= end:
+                break
+            bounds.append(offset)
+    bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+_worker_processor: Processor | None = None
+
+
+class MappedLine(str):
+    """
+    Line of a memory-mapped MCNP input. Its value is only the beginning of the line,
+    enough to tell whether it is blank, a comment, a continuation or the first line
+    of a card, and start and end are its position in bytes in the map.
+    """
+
+    start: int
+    end: int
+
+    def __new__(cls, deck: mmap.mmap, start: int, end: int) -> "MappedLine":
+        head = deck[start : min(end, start + LINE_HEAD_SIZE)]
+        if not head.strip():  # Only a full line of spaces is a blank line
+            head = deck[start:end]
+        line = super().__new__(cls, head.decode(errors="replace").expandtabs())
+        line.start = start
+        line.end = end
+        return line
+
+
+def iter_mapped_lines(
+    deck: mmap.mmap, start: int = 0, stop: int | None = None
+) -> Iterator[MappedLine]:
+    """
+    Yields the lines of a memory-mapped MCNP input (between the start and stop bytes)
+    without copying them. They can be grouped in cards with iter_cards.
+    """
+    stop = len(deck) if stop is None else stop
+    while start < stop:
+        end = deck.find(b"\n", start, stop)
+        end = stop if end == -1 else end + 1
+        yield MappedLine(deck, start, end)
+        start = end
+
+
+def iter_mapped_cards(
+    deck: mmap.mmap,
+) -> Iterator[tuple[str, list[tuple[int, int]]]]:
+    """
+    Groups the lines of a memory-mapped MCNP input into cards as iter_cards, leaving
+    out the GEOUNED comments. Yields the block and the spans in bytes of each card,
+    split only where a GEOUNED comment was left out. The cards are found with
+    regular expressions on the bytes of the map, only the cards with a & are
+    decoded to apply the continuation rules.
+    """
+    stop = len(deck)
+    lines = _iter_mapped_lines(deck, 0, stop)
+    line = next(lines, None)
+    if line is None:
+        return
+
+    if _get_mapped_head(deck, line) == b"message:":
+        message = [line.span()]
+        for line in lines:
+            if line.lastgroup == "blank":
+                break
+            _add_span(message, *line.span())
+        yield "message", message
+        yield "blank", [line.span()]
+        line = next(lines, None)
+        if line is None:
+            return
+
+    block_index = 0
+    position = line.start()
+    if _get_mapped_head(deck, line) == b"continue":
+        block_index = DECK_BLOCKS.index("data")
+    else:
+        yield "title", [line.span()]
+        position = line.end()
+
+    for block in DECK_BLOCKS[block_index:]:
+        delimiter = []
+        yield from _iter_mapped_block_cards(deck, position, stop, block, delimiter)
+        if not delimiter:
+            return
+        yield "blank", delimiter
+        position = delimiter[0][1]
+
+    for line in _iter_mapped_lines(deck, position, stop):
+        yield "end", [line.span()]
+
+
+def _iter_mapped_lines(deck: mmap.mmap, start: int, stop: int) -> Iterator[re.Match]:
+    """
+    Yields the lines of the map between the start and stop bytes, except the GEOUNED
+    comments, as matches of MAPPED_LINE_BYTES_PATTERN whose lastgroup is their kind.
+    """
+    for line in MAPPED_LINE_BYTES_PATTERN.finditer(deck, start, stop):
+        if line.lastgroup != "geouned":
+            yield line
+
+
+def _get_mapped_head(deck: mmap.mmap, line: re.Match) -> bytes:
+    start, end = line.span()
+    return deck[start : min(end, start + LINE_HEAD_SIZE)].lstrip()[:8].lower()
+
+
+def _iter_mapped_block_cards(
+    deck: mmap.mmap,
+    position: int,
+    stop: int,
+    block: str,
+    delimiter: list[tuple[int, int]],
+) -> Iterator[tuple[str, list[tuple[int, int]]]]:
+    """
+    Same as iter_block_cards for the lines of the map from the given byte until a
+    blank line, whose span is appended to delimiter.
+    """
+    match_line = MAPPED_LINE_BYTES_PATTERN.match
+    comments = []
+    while position < stop:
+        line = match_line(deck, position, stop)
+        kind = line.lastgroup
+        start, position = line.span()
+        if kind == "blank":
+            delimiter.append((start, position))
+            break
+        if kind == "geouned":
+            continue
+        if kind == "comment":
+            _add_span(comments, start, position)
+            continue
+
+        card_start = start
+        if kind == "card" and comments:
+            yield "comment", comments
+        elif comments:  # A continuation line at the beginning of the block
+            card_start = comments[0][0]
+        comments = []
+        position = _get_mapped_card_end(deck, kind, start, position, stop)
+        yield block, get_mapped_card_spans(deck, card_start, position)
+
+    if comments:
+        yield "comment", comments
+
+
+def _get_mapped_card_end(
+    deck: mmap.mmap, kind: str, start: int, line_end: int, stop: int
+) -> int:
+    """
+    Returns the end of the card whose first line goes from the start byte to
+    line_end: its continuation lines and the comments among them.
+    """
+    end = MAPPED_CARD_TAIL_BYTES_PATTERN.match(deck, line_end, stop).end()
+    if deck.find(b"&", start, end) == -1:
+        return end
+
+    # The line after a & belongs to the card whatever its columns
+    first_line = _decode_mapped_line(deck, start, line_end)
+    continuation = (
+        _is_card_continued(first_line)
+        if kind == "card"
+        else _has_continuation_mark(first_line)
+    )
+    end = position = line_end
+    match_line = MAPPED_LINE_BYTES_PATTERN.match
+    while position < stop:
+        line = match_line(deck, position, stop)
+        kind = line.lastgroup
+        if kind == "blank":
+            break
+        line_start, position = line.span()
+        if kind == "geouned":
+            continue
+        if kind == "continuation" or continuation:
+            end = position
+            continuation = _has_continuation_mark(
+                _decode_mapped_line(deck, line_start, end)
+            )
+        elif kind != "comment":
+            break
+    return end
+
+
+def _add_span(spans: list[tuple[int, int]], start: int, end: int) -> None:
+    if spans and spans[-1][1] == start:
+        spans[-1] = (spans[-1][0], end)
+    else:
+        spans.append((start, end))
+
+
+def _decode_mapped_line(deck: mmap.mmap, start: int, end: int) -> str:
+    # Only to find the columns, as iter_block_cards
+    return deck[start:end].decode(errors="replace").expandtabs()
+
+
+def get_mapped_card_spans(
+    deck: mmap.mmap, start: int, end: int
+) -> list[tuple[int, int]]:
+    """
+    Returns the spans of the card between the start and end bytes, leaving out the
+    GEOUNED comments.
+    """
+    spans = []
+    position = deck.find(b"$", start, end)
+    while position != -1:
+        line_start = deck.rfind(b"\n", start, position) + 1 or start
+        line_end = deck.find(b"\n", position, end) + 1 or end
+        # Only a $ after the blanks at the beginning of a line is a GEOUNED comment
+        if not deck[line_start:position].strip(b" \t\r\f\v"):
+            if line_start > start:
+                spans.append((start, line_start))
+            start = line_end
+        position = deck.find(b"$", line_end, end)
+    if end > start:
+        spans.append((start, end))
+    return spans
+
+
+def read_mapped_line(deck: mmap.mmap, start: int) -> str:
+    """
+    Returns the line of the map that starts at the given byte.
+    """
+    end = deck.find(b"\n", start)
+    return deck[start : len(deck) if end == -1 else end + 1].decode(errors="replace")
+
+
+def _scan_mapped_cards(deck: mmap.mmap) -> Iterator[tuple[str, tuple[int, int], str]]:
+    """
+    Yields the block, the span in bytes and the hash of every card of the deck.
+    """
+    for block, spans in iter_mapped_cards(deck):
+        start, end = spans[0][0], spans[-1][1]
+        yield block, (start, end), _hash_text(deck[start:end])
+
+
+def _hash_text(text: bytes) -> str:
+    return hashlib.blake2b(text, digest_size=16).hexdigest()
+
+
+def _hash_file(filepath: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, "rb") as infile:
+        while chunk := infile.read(1024**2):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _open_previous_output(output_filepath: str) -> mmap.mmap | nullcontext:
+    """
+    Returns the output of the previous run memory-mapped, or an empty one if there is
+    none, to copy the cards that did not change.
+    """
+    if not _is_non_empty_file(output_filepath):
+        return nullcontext(b"")
+    with open(output_filepath, "rb") as infile:
+        return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _replace_if_changed(temporary_filepath: str, filepath: str) -> bool:
+    """
+    Replaces the file with the temporary one if their contents differ, otherwise the
+    temporary file is removed and the file is not modified. Returns whether the
+    file was replaced.
+    """
+    if os.path.isfile(filepath) and filecmp.cmp(
+        temporary_filepath, filepath, shallow=False
+    ):
+        os.remove(temporary_filepath)
+        return False
+    os.replace(temporary_filepath, filepath)
+    return True
+
+
+def _is_non_empty_file(filepath: str) -> bool:
+    return os.path.isfile(filepath) and os.path.getsize(filepath) > 0
+
+
+def _get_material_card_ids(
+    mcnp_input_filepath: str, start: int, end: int
+) -> set[int]:
+    """
+    Returns the numbers of the M cards between the start and end bytes.
+    """
+    material_ids = set()
+    with (
+        open(mcnp_input_filepath, "rb") as infile,
+        mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as deck,
+    ):
+        lines = iter_mapped_lines(deck, start, end)
+        for _, card_lines in iter_block_cards(lines, "data"):
+            match = MATERIAL_CARD_PATTERN.match(card_lines[0])
+            if match is not None and match.group(2).lower() == "m":
+                material_ids.add(int(match.group(3)))
+    return material_ids
+
+
+def _insert_text(filepath: str, position: int, text: str) -> None:
+    """
+    Inserts the text at the byte position of the file. Appending to the end does
+    not rewrite the file.
+    """
+    size = os.path.getsize(filepath)
+    if position >= size:
+        with open(filepath, "rb+") as outfile:
+            outfile.seek(max(size - 1, 0))
+            if size and outfile.read(1) != b"\n":
+                text = "\n" + text
+            outfile.seek(size)
+            outfile.write(text.encode())
+        return
+    temporary_filepath = filepath + ".tmp"
+    with open(filepath, "rb") as infile, open(temporary_filepath, "wb") as outfile:
+        outfile.write(infile.read(position))
+        outfile.write(text.encode())
+        shutil.copyfileobj(infile, outfile)
+    os.replace(temporary_filepath, filepath)
+
+
+def _normalize_material_name(material_name: str) -> str:
+    return str(material_name).strip().casefold()
+
+
+def process_decks(
+    processor: Processor, decks: Iterable[tuple[str, int]], workers: int
+) -> None:
+    """
+    Writes the new MCNP file of each (MCNP input file, first cell id) pair reusing
+    the csv and material ids read by the processor. The decks are split among a pool
+    of worker processes, each of them processes its decks without a pool of its own.
+
+    New material IDs are assigned before starting so every deck receives the same ones.
+    """
+    decks = list(decks)
+    processor._allocate_material_ids()
+    if workers <= 1 or len(decks) <= 1:
+        for mcnp_input_filepath, first_cell_id in decks:
+            processor.for_deck(mcnp_input_filepath, first_cell_id).run()
+        return
+
+    processor = copy.copy(processor)
+    processor.input_data = replace(processor.input_data, processes=1)
+    with ProcessPoolExecutor(
+        min(workers, len(decks)), initializer=_init_worker, initargs=(processor,)
+    ) as executor:
+        for mcnp_input_filepath in executor.map(_process_deck, decks):
+            print(f"Processed {mcnp_input_filepath}")
+
+
+def get_deck_filepaths(pattern: str) -> list[str]:
+    """
+    Returns the files that match the glob pattern except the ones written by this
+    script and the card indices of mcnp_card_index.
+    """
+    return sorted(
+        filepath
+        for filepath in glob.glob(pattern)
+        if "[materials_added]" not in filepath
+        and not filepath.endswith(".index.json")
+        and os.path.isfile(filepath)
+    )
+
+
+async def watch(processor: Processor, interval: float = WATCH_INTERVAL) -> None:
+    """
+    Keeps the processor in memory and writes the new MCNP file every time the csv or
+    the MCNP input file are saved. Only the cards affected by the change are
+    regenerated, as in write_mcnp_with_materials_incremental, and the manifest of
+    the last run is kept in memory too. Runs until it is cancelled (Ctrl+C).
+
+    A change is processed once the file has not been modified for an interval, as
+    Excel and other editors may write a file in several steps.
+    """
+    csv_filepath = processor.input_data.csv_filepath
+    mcnp_input_filepath = processor.input_data.mcnp_input_filepath
+    manifest = await asyncio.to_thread(_regenerate, processor, None)
+    signatures = {
+        filepath: _get_file_signature(filepath)
+        for filepath in (csv_filepath, mcnp_input_filepath)
+    }
+    print(f"Watching {csv_filepath} and {mcnp_input_filepath} for changes...")
+
+    while True:
+        await asyncio.sleep(interval)
+        changed = {
+            filepath
+            for filepath, signature in signatures.items()
+            if _get_file_signature(filepath) != signature
+        }
+        if not changed:
+            continue
+        await _wait_until_unmodified(changed, interval)
+        for filepath in changed:
+            signatures[filepath] = _get_file_signature(filepath)
+
+        start = time.perf_counter()
+        if csv_filepath in changed:
+            try:
+                changed_components = processor.reload_csv()
+            except (OSError, ValueError, KeyError) as error:
+                print(f"The csv could not be read, waiting for a new change: {error}")
+                continue
+            print(f"The csv changed, modified components: {changed_components}")
+        if mcnp_input_filepath in changed:
+            print("The MCNP input file changed.")
+
+        try:
+            manifest = await asyncio.to_thread(_regenerate, processor, manifest)
+        except (OSError, ValueError) as error:
+            print(f"The MCNP file could not be written: {error}")
+            continue
+        print(f"Regenerated in {(time.perf_counter() - start) * 1000:.0f} ms.")
+
+
+async def _wait_until_unmodified(filepaths: Iterable[str], interval: float) -> None:
+    signatures = None
+    while True:
+        new_signatures = [_get_file_signature(filepath) for filepath in filepaths]
+        if new_signatures == signatures:
+            return
+        signatures = new_signatures
+        await asyncio.sleep(interval)
+
+
+def _regenerate(
+    processor: Processor, manifest: DeckManifest | None
+) -> DeckManifest | None:
+    processor.employed_materials = {}
+    processor._cell_headers = [None] * len(processor.cell_id_index)
+    manifest = processor.write_mcnp_with_materials_incremental(manifest)
+    processor.add_material_cards()
+    # The material cards update the manifest, or remove it if they moved the end of
+    # the file
+    return DeckManifest.load(processor.input_data.manifest_filepath)
+
+
+def _get_file_signature(filepath: str) -> tuple[int, int] | None:
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _get_component_rows(cell_id_index: CellIdIndex) -> dict[str, tuple]:
+    return {
+        str(component_id): row
+        for component_id, *row in zip(
+            cell_id_index.component_ids,
+            cell_id_index.starts.tolist(),
+            cell_id_index.ends.tolist(),
+            cell_id_index.materials.astype(str),
+            cell_id_index.density_texts,
+            cell_id_index.comments,
+        )
+    }
+
+
+def _init_worker(processor: Processor) -> None:
+    global _worker_processor
+    _worker_processor = processor
+
+
+def _process_cell_chunk(
+    chunk: tuple[int, int],
+) -> tuple[str, dict[str, int], Counter]:
+    return _worker_processor._process_cell_chunk(*chunk)
+
+
+def _process_deck(deck: tuple[str, int]) -> str:
+    mcnp_input_filepath, first_cell_id = deck
+    _worker_processor.for_deck(mcnp_input_filepath, first_cell_id).run()
+    return mcnp_input_filepath
+
+
+def _strip_geouned_comments(lines: Iterable[str]) -> Iterator[str]:
+    for line in lines:
+        if not GEOUNED_COMMENT_PATTERN.match(line):
+            yield line
+
+
+def _is_blank_line(line: str) -> bool:
+    return line.strip() == ""
+
+
+def _is_comment_line(line: str) -> bool:
+    return line[:6].lstrip().lower().startswith("c ") or line.strip().lower() == "c"
+
+
+def _has_continuation_mark(line: str) -> bool:
+    return "&" in line[:80].split("$", 1)[0]
+
+
+def _is_card_continued(first_line: str) -> bool:
+    # In tally comment cards (FCn) the & does not mean continuation
+    is_tally_comment = first_line.lstrip()[:2].lower() == "fc"
+    return not is_tally_comment and _has_continuation_mark(first_line)
 
 
 def main():
-    processor = Processor(InputData())
-    processor.write_mcnp_with_materials()
-    processor.remove_geouned_comments()
+    parser = argparse.ArgumentParser(
+        description="Updates the MCNP file with the materials of the CSV file. Several "
+        "MCNP files can be given with --deck or --glob, the CSV file is read once."
+    )
+    parser.add_argument(
+        "--deck",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("MCNP_INPUT", "FIRST_CELL_ID"),
+        help="MCNP input file and the cell id of its first csv cell, can be repeated",
+    )
+    parser.add_argument(
+        "--glob",
+        help="process every MCNP input file that matches the pattern, their first "
+        "cell id is --first-cell-id",
+    )
+    parser.add_argument("--first-cell-id", type=int, default=FIRST_CELL_ID)
+    parser.add_argument("--csv", default=CSV_FILEPATH)
+    parser.add_argument("--material-ids", default=MATERIAL_IDS_FILEPATH)
+    parser.add_argument(
+        "--material-library",
+        default=MATERIAL_LIBRARY_FILEPATH,
+        help="file with the M and MT cards of the materials, the cards of the "
+        "employed ones are added to the new MCNP file (none by default)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="processes among which the MCNP files are split",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        default=STATS,
+        help="write the time, memory and counters of each stage to a JSON file",
+    )
+    parser.add_argument(
+        "--deduplicate-surfaces",
+        action="store_true",
+        default=DEDUPLICATE_SURFACES,
+        help="remove the surfaces equal to another one from the new MCNP file",
+    )
+    parser.add_argument(
+        "--split-assemblies",
+        action="store_true",
+        default=SPLIT_ASSEMBLIES,
+        help="write the cells of each assembly to a file included with a READ card, "
+        "only the files of the assemblies that changed are rewritten",
+    )
+    parser.add_argument(
+        "--assembly-level",
+        default=ASSEMBLY_LEVEL,
+        help="column of the csv with the assemblies of --split-assemblies",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and update the MCNP file every time the CSV file or the "
+        "MCNP input file are saved",
+    )
+    args = parser.parse_args()
+    if args.split_assemblies and args.deduplicate_surfaces:
+        parser.error("--deduplicate-surfaces cannot be used with --split-assemblies!")
+    # The watch mode always writes the new MCNP file as the incremental mode
+    if args.watch and args.split_assemblies:
+        parser.error("--split-assemblies cannot be used with --watch!")
+    if args.watch and args.deduplicate_surfaces:
+        parser.error("--deduplicate-surfaces cannot be used with --watch!")
+
+    decks = []
+    for mcnp_input_filepath, first_cell_id in args.deck:
+        try:
+            decks.append((mcnp_input_filepath, int(first_cell_id)))
+        except ValueError:
+            parser.error(f"Invalid first cell id for {mcnp_input_filepath}!")
+    if args.glob:
+        deck_filepaths = get_deck_filepaths(args.glob)
+        if not deck_filepaths:
+            parser.error(f"No MCNP input file matches {args.glob}!")
+        decks += [(filepath, args.first_cell_id) for filepath in deck_filepaths]
+
+    processor = Processor(
+        InputData(
+            csv_filepath=args.csv,
+            material_ids_filpath=args.material_ids,
+            material_library_filepath=args.material_library,
+            first_cell_id=args.first_cell_id,
+            stats=args.stats,
+            deduplicate_surfaces=args.deduplicate_surfaces,
+            split_assemblies=args.split_assemblies,
+            assembly_level=args.assembly_level,
+        )
+    )
+    if args.watch:
+        if len(decks) > 1:
+            parser.error("--watch only supports a single MCNP input file!")
+        if decks:
+            processor = processor.for_deck(*decks[0])
+        try:
+            asyncio.run(watch(processor))
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+    elif decks:
+        process_decks(processor, decks, args.workers)
+    else:
+        processor.run()
 
 
 if __name__ == "__main__":
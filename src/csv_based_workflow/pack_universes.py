@@ -0,0 +1,317 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+import mcnp_geometry as mg
+from mcnp_materials_from_csv import CellIdIndex, iter_cards
+
+MCNP_INPUT_FILEPATH = "testing.mcnp"
+CSV_FILEPATH = "testing.csv"
+FIRST_CELL_ID = 1
+LEVEL = "Level 1"  # Column of the csv whose assemblies are packed in universes
+ENVELOPE_MARGIN = 1.0  # cm added around the sampled extent of the cells
+SAMPLES_PER_CELL = 10_000  # Random points used to find the extent of each cell
+SEED = 0
+
+
+@dataclass
+class InputData:
+    """
+    Holds the input data for the packer taking the default values from the module
+    """
+
+    mcnp_input_filepath: str = MCNP_INPUT_FILEPATH
+    csv_filepath: str = CSV_FILEPATH
+    first_cell_id: int = FIRST_CELL_ID
+    level: str = LEVEL
+
+    @property
+    def output_filepath(self) -> str:
+        return self.mcnp_input_filepath + "[universes]"
+
+
+@dataclass
+class Envelope:
+    """
+    Box around the cells of an assembly. The box is a new cell filled with a
+    universe made of the cells of the assembly and of copies of the cells that cross
+    the box, which are cut by it in the main geometry.
+    """
+
+    name: str
+    cells: list[int]
+    bounds: np.ndarray
+    crossing_cells: list[int] = field(default_factory=list)
+    universe: int = 0
+    surface: int = 0
+    cell: int = 0
+    copies: dict[int, int] = field(default_factory=dict)
+
+
+class UniversePacker:
+    """
+    Groups the cells of the assemblies of a csv Level column into universes that
+    fill box envelopes, so MCNP only searches the cells of an assembly when a
+    particle is inside its envelope.
+
+    The extent of the cells is estimated by sampling random points, so it may be
+    smaller than the real one for thin parts of a cell. ENVELOPE_MARGIN should be
+    larger than the thickness of those parts.
+    """
+
+    def __init__(self, input_data: InputData):
+        self.input_data = input_data
+        self.csv = pd.read_csv(input_data.csv_filepath)
+        self.cell_id_index = CellIdIndex.from_csv(
+            self.csv, input_data.first_cell_id - 1
+        )
+        with open(input_data.mcnp_input_filepath, errors="replace") as infile:
+            self.geometry = mg.Geometry.from_cards(iter_cards(infile))
+        self.world_bounds = self.geometry.get_world_bounds()
+        self.rng = np.random.default_rng(SEED)
+
+        self.cell_bounds: dict[int, np.ndarray | None] = {}
+        self.referenced_cells: set[int] = set()
+        for cell_id, node in self.geometry.cells.items():
+            self.cell_bounds[cell_id] = None
+            if node is not None:
+                self.cell_bounds[cell_id] = self.geometry.get_bounds(cell_id)
+                self.referenced_cells.update(_get_referenced_cells(node))
+        # The LIKE n BUT cells with TRCL have no geometry node
+        self.referenced_cells.update(self.geometry.like_cells.values())
+
+    def get_assemblies(self) -> dict[str, list[int]]:
+        """
+        Returns the cells of the main geometry grouped by the value of the Level
+        column of their csv component.
+        """
+        levels = self.csv.set_index("Component ID")[self.input_data.level]
+        assemblies = {}
+        for cell_id in self.geometry.cells:
+            component = self.cell_id_index.find(cell_id)
+            if component is None or not self._is_in_main_geometry(cell_id):
+                continue
+            name = str(levels.get(self.cell_id_index.component_ids[component]))
+            if name not in ("-", "nan"):
+                assemblies.setdefault(name, []).append(cell_id)
+        return assemblies
+
+    def pack(self) -> list[Envelope]:
+        """
+        Returns the envelopes of the assemblies that can be packed, the largest
+        first. An assembly is not packed if its envelope overlaps a previous one or
+        if the cells that cross it cannot be cut.
+        """
+        envelopes = []
+        packed_cells = set()
+        assemblies = sorted(
+            self.get_assemblies().items(), key=lambda item: len(item[1]), reverse=True
+        )
+        for name, cells in assemblies:
+            try:
+                envelope = self.get_envelope(name, cells)
+                for other in envelopes:
+                    if _boxes_overlap(envelope.bounds, other.bounds):
+                        raise ValueError(f"its envelope overlaps {other.name}")
+                for cell_id in envelope.crossing_cells:
+                    if cell_id in packed_cells:
+                        raise ValueError(f"cell {cell_id} is already in a universe")
+            except ValueError as error:
+                print(f"{name} was not packed: {error}.")
+                continue
+            envelopes.append(envelope)
+            packed_cells.update(envelope.cells)
+        self._number_envelopes(envelopes)
+        return envelopes
+
+    def get_envelope(self, name: str, cells: list[int]) -> Envelope:
+        """
+        Returns the envelope of the cells of an assembly and the cells that cross
+        it. Raises ValueError if the assembly cannot be packed.
+        """
+        boxes = []
+        for cell_id in cells:
+            if self.cell_bounds[cell_id] is None:
+                raise ValueError(f"the geometry of cell {cell_id} is not supported")
+            region = _intersect_boxes(self.cell_bounds[cell_id], self.world_bounds)
+            box = self.geometry.sample_bounds(
+                cell_id, region, SAMPLES_PER_CELL, self.rng
+            )
+            if box is None:
+                raise ValueError(f"no point was sampled in cell {cell_id}")
+            box = box + [[-ENVELOPE_MARGIN] * 3, [ENVELOPE_MARGIN] * 3]
+            boxes.append(_intersect_boxes(box, self.cell_bounds[cell_id]))
+        boxes = np.array(boxes)
+        bounds = np.array([boxes[:, 0].min(axis=0), boxes[:, 1].max(axis=0)])
+
+        envelope = Envelope(name, cells, bounds)
+        members = set(cells)
+        for cell_id in self.geometry.cells:
+            if cell_id in members or not self._is_in_main_geometry(cell_id):
+                continue
+            if self._crosses_box(cell_id, bounds):
+                if cell_id in self.referenced_cells:
+                    raise ValueError(
+                        f"cell {cell_id} crosses the envelope and is used by "
+                        "LIKE n BUT or # in other cells"
+                    )
+                if cell_id in self.geometry.like_cells:
+                    raise ValueError(
+                        f"cell {cell_id} crosses the envelope and is a LIKE "
+                        f"{self.geometry.like_cells[cell_id]} BUT cell, which has no "
+                        "geometry to cut"
+                    )
+                envelope.crossing_cells.append(cell_id)
+        return envelope
+
+    def _crosses_box(self, cell_id: int, box: np.ndarray) -> bool:
+        # The cells that cannot be evaluated are cut anyway, it does no harm
+        cell_bounds = self.cell_bounds[cell_id]
+        if cell_bounds is None:
+            return True
+        if not _boxes_overlap(cell_bounds, box):
+            return False
+        region = _intersect_boxes(cell_bounds, box)
+        points = self.rng.uniform(region[0], region[1], size=(SAMPLES_PER_CELL, 3))
+        try:
+            return bool(self.geometry.contains(cell_id, points).any())
+        except ValueError:
+            return True
+
+    def _is_in_main_geometry(self, cell_id: int) -> bool:
+        return self.geometry.cell_parameters[cell_id].get("u", "0") == "0"
+
+    def _number_envelopes(self, envelopes: list[Envelope]) -> None:
+        # Negative universe numbers are a performance hint for MCNP
+        universes = [
+            int(value.lstrip("-"))
+            for parameters in self.geometry.cell_parameters.values()
+            for key, value in parameters.items()
+            if key in ("u", "fill") and value.lstrip("-").isdigit()
+        ]
+        universe = max(universes, default=0)
+        surface = max(self.geometry.surfaces, default=0)
+        cell = max(self.geometry.cells, default=0)
+        for envelope in envelopes:
+            universe += 1
+            surface += 1
+            cell += 1
+            envelope.universe = universe
+            envelope.surface = surface
+            envelope.cell = cell
+            for cell_id in envelope.crossing_cells:
+                cell += 1
+                envelope.copies[cell_id] = cell
+
+    def write_packed_deck(self, envelopes: list[Envelope]) -> None:
+        """
+        Writes the MCNP input file with the cells of the envelopes moved to their
+        universes, the cells that cross the envelopes cut by them and the envelope
+        cells and surfaces added at the end of their blocks.
+        """
+        universes = {
+            cell_id: envelope.universe
+            for envelope in envelopes
+            for cell_id in envelope.cells
+        }
+        cuts: dict[int, list[int]] = {}
+        for envelope in envelopes:
+            for cell_id in envelope.crossing_cells:
+                cuts.setdefault(cell_id, []).append(envelope.surface)
+
+        crossing_cards = {}
+        new_cells_written = new_surfaces_written = False
+        previous_block = None
+        with (
+            open(self.input_data.mcnp_input_filepath, errors="replace") as infile,
+            open(self.input_data.output_filepath, "w") as outfile,
+        ):
+            for block, card_lines in iter_cards(infile):
+                if block == "cell":
+                    cell_id = mg.get_card_number(card_lines)
+                    if cell_id in universes:
+                        card_lines = card_lines + [f"     u={universes[cell_id]}\n"]
+                    elif cell_id in cuts:
+                        crossing_cards[cell_id] = card_lines
+                        outside = " ".join(str(surface) for surface in cuts[cell_id])
+                        card_lines = mg.intersect_cell_geometry(card_lines, outside)
+                elif block == "blank" and previous_block is not None:
+                    if previous_block == "cell" and not new_cells_written:
+                        for envelope in envelopes:
+                            self._write_envelope_cells(
+                                envelope, crossing_cards, outfile
+                            )
+                        new_cells_written = True
+                    elif previous_block == "surface" and not new_surfaces_written:
+                        for envelope in envelopes:
+                            _write_envelope_surface(envelope, outfile)
+                        new_surfaces_written = True
+                if block not in ("comment", "blank"):
+                    previous_block = block
+                outfile.writelines(card_lines)
+
+            if not new_surfaces_written:  # The deck ends with the surface block
+                for envelope in envelopes:
+                    _write_envelope_surface(envelope, outfile)
+
+    def _write_envelope_cells(
+        self, envelope: Envelope, crossing_cards: dict[int, list[str]], outfile
+    ) -> None:
+        parameters = self.geometry.cell_parameters[envelope.cells[0]]
+        importances = [
+            f"{key}={value}" for key, value in parameters.items() if "imp" in key
+        ]
+        outfile.write(f"c Envelope of {envelope.name}\n")
+        outfile.write(
+            f"{envelope.cell} 0 -{envelope.surface} fill={envelope.universe}\n"
+        )
+        if importances:
+            outfile.write(f"     {' '.join(importances)}\n")
+        for cell_id, copy_id in envelope.copies.items():
+            card_lines = mg.replace_card_number(crossing_cards[cell_id], copy_id)
+            outfile.writelines(card_lines + [f"     u={envelope.universe}\n"])
+
+
+def _write_envelope_surface(envelope: Envelope, outfile) -> None:
+    (x_min, y_min, z_min), (x_max, y_max, z_max) = envelope.bounds
+    outfile.write(
+        f"{envelope.surface} RPP {x_min:.6e} {x_max:.6e} {y_min:.6e} {y_max:.6e}\n"
+        f"     {z_min:.6e} {z_max:.6e}\n"
+    )
+
+
+def _get_referenced_cells(node: mg.GeometryNode) -> set[int]:
+    if node.kind == "cell":  # LIKE n BUT or complement #n
+        return {node.number}
+    cells = set()
+    for child in node.children:
+        cells.update(_get_referenced_cells(child))
+    return cells
+
+
+def _intersect_boxes(box: np.ndarray, other: np.ndarray) -> np.ndarray:
+    return np.array([np.maximum(box[0], other[0]), np.minimum(box[1], other[1])])
+
+
+def _boxes_overlap(box: np.ndarray, other: np.ndarray) -> bool:
+    return bool(np.all(box[0] < other[1]) and np.all(other[0] < box[1]))
+
+
+def main():
+    packer = UniversePacker(InputData())
+    envelopes = packer.pack()
+    packer.write_packed_deck(envelopes)
+    for envelope in envelopes:
+        print(
+            f"{envelope.name}: {len(envelope.cells)} cells in universe "
+            f"{envelope.universe}, {len(envelope.crossing_cells)} cells cut by it"
+        )
+    print(
+        f"MCNP input file with {len(envelopes)} universes written to "
+        f"{packer.input_data.output_filepath}"
+    )
+
+
+if __name__ == "__main__":
+    main()
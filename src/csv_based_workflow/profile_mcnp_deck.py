@@ -0,0 +1,202 @@
+from dataclasses import dataclass
+
+import pandas as pd
+
+import mcnp_geometry as mg
+from mcnp_materials_from_csv import CellIdIndex, iter_cards
+
+MCNP_INPUT_FILEPATH = "testing.mcnp"
+CSV_FILEPATH = "testing.csv"
+FIRST_CELL_ID = 1
+REMOVE_UNUSED_SURFACES = False  # Write a copy of the deck without unused surfaces
+RANK_BY = "SURFACES"  # Column of the component table used to rank them
+TOP_COMPONENTS = 20  # Number of components printed in the console
+
+TORUS_MNEMONICS = ("TX", "TY", "TZ")
+
+
+@dataclass
+class InputData:
+    """
+    Holds the input data for the profiler taking the default values from the module
+    """
+
+    mcnp_input_filepath: str = MCNP_INPUT_FILEPATH
+    csv_filepath: str = CSV_FILEPATH
+    first_cell_id: int = FIRST_CELL_ID
+    remove_unused_surfaces: bool = REMOVE_UNUSED_SURFACES
+
+    @property
+    def cells_filepath(self) -> str:
+        return self.mcnp_input_filepath + "[cells_profile].csv"
+
+    @property
+    def components_filepath(self) -> str:
+        return self.mcnp_input_filepath + "[components_profile].csv"
+
+    @property
+    def pruned_filepath(self) -> str:
+        return self.mcnp_input_filepath + "[unused_surfaces_removed]"
+
+
+class DeckProfiler:
+    """
+    Measures the complexity of the cells of an MCNP input file: the number of
+    surfaces, the depth of the Boolean expression of their geometry and the number of
+    tori and GQ surfaces. The cells are grouped by the components of the csv to know
+    which ones should be simplified first.
+    """
+
+    def __init__(self, input_data: InputData):
+        self.input_data = input_data
+        self.csv = pd.read_csv(input_data.csv_filepath)
+        self.cell_id_index = CellIdIndex.from_csv(
+            self.csv, input_data.first_cell_id - 1
+        )
+        self.cell_ids: list[int] = []
+        self.cell_surfaces: list[list[int]] = []
+        self.cell_depths: list[int] = []
+        self.surface_mnemonics: dict[int, str] = {}
+        self.data_surfaces: set[int] = set()
+
+    def read_deck(self) -> None:
+        with open(self.input_data.mcnp_input_filepath, errors="replace") as infile:
+            for block, card_lines in iter_cards(infile):
+                if block == "cell":
+                    self._read_cell(card_lines)
+                elif block == "surface":
+                    surface = mg.parse_surface_card(card_lines)
+                    if surface is not None:
+                        self.surface_mnemonics[surface.number] = surface.mnemonic
+                elif block == "data":
+                    self.data_surfaces |= mg.get_data_card_surfaces(card_lines)
+
+    def _read_cell(self, card_lines: list[str]) -> None:
+        tokens = list(mg.iter_cell_geometry(card_lines))
+        cell_id = mg.get_card_number(card_lines)
+        if cell_id is None:
+            return
+        surfaces = {
+            int(mg.SURFACE_REFERENCE_PATTERN.fullmatch(token.text).group(2))
+            for token in tokens
+            if token.kind == "surface"
+        }
+        self.cell_ids.append(cell_id)
+        self.cell_surfaces.append(sorted(surfaces))
+        self.cell_depths.append(mg.get_geometry_depth(mg.parse_cell_geometry(tokens)))
+
+    def get_cell_table(self) -> pd.DataFrame:
+        """
+        Returns a row per cell with its component, number of surfaces, depth of the
+        Boolean expression and number of tori and GQ surfaces.
+        """
+        components = [self.cell_id_index.find(cell_id) for cell_id in self.cell_ids]
+        cells = pd.DataFrame(
+            {
+                "CELL": self.cell_ids,
+                "Component ID": [
+                    None if c is None else self.cell_id_index.component_ids[c]
+                    for c in components
+                ],
+                "SURFACES": [len(surfaces) for surfaces in self.cell_surfaces],
+                "DEPTH": self.cell_depths,
+            }
+        )
+        references = self._get_surface_references()
+        kinds = references.groupby("CELL")[["TORI", "GQ"]].sum()
+        cells = cells.join(kinds, on="CELL")
+        cells[["TORI", "GQ"]] = cells[["TORI", "GQ"]].fillna(0).astype(int)
+        return cells
+
+    def get_component_table(self, cells: pd.DataFrame) -> pd.DataFrame:
+        """
+        Returns a row per csv component with its hierarchy, the number of cells and
+        their total surfaces, the number of different surfaces, tori and GQs, and the
+        maximum depth. The components are ranked by the RANK_BY column.
+        """
+        cells = cells.dropna(subset=["Component ID"])
+        components = cells.groupby("Component ID").agg(
+            CELLS=("CELL", "size"),
+            SURFACES=("SURFACES", "sum"),
+            MAX_DEPTH=("DEPTH", "max"),
+        )
+
+        # Surfaces shared by several cells of the component are counted once
+        references = self._get_surface_references().merge(
+            cells[["CELL", "Component ID"]], on="CELL"
+        )
+        references = references.drop_duplicates(["Component ID", "SURFACE"])
+        unique = references.groupby("Component ID").agg(
+            UNIQUE_SURFACES=("SURFACE", "size"), TORI=("TORI", "sum"), GQ=("GQ", "sum")
+        )
+        components = components.join(unique).fillna(0).astype(int)
+
+        level_keys = [key for key in self.csv.keys() if "Level" in key]
+        hierarchy = self.csv[level_keys + ["Component ID", "MATERIAL"]]
+        components = hierarchy.merge(components, on="Component ID")
+        components = components.sort_values(RANK_BY, ascending=False, kind="stable")
+        components.insert(0, "RANK", range(1, len(components) + 1))
+        return components
+
+    def _get_surface_references(self) -> pd.DataFrame:
+        references = pd.DataFrame(
+            {
+                "CELL": [
+                    cell_id
+                    for cell_id, surfaces in zip(self.cell_ids, self.cell_surfaces)
+                    for _ in surfaces
+                ],
+                "SURFACE": [s for surfaces in self.cell_surfaces for s in surfaces],
+            }
+        )
+        mnemonics = references["SURFACE"].map(self.surface_mnemonics)
+        references["TORI"] = mnemonics.isin(TORUS_MNEMONICS).astype(int)
+        references["GQ"] = (mnemonics == "GQ").astype(int)
+        return references
+
+    def get_unused_surfaces(self) -> list[int]:
+        """
+        Returns the surfaces that are not referenced by the geometry of any cell nor
+        by the data cards (e.g. surface tallies or the SUR of SDEF).
+        """
+        used = {surface for surfaces in self.cell_surfaces for surface in surfaces}
+        used |= self.data_surfaces
+        return sorted(set(self.surface_mnemonics) - used)
+
+    def remove_unused_surfaces(self, unused_surfaces: list[int]) -> None:
+        """
+        Writes a copy of the MCNP input file without the unused surfaces.
+        """
+        unused_surfaces = set(unused_surfaces)
+        with (
+            open(self.input_data.mcnp_input_filepath, errors="replace") as infile,
+            open(self.input_data.pruned_filepath, "w") as outfile,
+        ):
+            for block, card_lines in iter_cards(infile):
+                if block == "surface":
+                    if mg.get_card_number(card_lines) in unused_surfaces:
+                        continue
+                outfile.writelines(card_lines)
+
+
+def main():
+    profiler = DeckProfiler(InputData())
+    profiler.read_deck()
+
+    cells = profiler.get_cell_table()
+    cells.to_csv(profiler.input_data.cells_filepath, index=False)
+    components = profiler.get_component_table(cells)
+    components.to_csv(profiler.input_data.components_filepath, index=False)
+    print(f"Most complex components by {RANK_BY}:")
+    print(components.head(TOP_COMPONENTS).to_string(index=False))
+    print(f"Profiles written to {profiler.input_data.components_filepath}")
+
+    unused_surfaces = profiler.get_unused_surfaces()
+    print(f"{len(unused_surfaces)} surfaces are not used by any cell or data card.")
+    if unused_surfaces and profiler.input_data.remove_unused_surfaces:
+        profiler.remove_unused_surfaces(unused_surfaces)
+        print(f"Deck without them written to {profiler.input_data.pruned_filepath}")
+
+
+if __name__ == "__main__":
+    main()
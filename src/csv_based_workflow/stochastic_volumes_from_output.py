@@ -0,0 +1,196 @@
+import re
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from mcnp_materials_from_csv import CellIdIndex
+
+MCNP_OUTPUT_FILEPATH = "testing.mcnpo"
+CSV_FILEPATH = "testing.csv"
+FIRST_CELL_ID = 1
+VOLUMES_FROM = "TALLY"  # "TALLY" for a stochastic volume tally, "TABLE" for table 60
+TALLY_NUMBER = 4  # F4 tally whose results are the volumes of the cells
+MAX_RELATIVE_ERROR = 0.01  # Components with a larger error are reported
+
+CELL_TABLE_ROW_PATTERN = re.compile(r"\s+\d+\s+(\d+)\s+\d+\s+\S+\s+\S+\s+(\S+)\s")
+TALLY_CELL_PATTERN = re.compile(r"\s*cell\s+(\d+)\s*")
+TALLY_RESULT_PATTERN = re.compile(r"\s*(?:total\s+)?(\S+)\s+(\d+\.\d+)\s*")
+
+
+@dataclass
+class InputData:
+    """
+    Holds the input data for the reader taking the default values from the module
+    """
+
+    mcnp_output_filepath: str = MCNP_OUTPUT_FILEPATH
+    csv_filepath: str = CSV_FILEPATH
+    first_cell_id: int = FIRST_CELL_ID
+    volumes_from: str = VOLUMES_FROM
+    tally_number: int = TALLY_NUMBER
+
+
+class StochasticVolumeReader:
+    """
+    Fills the STOCHASTIC VOLUME and DCF=ORG/STOCH columns of the csv with the
+    volumes of the cells found in an MCNP output file. The output file is read line
+    by line, only the volume of each cell is kept in memory.
+    """
+
+    def __init__(self, input_data: InputData):
+        self.input_data = input_data
+        # Read as text so the columns that are not updated are written back as is
+        self.csv = pd.read_csv(
+            input_data.csv_filepath, dtype=str, keep_default_na=False
+        )
+        self.cell_id_index = CellIdIndex.from_csv(
+            self.csv, input_data.first_cell_id - 1
+        )
+
+    def read_output(self) -> pd.DataFrame:
+        """
+        Returns a row per cell with its volume and relative error. If the volumes
+        are printed several times (e.g. at every dump) the last ones are kept.
+        """
+        if self.input_data.volumes_from not in ("TALLY", "TABLE"):
+            raise ValueError(
+                f"VOLUMES_FROM should be TALLY or TABLE, not "
+                f"{self.input_data.volumes_from}!"
+            )
+        volumes = {}
+        with open(self.input_data.mcnp_output_filepath, errors="replace") as infile:
+            if self.input_data.volumes_from == "TALLY":
+                results = iter_tally_volumes(infile, self.input_data.tally_number)
+            else:
+                results = (
+                    (cell_id, volume, 0.0)
+                    for cell_id, volume in iter_cell_table_volumes(infile)
+                )
+            for cell_id, volume, error in results:
+                volumes[cell_id] = (volume, error)
+
+        values = np.array(list(volumes.values()), dtype=np.float64).reshape(-1, 2)
+        return pd.DataFrame(
+            {
+                "CELL": np.fromiter(volumes, dtype=np.int64, count=len(volumes)),
+                "VOLUME": values[:, 0],
+                "ERROR": values[:, 1],
+            }
+        )
+
+    def get_component_volumes(self, cells: pd.DataFrame) -> pd.DataFrame:
+        """
+        Returns a row per csv component with cells in the output: the sum of their
+        volumes, the relative error of the sum and the DCF. Cells with a volume of 0
+        were not calculated by MCNP and make the whole component unknown.
+        """
+        positions = self.cell_id_index.find_all(cells["CELL"].to_numpy())
+        found = positions >= 0
+        positions = positions[found]
+        volumes = cells["VOLUME"].to_numpy()[found]
+        variances = (volumes * cells["ERROR"].to_numpy()[found]) ** 2
+
+        n_components = len(self.cell_id_index)
+        totals = np.bincount(positions, weights=volumes, minlength=n_components)
+        variances = np.bincount(positions, weights=variances, minlength=n_components)
+        n_cells = np.bincount(positions, minlength=n_components)
+        n_uncalculated = np.bincount(
+            positions, weights=volumes <= 0, minlength=n_components
+        )
+
+        calculated = (n_cells > 0) & (n_uncalculated == 0)
+        totals = totals[calculated]
+        components = pd.DataFrame(
+            {
+                "Component ID": self.cell_id_index.component_ids[calculated],
+                "STOCHASTIC VOLUME": totals,
+                "ERROR": np.sqrt(variances[calculated]) / totals,
+            }
+        )
+        original_volumes = (
+            self.csv.set_index("Component ID")["ORIGINAL VOLUME [cm3]"]
+            .reindex(components["Component ID"])
+            .to_numpy()
+        )
+        original_volumes = pd.to_numeric(original_volumes, errors="coerce")
+        components["DCF=ORG/STOCH"] = original_volumes / totals
+        return components
+
+    def update_csv(self, components: pd.DataFrame) -> None:
+        """
+        Overwrites the csv with the stochastic volumes and DCFs of the components.
+        The DCF is left empty when the original volume is unknown.
+        """
+        rows = self.csv["Component ID"].isin(components["Component ID"])
+        components = components.set_index("Component ID").loc[
+            self.csv.loc[rows, "Component ID"]
+        ]
+        self.csv.loc[rows, "STOCHASTIC VOLUME"] = (
+            components["STOCHASTIC VOLUME"].to_numpy().astype(str)
+        )
+        dcfs = components["DCF=ORG/STOCH"].to_numpy()
+        self.csv.loc[rows, "DCF=ORG/STOCH"] = np.where(
+            np.isnan(dcfs), "", dcfs.astype(str)
+        )
+        self.csv.to_csv(self.input_data.csv_filepath, index=False)
+
+
+def iter_tally_volumes(
+    lines: Iterable[str], tally_number: int
+) -> Iterator[tuple[int, float, float]]:
+    """
+    Yields the cell, result and relative error of the cells of an F4 tally of the
+    output. With SD 1 for every cell the result of the tally is the volume of the
+    cell. Bins other than the cells (e.g. energy) are summed in the total line.
+    """
+    in_tally = False
+    cell_id = None
+    for line in lines:
+        if line.startswith("1"):  # New page of the output
+            words = line.split()
+            in_tally = words[0] == "1tally" and words[1:2] == [str(tally_number)]
+            cell_id = None
+        elif not in_tally:
+            continue
+        elif match := TALLY_CELL_PATTERN.fullmatch(line):
+            cell_id = int(match.group(1))
+        elif cell_id is not None and (match := TALLY_RESULT_PATTERN.fullmatch(line)):
+            yield cell_id, float(match.group(1)), float(match.group(2))
+            cell_id = None
+
+
+def iter_cell_table_volumes(lines: Iterable[str]) -> Iterator[tuple[int, float]]:
+    """
+    Yields the cell and volume of the rows of the cells table (print table 60) of the
+    output. MCNP prints a volume of 0 for the cells it cannot calculate.
+    """
+    in_table = False
+    for line in lines:
+        if line.startswith("1"):  # New page of the output
+            in_table = line.startswith("1cells") and "print table 60" in line
+        elif not in_table:
+            continue
+        elif line.lstrip().startswith("total"):
+            in_table = False
+        elif match := CELL_TABLE_ROW_PATTERN.match(line):
+            yield int(match.group(1)), float(match.group(2))
+
+
+def main():
+    reader = StochasticVolumeReader(InputData())
+    cells = reader.read_output()
+    print(f"{len(cells)} cell volumes were read from the MCNP output.")
+    components = reader.get_component_volumes(cells)
+    reader.update_csv(components)
+    print(f"The volume of {len(components)} components was written to the csv.")
+
+    uncertain = components[components["ERROR"] > MAX_RELATIVE_ERROR]
+    if not uncertain.empty:
+        print(f"Components with a relative error above {MAX_RELATIVE_ERROR}:")
+        print(uncertain.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
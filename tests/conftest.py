@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The scripts of the csv workflow are run from their folder and import each other
+sys.path.insert(0, str(Path(__file__).parents[1] / "src" / "csv_based_workflow"))
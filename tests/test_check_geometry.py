@@ -0,0 +1,71 @@
+import numpy as np
+
+import check_geometry as cg
+from test_mcnp_materials_from_csv import CSV_HEADER
+
+
+def test_overlaps_and_gaps_are_found(tmp_path):
+    mcnp_input_filepath = tmp_path / "deck.mcnp"
+    mcnp_input_filepath.write_text(
+        "Deck with two overlapping spheres and a hole\n"
+        "1 0 -1 imp:n=1\n"
+        "2 0 -2 imp:n=1\n"
+        "3 0 -3 1 2 4 imp:n=1\n"
+        "4 0 3 imp:n=0\n"
+        "\n"
+        "1 so 2\n"
+        "2 sx 3 2\n"
+        "3 rpp -5 5 -5 5 -5 5\n"
+        "4 s 4.5 1.5 1.5 0.4\n"
+        "\n"
+        "nps 10\n"
+    )
+    csv_filepath = tmp_path / "deck.csv"
+    csv_filepath.write_text(
+        CSV_HEADER
+        + 'A,B,Comp1,Water,,1.0,"[1, 1]",,,,,,\n'
+        + 'A,C,Comp2,Water,,1.0,"[2, 2]",,,,,,\n'
+    )
+    checker = cg.GeometryChecker(
+        cg.InputData(
+            str(mcnp_input_filepath), str(csv_filepath), n_points=100_000, processes=1
+        )
+    )
+    overlaps, gaps, n_unchecked = checker.check()
+
+    assert n_unchecked == 0
+    points = overlaps[["X", "Y", "Z"]].to_numpy()
+    assert len(points) > 0
+    assert np.all(np.linalg.norm(points, axis=1) < 2)
+    assert np.all(np.linalg.norm(points - [3, 0, 0], axis=1) < 2)
+    assert set(zip(overlaps["CELL A"], overlaps["CELL B"])) <= {(1, 2), (2, 1)}
+    assert set(overlaps["COMPONENT A"]) | set(overlaps["COMPONENT B"]) == {
+        "Comp1",
+        "Comp2",
+    }
+
+    points = gaps[["X", "Y", "Z"]].to_numpy()
+    assert len(points) > 0
+    assert np.all(np.linalg.norm(points - [4.5, 1.5, 1.5], axis=1) < 0.4)
+    # The hole is in a corner of the box of cell 2, the smallest one around it
+    assert set(gaps["CELL"]) == {2}
+    assert set(gaps["COMPONENT"]) == {"Comp2"}
+
+    components = checker.get_component_table(overlaps, gaps)
+    assert components["Component ID"].tolist() == ["Comp2", "Comp1"]
+    assert components["Level 1"].tolist() == ["C", "B"]
+    assert components["OVERLAPS"].tolist() == [len(overlaps)] * 2
+    assert components["GAPS"].tolist() == [len(gaps), 0]
+
+
+def test_the_voxel_grid_finds_the_points_of_a_box():
+    rng = np.random.default_rng(0)
+    low, high = np.zeros(3), np.array([1.0, 2.0, 3.0])
+    points = rng.uniform(low, high, size=(10_000, 3))
+    grid = cg._VoxelGrid(points, low, high)
+
+    for bounds in ([[0.1, 0.5, 0.0], [0.3, 1.9, 1.2]], [[-1, -1, -1], [5, 5, 5]]):
+        bounds = np.array(bounds)
+        inside = np.all((points >= bounds[0]) & (points <= bounds[1]), axis=1)
+        assert sorted(grid.get_points_in_box(bounds)) == np.flatnonzero(inside).tolist()
+    assert len(grid.get_points_in_box(np.array([[1, 1, 1], [0, 0, 0]]))) == 0
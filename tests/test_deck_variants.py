@@ -0,0 +1,69 @@
+import pytest
+
+import deck_variants as dv
+from test_mcnp_materials_from_csv import CSV_HEADER, TAB_DECK, run_mode, write_inputs
+
+CSV_ROWS = (
+    'A,B,Coolant1,Water,,1.0,"[1, 1]",,,,,,\n'
+    'A,B,Coolant2,Water,,1.0,"[201, 201]",,,,,,\n'
+    'A,C,Shield,Water,,2.0,"[2, 2]",,,,,,\n'
+)
+VARIANTS = (
+    "VARIANT,Component ID,MATERIAL,DENSITY [g/cm3],DENSITY FACTOR\n"
+    "helium,Coolant*,Helium,,\n"
+    "dense,Shield,,3.0,0.5\n"
+    "dense,Coolant2,,,1.5\n"
+    "dense,Blanket*,Steel,,\n"
+)
+
+
+def get_generator(folder, variants):
+    input_data = write_inputs(folder, TAB_DECK, CSV_ROWS)
+    variants_filepath = folder / "variants.csv"
+    variants_filepath.write_text(variants)
+    generator = dv.DeckVariantGenerator(
+        dv.InputData(
+            input_data.mcnp_input_filepath,
+            input_data.csv_filepath,
+            input_data.material_ids_filpath,
+            variants_filepath=str(variants_filepath),
+            processes=2,
+        )
+    )
+    return generator, input_data
+
+
+def test_variants_are_the_decks_of_the_csv_with_the_overrides(tmp_path, capsys):
+    generator, input_data = get_generator(tmp_path, VARIANTS)
+    variants = dict(generator.write_variants())
+
+    assert "No component matches Blanket* in the variant dense." in (
+        capsys.readouterr().out
+    )
+    assert variants == {
+        generator.input_data.get_variant_filepath("helium"): {"Helium": 6, "Water": 5},
+        generator.input_data.get_variant_filepath("dense"): {"Water": 5},
+    }
+    overridden_rows = {
+        "helium": CSV_ROWS.replace("Coolant1,Water", "Coolant1,Helium").replace(
+            "Coolant2,Water", "Coolant2,Helium"
+        ),
+        "dense": CSV_ROWS.replace("Shield,Water,,2.0", "Shield,Water,,1.5").replace(
+            "Coolant2,Water,,1.0", "Coolant2,Water,,1.5"
+        ),
+    }
+    for variant, csv_rows in overridden_rows.items():
+        (tmp_path / "deck.csv").write_text(CSV_HEADER + csv_rows)
+        with open(generator.input_data.get_variant_filepath(variant)) as infile:
+            assert infile.read() == run_mode(input_data, "memory_map"), variant
+
+
+def test_invalid_overrides_are_reported(tmp_path):
+    generator, _ = get_generator(
+        tmp_path,
+        "VARIANT,Component ID,MATERIAL,DENSITY [g/cm3],DENSITY FACTOR\n"
+        "light,Shield,,,half\n",
+    )
+
+    with pytest.raises(ValueError, match="Invalid value half in the variant light"):
+        generator.write_variants()
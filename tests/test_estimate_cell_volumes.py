@@ -0,0 +1,48 @@
+import numpy as np
+
+import estimate_cell_volumes as ev
+from test_mcnp_materials_from_csv import CSV_HEADER
+
+
+def test_small_cells_are_sampled_with_the_points_they_need(tmp_path):
+    mcnp_input_filepath = tmp_path / "deck.mcnp"
+    mcnp_input_filepath.write_text(
+        "Deck with a large and a small sphere\n"
+        "1 0 -1 imp:n=1\n"
+        "2 0 -2 imp:n=1\n"
+        "3 0 1 2 -3 imp:n=1\n"
+        "4 0 3 imp:n=0\n"
+        "\n"
+        "1 so 50\n"
+        "2 s 80 0 0 1\n"
+        "3 so 100\n"
+        "\n"
+        "nps 10\n"
+    )
+    csv_filepath = tmp_path / "deck.csv"
+    csv_filepath.write_text(
+        CSV_HEADER
+        + 'A,B,Comp1,Water,,1.0,"[1, 1]",,,,,,\n'
+        + 'A,C,Comp2,Water,,1.0,"[2, 2]",,,,,,\n'
+    )
+    estimator = ev.CellVolumeEstimator(
+        ev.InputData(
+            str(mcnp_input_filepath),
+            str(csv_filepath),
+            target_relative_error=0.02,
+            processes=1,
+        )
+    )
+    boxes = estimator.get_sampling_boxes()
+    cells = estimator.estimate_volumes().set_index("CELL")
+
+    assert estimator.get_first_batch_size(boxes[1]) == 12_500
+    assert estimator.get_first_batch_size(boxes[2]) == ev.MIN_BATCH_SIZE
+    for cell_id, radius in ((1, 50), (2, 1)):
+        volume = 4 / 3 * np.pi * radius**3
+        assert cells.loc[cell_id, "ERROR"] <= 0.02
+        assert abs(cells.loc[cell_id, "VOLUME"] / volume - 1) < 4 * 0.02
+    # The first batch of the large sphere is enough, the small one needs about
+    # (1 - 0.52) / (0.52 * 0.02**2) points as it fills 52% of its box
+    assert cells.loc[1, "SAMPLES"] == 12_500
+    assert cells.loc[2, "SAMPLES"] < 4_000
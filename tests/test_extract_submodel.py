@@ -0,0 +1,61 @@
+import pytest
+
+import extract_submodel as es
+from test_mcnp_materials_from_csv import CSV_HEADER
+
+DECK = (
+    "Deck with an assembly\n"
+    "1 3 -7.9 -1 imp:n=1\n"
+    "2 like 1 but mat=4 rho=-1.0\n"
+    "3 0 -4 imp:n=1 u=5\n"
+    "4 0 1 -2 3 imp:n=1\n"
+    "5 0 2 imp:n=0\n"
+    "\n"
+    "1 so 1\n"
+    "2 so 50\n"
+    "3 s 20 0 0 1\n"
+    "4 so 2\n"
+    "\n"
+    "mode n\n"
+    "m3 26000 1\n"
+    "sdef pos=0 0 0\n"
+    "nps 10\n"
+)
+
+
+def get_extractor(folder, csv_rows):
+    mcnp_input_filepath = folder / "deck.mcnp"
+    mcnp_input_filepath.write_text(DECK)
+    csv_filepath = folder / "deck.csv"
+    csv_filepath.write_text(CSV_HEADER + csv_rows)
+    return es.SubModelExtractor(
+        es.InputData(str(mcnp_input_filepath), str(csv_filepath), assembly="Coils")
+    )
+
+
+def test_extracted_cells_keep_the_cards_they_depend_on(tmp_path):
+    extractor = get_extractor(
+        tmp_path,
+        'A,Coils,Comp1,Water,,1.0,"[2, 2]",,,,,,\n'
+        'A,Shield,Comp2,Water,,1.0,"[4, 4]",,,,,,\n',
+    )
+    sub_model = extractor.extract(extractor.get_selected_cells())
+    extractor.write_submodel(sub_model)
+
+    assert list(sub_model.cells) == [1, 2]
+    assert sub_model.added_cells == [1]
+    assert list(sub_model.surfaces) == [1]
+    with open(extractor.input_data.output_filepath) as infile:
+        output = infile.read()
+    assert output.startswith("Sub-model of")
+    assert "3 0 -2 #1 #2 imp:n=1\n4 0 2 imp:n=0\n" in output
+    assert "mode n\nm3 26000 1\nVOID\nSDEF SUR=2 NRM=-1\n" in output
+    assert "sdef pos" not in output
+
+
+def test_a_sub_model_only_in_universes_cannot_be_written(tmp_path):
+    extractor = get_extractor(tmp_path, 'A,Coils,Comp1,Water,,1.0,"[3, 3]",,,,,,\n')
+    sub_model = extractor.extract(extractor.get_selected_cells())
+
+    with pytest.raises(ValueError, match="main geometry"):
+        extractor.write_submodel(sub_model)
@@ -0,0 +1,62 @@
+import numpy as np
+
+import lost_particles as lp
+from test_mcnp_materials_from_csv import CSV_HEADER
+
+
+def test_the_hierarchy_finds_the_boxes_close_to_each_point():
+    rng = np.random.default_rng(0)
+    corners = rng.uniform(0, 10, size=(200, 3))
+    boxes = np.stack([corners, corners + rng.uniform(0, 1, size=(200, 3))], axis=1)
+    points = rng.uniform(-1, 12, size=(500, 3))
+    hierarchy = lp.BoundingVolumeHierarchy(boxes)
+    point_indices, box_indices = hierarchy.query(points, 0.2)
+
+    close = np.all(
+        (points[:, None] >= boxes[:, 0] - 0.2) & (points[:, None] <= boxes[:, 1] + 0.2),
+        axis=2,
+    )
+    assert sorted(zip(point_indices, box_indices)) == list(zip(*np.nonzero(close)))
+
+
+def test_lost_particles_are_located_in_cells_and_components(tmp_path):
+    mcnp_input_filepath = tmp_path / "deck.mcnp"
+    mcnp_input_filepath.write_text(
+        "Deck with two spheres and a hole\n"
+        "1 0 -1 imp:n=1\n"
+        "2 0 -2 imp:n=1\n"
+        "3 0 -3 1 2 4 imp:n=1\n"
+        "4 0 3 imp:n=0\n"
+        "\n"
+        "1 so 2\n"
+        "2 sx 5 1\n"
+        "3 rpp -10 10 -10 10 -10 10\n"
+        "4 s 5.8 0.8 0.8 0.1\n"
+        "\n"
+        "nps 10\n"
+    )
+    csv_filepath = tmp_path / "deck.csv"
+    csv_filepath.write_text(
+        CSV_HEADER
+        + 'A,B,Comp1,Water,,1.0,"[1, 1]",,,,,,\n'
+        + 'A,C,Comp2,Steel,,1.0,"[2, 2]",,,,,,\n'
+    )
+    points_filepath = tmp_path / "lost.csv"
+    points_filepath.write_text(
+        "x,y,z,history\n0,0,0,1\n5.5,0,0,2\n5.8,0.8,0.8,3\n30,0,0,4\n"
+    )
+    locator = lp.LostParticleLocator(
+        lp.InputData(str(mcnp_input_filepath), str(csv_filepath), str(points_filepath))
+    )
+    points = locator.locate(locator.read_points())
+
+    assert points["CELL"].tolist() == [1, 2, 2, 4]
+    # The hole is in none of the cells, the smallest box around it is the one of 2
+    assert points["INSIDE"].tolist() == [True, True, False, True]
+    assert points["COMPONENT"].tolist() == ["Comp1", "Comp2", "Comp2", "-"]
+
+    components = locator.get_component_histogram(points)
+    assert components["Component ID"].tolist() == ["Comp2", "-", "Comp1"]
+    assert components["MATERIAL"].tolist()[::2] == ["Steel", "Water"]
+    assert components["LOST"].tolist() == [2, 1, 1]
+    assert components["INSIDE"].tolist() == [1, 1, 1]
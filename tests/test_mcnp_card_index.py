@@ -0,0 +1,63 @@
+import pytest
+
+import mcnp_card_index as ci
+from test_mcnp_materials_from_csv import TAB_DECK
+
+DECK = TAB_DECK.replace("mode\tn\n", "mode\tn\nf4:n 1 2\nM5 1001 2 $ Water\n")
+
+
+def test_cards_are_read_from_their_position(tmp_path):
+    mcnp_input_filepath = tmp_path / "deck.mcnp"
+    mcnp_input_filepath.write_text(DECK)
+    index = ci.CardIndex.for_deck(str(mcnp_input_filepath))
+
+    assert index == ci.CardIndex.load(str(mcnp_input_filepath) + ci.CARD_INDEX_SUFFIX)
+    assert index.read_card(str(mcnp_input_filepath), "cell", 202) == (
+        "202 0 -1\t4 &\n\t5 imp:n=1\n"
+    )
+    assert index.read_cards(str(mcnp_input_filepath), "cell", [1, 7]) == {
+        1: "1 3 -7.9 -1 2\n     $ geouned comment\n     imp:n=1\n",
+        7: None,
+    }
+    assert index.read_card(str(mcnp_input_filepath), "surface", 1) == "1 so\t5\n"
+    assert index.read_card(str(mcnp_input_filepath), "data", "f4") == "f4:n 1 2\n"
+    assert index.read_card(str(mcnp_input_filepath), "data", "m5").startswith("M5")
+    with pytest.raises(KeyError):
+        index.read_card(str(mcnp_input_filepath), "data", "m6")
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "201\t0 -1 4\n\timp:n=1\n",  # Same length, written in place
+        "201 0 -1 3 -4 -5\n     imp:n=1 vol=1\n",
+        "201 0 -1",
+        "205 0 -1 3\n",  # New number
+    ],
+)
+def test_replaced_cards_keep_the_index_up_to_date(tmp_path, text):
+    mcnp_input_filepath = tmp_path / "deck.mcnp"
+    mcnp_input_filepath.write_text(DECK)
+    index = ci.CardIndex.for_deck(str(mcnp_input_filepath))
+    index.replace_card(str(mcnp_input_filepath), "cell", 201, text)
+
+    new_card = text if text.endswith("\n") else text + "\n"
+    new_deck = DECK.replace("201\t0 -1 3\n\timp:n=1\n", new_card)
+    assert mcnp_input_filepath.read_text() == new_deck
+    assert index == ci.CardIndex.build(str(mcnp_input_filepath))
+    assert index == ci.CardIndex.for_deck(str(mcnp_input_filepath))
+    new_id = text.split()[0]
+    assert index.read_card(str(mcnp_input_filepath), "cell", new_id) == new_card
+    assert index.read_card(str(mcnp_input_filepath), "data", "m5").startswith("M5")
+
+
+def test_an_outdated_index_is_not_used_to_replace_cards(tmp_path):
+    mcnp_input_filepath = tmp_path / "deck.mcnp"
+    mcnp_input_filepath.write_text(DECK)
+    index = ci.CardIndex.for_deck(str(mcnp_input_filepath))
+    mcnp_input_filepath.write_text("New title\n" + DECK)
+
+    with pytest.raises(ValueError, match="outdated"):
+        index.replace_card(str(mcnp_input_filepath), "cell", 201, "201 0 -1\n")
+    index = ci.CardIndex.for_deck(str(mcnp_input_filepath))
+    assert index.find("cell", 201)[0] == DECK.index("201") + len("New title\n")
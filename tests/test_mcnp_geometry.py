@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import mcnp_geometry as mg
+
+# Surface card and a point on its negative and positive sides
+SURFACES = [
+    ("1 px 2", (1, 0, 0), (3, 0, 0)),
+    ("1 p 1 1 0 2", (0, 0, 0), (2, 2, 0)),
+    ("1 so 2", (1, 1, 0), (2, 1, 0)),
+    ("1 s 5 0 0 1", (5, 0, 0.9), (5, 0, 1.1)),
+    ("1 sy 3 1", (0, 3.5, 0), (0, 4.5, 0)),
+    ("1 cz 1", (0.5, 0.5, 100), (1, 1, 0)),
+    ("1 c/x 1 1 1", (100, 1, 1.5), (0, 0, 0)),
+    ("1 kz 0 1", (0.5, 0, 1), (1.5, 0, -1)),
+    ("1 kz 0 1 1", (0.5, 0, 1), (0.5, 0, -1)),
+    ("1 tz 0 0 0 5 1 1", (5, 0, 0.5), (5, 0, 1.5)),
+    ("1 gq 1 1 1 0 0 0 0 0 0 -4", (1, 1, 1), (2, 1, 0)),
+    ("1 sq 1 1 1 0 0 0 -1 3 0 0", (3, 0.5, 0), (3, 0, 1.1)),
+    ("1 rpp 0 1 0 2 0 3", (0.5, 1.5, 2.5), (0.5, 2.5, 2.5)),
+    ("1 sph 0 0 1 1", (0, 0, 1.5), (0, 0, 2.5)),
+    ("1 rcc 0 0 0 0 0 2 1", (0.5, 0, 1.5), (0.5, 0, 2.5)),
+]
+
+DECK = [
+    ("cell", ["1 3 -7.9 -1 2\n"]),
+    ("cell", ["2 0 -3 (-2 : 4)\n"]),
+    ("cell", ["3 like 1 but mat=4\n"]),
+    ("cell", ["4 0 3 imp:n=0 u=1\n"]),
+    ("cell", ["5 0 -3 #2 trcl=(1 0 0)\n"]),
+    ("surface", ["1 so 5\n"]),
+    ("surface", ["2 so 2\n"]),
+    ("surface", ["3 rpp -10 10 -10 10 -10 10\n"]),
+    ("surface", ["4 px 8\n"]),
+]
+
+
+@pytest.mark.parametrize("card, inside, outside", SURFACES)
+def test_surfaces_are_negative_on_their_negative_side(card, inside, outside):
+    surface = mg.parse_surface_card([card])
+    values = mg.evaluate_surface(surface, np.array([inside, outside], dtype=float))
+
+    assert values[0] < 0 < values[1]
+
+
+@pytest.mark.parametrize("card", ["1 p 0 0 0 1 0 0 0 1 0", "1 box 0 0 0 1 0 0"])
+def test_unsupported_surfaces_raise(card):
+    with pytest.raises(ValueError, match="not supported"):
+        mg.evaluate_surface(mg.parse_surface_card([card]), np.zeros((1, 3)))
+
+
+def test_cells_are_evaluated_on_arrays_of_points():
+    geometry = mg.Geometry.from_cards(DECK)
+    points = np.array([[0, 0, 0], [3, 0, 0], [9, 0, 0], [11, 0, 0]], dtype=float)
+
+    assert geometry.contains(1, points).tolist() == [False, True, False, False]
+    assert geometry.contains(2, points).tolist() == [True, False, True, False]
+    assert geometry.contains(3, points).tolist() == [False, True, False, False]
+    assert geometry.contains(4, points).tolist() == [False, False, False, True]
+    assert geometry.cell_materials == {1: 3, 2: 0, 3: 4, 4: 0, 5: 0}
+    assert geometry.cell_parameters[4] == {"imp:n": "0", "u": "1"}
+    with pytest.raises(ValueError, match="cell 5"):
+        geometry.contains(5, points)
+
+
+def test_cell_bounds_come_from_their_surfaces():
+    geometry = mg.Geometry.from_cards(DECK)
+
+    assert geometry.get_bounds(1).tolist() == [[-5, -5, -5], [5, 5, 5]]
+    assert geometry.get_bounds(3).tolist() == [[-5, -5, -5], [5, 5, 5]]
+    # Inside the box and either inside sphere 2 or beyond the plane x = 8
+    assert geometry.get_bounds(2).tolist() == [[-2, -10, -10], [10, 10, 10]]
+    assert geometry.get_world_bounds().tolist() == [[-10, -10, -10], [10, 10, 10]]
+
+
+def test_periodic_partners_are_not_merged():
+    surfaces = [
+        mg.parse_surface_card([text])
+        for text in ("1 -2 px 0\n", "2 px 10\n", "3 px 10\n", "4 px 0\n", "5 px 0\n")
+    ]
+    replacements = mg.find_duplicate_surfaces(surfaces, 1e-6)
+
+    # 2 is the partner of the periodic 1, so 3 is kept instead of being replaced by it
+    assert replacements == {5: 4}
@@ -0,0 +1,297 @@
+import asyncio
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+
+import pytest
+
+import mcnp_materials_from_csv as mm
+
+CSV_HEADER = (
+    "Level 0,Level 1,Component ID,MATERIAL,MASS [g],DENSITY [g/cm3],CELL IDs,"
+    "ORIGINAL VOLUME [cm3],%dif (ORG-SIM)/ORG*100,SIMPLIFIED VOLUME,"
+    "STOCHASTIC VOLUME,DCF=ORG/STOCH,COMMENT\n"
+)
+
+TAB_DECK = (
+    "Deck with tabs\n"
+    "1 3 -7.9 -1 2\n"
+    "     $ geouned comment\n"
+    "     imp:n=1\n"
+    "201\t0 -1 3\n"
+    "\timp:n=1\n"
+    "202 0 -1\t4 &\n"
+    "\t5 imp:n=1\n"
+    "c comment\twith a tab\n"
+    "2 1 -7.9 -2\t3\n"
+    "\timp:n=1\n"
+    "\n"
+    "1 so\t5\n"
+    "2 so 6\n"
+    "3 so 7\n"
+    "4 so 8\n"
+    "5 so 9\n"
+    "\n"
+    "mode\tn\n"
+    "nps 10\n"
+)
+
+MODES = {
+    "default": {},
+    "streaming": {"streaming": True},
+    "memory_map": {"memory_map": True},
+    "incremental": {"incremental": True},
+    "parallel": {"processes": 2},
+}
+
+
+def write_inputs(folder, deck, csv_rows):
+    mcnp_input_filepath = folder / "deck.mcnp"
+    mcnp_input_filepath.write_text(deck)
+    csv_filepath = folder / "deck.csv"
+    csv_filepath.write_text(CSV_HEADER + csv_rows)
+    material_ids_filepath = folder / "material_ids.csv"
+    material_ids_filepath.write_text("MATERIAL,ID\nVoid,0\nWater,5\n")
+    return mm.InputData(
+        str(mcnp_input_filepath), str(csv_filepath), str(material_ids_filepath)
+    )
+
+
+def run_mode(input_data, mode):
+    processor = mm.Processor(mm.InputData(**{**vars(input_data), **MODES[mode]}))
+    processor.run()
+    with open(input_data.output_filepath) as infile:
+        return infile.read()
+
+
+def test_all_modes_write_the_same_deck(tmp_path):
+    csv_rows = 'A,B,Comp1,Water,,1.0,"[1, 2]",,,,,,\n'
+    input_data = write_inputs(tmp_path, TAB_DECK, csv_rows)
+    outputs = {mode: run_mode(input_data, mode) for mode in MODES}
+
+    for mode, output in outputs.items():
+        assert output == outputs["memory_map"], mode
+    # The cards that are not modified keep their tabs
+    assert "201\t0 -1 3\n\timp:n=1\n" in outputs["default"]
+    assert "mode\tn\n" in outputs["default"]
+    assert "2 5 -1.0000e+00 $ Comp1 - B\n" in outputs["default"]
+    assert "geouned" not in outputs["default"]
+
+
+def test_only_the_default_mode_drops_the_text_after_the_data_block(tmp_path):
+    csv_rows = 'A,B,Comp1,Water,,1.0,"[1, 2]",,,,,,\n'
+    deck = TAB_DECK + "\nnotes after the data block\n"
+    input_data = write_inputs(tmp_path, deck, csv_rows)
+    outputs = {mode: run_mode(input_data, mode) for mode in MODES}
+
+    assert "notes" not in outputs["default"]
+    for mode, output in outputs.items():
+        if mode != "default":
+            assert output.endswith("nps 10\n\nnotes after the data block\n"), mode
+
+
+def test_mapped_cards_are_the_streamed_cards(tmp_path):
+    deck = TAB_DECK.replace("nps 10\n", "") + (
+        "c\r\n"
+        "   c x &\n"
+        "f4:n 1 &\n"
+        "     $ geouned &\n"
+        "  cx 1\n"
+        "fc4 a & b\n"
+        "2 0 1 $ comment &\n"
+        "     5 &\n"
+        "\t\n"
+        "nps 10"
+    )
+    mcnp_input_filepath = tmp_path / "deck.mcnp"
+    mcnp_input_filepath.write_text(deck)
+    with open(mcnp_input_filepath, newline="") as infile:
+        cards = mm.iter_cards(mm._strip_geouned_comments(infile))
+        streamed = [(block, "".join(card_lines)) for block, card_lines in cards]
+    with (
+        open(mcnp_input_filepath, "rb") as infile,
+        mm.mmap.mmap(infile.fileno(), 0, access=mm.mmap.ACCESS_READ) as mapped_deck,
+    ):
+        mapped = [
+            (block, b"".join(mapped_deck[start:end] for start, end in spans).decode())
+            for block, spans in mm.iter_mapped_cards(mapped_deck)
+        ]
+    assert mapped == streamed
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_cells_not_in_the_csv_are_copied(tmp_path, mode):
+    csv_rows = 'A,B,Comp1,Water,,1.0,"[1, 1]",,,,,,\n'
+    input_data = write_inputs(tmp_path, TAB_DECK, csv_rows)
+    output = run_mode(input_data, mode)
+    assert "2 1 -7.9 -2\t3\n\timp:n=1\n" in output
+
+
+def test_surfaces_of_the_data_cards_are_not_deduplicated(tmp_path):
+    deck = (
+        "Deck with a surface tally\n"
+        "1 3 -7.9 -1 -2 -3 -4\n"
+        "     imp:n=1\n"
+        "2 0 1:2:3:4 imp:n=0\n"
+        "\n"
+        "1 so 5\n"
+        "2 so 5\n"
+        "3 so 5\n"
+        "4 so 5\n"
+        "\n"
+        "f2:n 2\n"
+        "sdef sur=4\n"
+        "nps 10\n"
+    )
+    input_data = write_inputs(tmp_path, deck, 'A,B,Comp1,Water,,1.0,"[1, 1]",,,,,,\n')
+    input_data.deduplicate_surfaces = True
+    output = run_mode(input_data, "default")
+
+    assert "-1 -2 -1 -4\n" in output
+    assert "2 0 1:2:1:4 imp:n=0\n" in output
+    assert "\n2 so 5\n" in output
+    assert "\n3 so 5\n" not in output
+    assert "\n4 so 5\n" in output
+
+
+def test_the_last_csv_row_wins_when_the_cell_ids_overlap(capsys):
+    csv = mm.pd.DataFrame(
+        {
+            "Component ID": ["A", "B", "C", "D"],
+            "CELL IDs": ["[1, 10]", "[4, 6]", "[9, 12]", "[2, 2]"],
+        }
+    )
+    index = mm.CellIdIndex.from_csv(
+        csv.assign(**{"MATERIAL": "Water", "DENSITY [g/cm3]": 1.0, "DCF=ORG/STOCH": 1})
+    )
+    found = [index.component_ids[index.find(cell_id)] for cell_id in range(1, 13)]
+
+    assert found == ["A", "D", "A", "B", "B", "B", "A", "A", "C", "C", "C", "C"]
+    assert index.find(13) is None
+    assert "overlap" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("text", ["", "MATERIAL,ID\n"])
+def test_new_materials_do_not_get_the_void_id(tmp_path, text):
+    material_ids_filepath = tmp_path / "material_ids.csv"
+    material_ids_filepath.write_text(text)
+    registry = mm.MaterialIdRegistry.from_csv(str(material_ids_filepath))
+
+    assert registry.get_id("Water") == 1
+    assert mm.MaterialIdRegistry(None, {}).get_id("Water") == 1
+
+
+def allocate_ids(material_ids_filepath, material_names, barrier):
+    registry = mm.MaterialIdRegistry.from_csv(material_ids_filepath)
+    barrier.wait()  # All the runs assign their ids at the same time
+    for material_name in material_names:
+        registry.get_id(material_name)
+    return {name: registry[name] for name in material_names}
+
+
+def test_concurrent_runs_agree_on_the_new_material_ids(tmp_path):
+    material_ids_filepath = tmp_path / "material_ids.csv"
+    material_ids_filepath.write_text("MATERIAL,ID\nVoid,0\nWater,5\n")
+    names = [f"Material{number}" for number in range(1000)]
+    orders = [names, names[::-1], names[::2] + names[1::2], names[5:] + names[:5]]
+    with Manager() as manager, ProcessPoolExecutor(len(orders)) as executor:
+        barrier = manager.Barrier(len(orders))
+        filepaths = [str(material_ids_filepath)] * len(orders)
+        runs = list(
+            executor.map(allocate_ids, filepaths, orders, [barrier] * len(orders))
+        )
+
+    for ids in runs:
+        assert ids == runs[0]
+    assert sorted(runs[0].values()) == list(range(6, 1006))
+    registry = mm.MaterialIdRegistry.from_csv(str(material_ids_filepath))
+    assert registry.ids == {"Void": 0, "Water": 5, **runs[0]}
+    assert len(material_ids_filepath.read_text().splitlines()) == 1003
+
+
+def test_batch_decks_get_the_same_material_ids(tmp_path):
+    csv_rows = 'A,B,Comp1,Steel,,1.0,"[1, 2]",,,,,,\n'
+    input_data = write_inputs(tmp_path, TAB_DECK, csv_rows)
+    shifted_deck = tmp_path / "shifted.mcnp"
+    shifted_deck.write_text(TAB_DECK.replace("\n1 3 -7.9", "\n101 3 -7.9"))
+    processor = mm.Processor(input_data)
+    mm.process_decks(
+        processor,
+        [(input_data.mcnp_input_filepath, 1), (str(shifted_deck), 100)],
+        workers=2,
+    )
+
+    with open(input_data.output_filepath) as infile:
+        assert "\n1 6 -1.0000e+00 $ Comp1 - B\n" in infile.read()
+    with open(str(shifted_deck) + "[materials_added]") as infile:
+        output = infile.read()
+    assert "\n101 6 -1.0000e+00 $ Comp1 - B\n" in output
+    # The CELL IDs of the csv become [100, 101] in this deck
+    assert "\n2 1 -7.9 -2\t3\n" in output
+    assert (tmp_path / "material_ids.csv").read_text().endswith("Steel,6\n")
+
+
+def test_incremental_run_after_another_mode(tmp_path):
+    csv_rows = (
+        'A,B,Comp1,Water,,1.0,"[1, 1]",,,,,,\n'
+        'A,C,Comp2,Water,,2.0,"[2, 2]",,,,,,\n'
+    )
+    input_data = write_inputs(tmp_path, TAB_DECK, csv_rows)
+    run_mode(input_data, "incremental")
+    mm.Processor(mm.InputData(**{**vars(input_data), "split_assemblies": True})).run()
+    (tmp_path / "deck.csv").write_text(CSV_HEADER + csv_rows.replace("2.0", "3.0"))
+    output = run_mode(input_data, "incremental")
+
+    assert "READ FILE" not in output
+    assert output == run_mode(input_data, "streaming")
+
+
+def test_split_mode_removes_the_incremental_manifest(tmp_path):
+    csv_rows = 'A,B,Comp1,Water,,1.0,"[1, 2]",,,,,,\n'
+    input_data = write_inputs(tmp_path, TAB_DECK, csv_rows)
+    run_mode(input_data, "incremental")
+    mm.Processor(mm.InputData(**{**vars(input_data), "split_assemblies": True})).run()
+
+    assert not os.path.exists(input_data.manifest_filepath)
+
+
+@pytest.mark.parametrize("flag", ["--split-assemblies", "--deduplicate-surfaces"])
+def test_watch_rejects_the_modes_it_does_not_support(monkeypatch, flag):
+    monkeypatch.setattr(sys, "argv", ["mcnp_materials_from_csv.py", "--watch", flag])
+    with pytest.raises(SystemExit):
+        mm.main()
+
+
+async def wait_for_text(filepath, text, timeout=10):
+    for _ in range(int(timeout / 0.01)):
+        if os.path.exists(filepath):
+            with open(filepath) as infile:
+                if text in infile.read():
+                    return
+        await asyncio.sleep(0.01)
+    raise TimeoutError(f"{text!r} was not written to {filepath}")
+
+
+def test_watch_regenerates_the_deck_when_the_csv_is_saved(tmp_path, capsys):
+    csv_rows = 'A,B,Comp1,Water,,1.0,"[1, 2]",,,,,,\n'
+    input_data = write_inputs(tmp_path, TAB_DECK, csv_rows)
+    processor = mm.Processor(input_data)
+    output_filepath = input_data.output_filepath
+
+    async def edit_while_watching():
+        watcher = asyncio.create_task(mm.watch(processor, interval=0.01))
+        await wait_for_text(output_filepath, "\n2 5 -1.0000e+00 $ Comp1 - B\n")
+        (tmp_path / "deck.csv").write_text("Not a csv of components\n")
+        while "could not be read" not in capsys.readouterr().out:
+            await asyncio.sleep(0.01)
+        (tmp_path / "deck.csv").write_text(CSV_HEADER + csv_rows.replace("1.0", "2.25"))
+        await wait_for_text(output_filepath, "\n2 5 -2.2500e+00 $ Comp1 - B\n")
+        watcher.cancel()
+
+    asyncio.run(asyncio.wait_for(edit_while_watching(), 20))
+
+    with open(output_filepath) as infile:
+        output = infile.read()
+    assert "\n1 5 -2.2500e+00 $ Comp1 - B\n" in output
+    assert output == run_mode(input_data, "streaming")
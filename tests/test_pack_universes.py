@@ -0,0 +1,34 @@
+import pack_universes as pu
+from test_mcnp_materials_from_csv import CSV_HEADER
+
+
+def test_like_cells_crossing_an_envelope_are_not_cut(tmp_path, capsys):
+    mcnp_input_filepath = tmp_path / "deck.mcnp"
+    mcnp_input_filepath.write_text(
+        "Deck with a LIKE n BUT cell\n"
+        "1 0 -1 imp:n=1\n"
+        "2 0 1 -2 3 imp:n=1\n"
+        "3 like 4 but trcl=(-20 0 0)\n"
+        "4 0 -3 imp:n=1\n"
+        "5 0 2 imp:n=0\n"
+        "\n"
+        "1 so 1\n"
+        "2 so 30\n"
+        "3 s 20 0 0 1\n"
+        "\n"
+        "nps 10\n"
+    )
+    csv_filepath = tmp_path / "deck.csv"
+    csv_filepath.write_text(CSV_HEADER + 'A,B,Comp1,Water,,1.0,"[1, 1]",,,,,,\n')
+    packer = pu.UniversePacker(
+        pu.InputData(str(mcnp_input_filepath), str(csv_filepath))
+    )
+    envelopes = packer.pack()
+    packer.write_packed_deck(envelopes)
+
+    assert envelopes == []
+    assert "B was not packed: cell 3 crosses the envelope and is a LIKE 4" in (
+        capsys.readouterr().out
+    )
+    with open(packer.input_data.output_filepath) as infile:
+        assert infile.read() == mcnp_input_filepath.read_text()
@@ -0,0 +1,34 @@
+import profile_mcnp_deck as pmd
+from test_mcnp_materials_from_csv import CSV_HEADER
+
+
+def test_surfaces_of_the_data_cards_are_used(tmp_path):
+    mcnp_input_filepath = tmp_path / "deck.mcnp"
+    mcnp_input_filepath.write_text(
+        "Deck with a surface tally\n"
+        "1 0 -1 imp:n=1\n"
+        "2 0 1 imp:n=0\n"
+        "\n"
+        "1 so 5\n"
+        "2 so 6\n"
+        "3 so 7\n"
+        "4 so 8\n"
+        "5 so 9\n"
+        "\n"
+        "f2:n 2\n"
+        "sf1 -3\n"
+        "sdef sur=4\n"
+        "nps 10\n"
+    )
+    csv_filepath = tmp_path / "deck.csv"
+    csv_filepath.write_text(CSV_HEADER + 'A,B,Comp1,Water,,1.0,"[1, 2]",,,,,,\n')
+    profiler = pmd.DeckProfiler(
+        pmd.InputData(str(mcnp_input_filepath), str(csv_filepath))
+    )
+    profiler.read_deck()
+
+    assert profiler.get_unused_surfaces() == [5]
+    profiler.remove_unused_surfaces([5])
+    with open(profiler.input_data.pruned_filepath) as infile:
+        pruned = infile.read()
+    assert "4 so 8\n\nf2:n 2\n" in pruned
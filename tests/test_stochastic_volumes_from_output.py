@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+
+import stochastic_volumes_from_output as sv
+from test_mcnp_materials_from_csv import CSV_HEADER
+
+OUTPUT = (
+    "1mcnp     version 6\n"
+    "1cells                                                   print table 60\n"
+    "\n"
+    "              cell      mat   density     density     volume       mass\n"
+    "\n"
+    "        1        1        1  1.00000E-01 1.00000E+00 1.00000E+03 1.00000E+03\n"
+    "        2        2        0  0.00000E+00 0.00000E+00 2.00000E+03 0.00000E+00\n"
+    "        3        3        0  0.00000E+00 0.00000E+00 0.00000E+00 0.00000E+00\n"
+    "           total                                     3.00000E+03 1.00000E+03\n"
+    "1tally        4        nps =     1000\n"
+    " cell  1\n"
+    "                 9.00000E+02 0.0100\n"
+    "1tally       14        nps =     1000\n"
+    " cell  2\n"
+    "                 5.00000E+00 0.0010\n"
+    "1tally        4        nps =     2000\n"
+    "           tally type 4    track length estimate of particle flux.\n"
+    " cell  1\n"
+    "                 9.80000E+02 0.0050\n"
+    " cell  2\n"
+    "      energy\n"
+    "    1.0000E+00   1.00000E+03 0.0100\n"
+    "    2.0000E+01   1.00000E+03 0.0100\n"
+    "      total      2.00000E+03 0.0050\n"
+    " cell  3\n"
+    "                 5.00000E+02 0.0200\n"
+)
+
+
+def get_reader(folder, volumes_from):
+    mcnp_output_filepath = folder / "deck.mcnpo"
+    mcnp_output_filepath.write_text(OUTPUT)
+    csv_filepath = folder / "deck.csv"
+    csv_filepath.write_text(
+        CSV_HEADER
+        + 'A,B,Comp1,Water,,1.0,"[1, 1]",1000,,,,,\n'
+        + 'A,B,Comp2,Water,,1.0,"[2, 3]",,,,,,Kept as it is\n'
+    )
+    return sv.StochasticVolumeReader(
+        sv.InputData(str(mcnp_output_filepath), str(csv_filepath), 1, volumes_from)
+    )
+
+
+def test_the_last_tally_results_are_the_volumes(tmp_path):
+    reader = get_reader(tmp_path, "TALLY")
+    cells = reader.read_output()
+
+    assert cells["CELL"].tolist() == [1, 2, 3]
+    assert cells["VOLUME"].tolist() == [980.0, 2000.0, 500.0]
+    assert cells["ERROR"].tolist() == [0.005, 0.005, 0.02]
+
+    components = reader.get_component_volumes(cells).set_index("Component ID")
+    assert components.loc["Comp2", "STOCHASTIC VOLUME"] == 2500.0
+    assert components.loc["Comp2", "ERROR"] == pytest.approx(
+        (10**2 + 10**2) ** 0.5 / 2500
+    )
+    reader.update_csv(reader.get_component_volumes(cells))
+    csv = pd.read_csv(reader.input_data.csv_filepath, dtype=str, keep_default_na=False)
+    assert csv["STOCHASTIC VOLUME"].tolist() == ["980.0", "2500.0"]
+    assert float(csv["DCF=ORG/STOCH"][0]) == pytest.approx(1000 / 980)
+    assert csv["DCF=ORG/STOCH"][1] == ""  # The original volume is unknown
+    assert csv["COMMENT"][1] == "Kept as it is"
+
+
+def test_components_with_uncalculated_cells_are_not_updated(tmp_path):
+    reader = get_reader(tmp_path, "TABLE")
+    cells = reader.read_output()
+
+    assert cells["VOLUME"].tolist() == [1000.0, 2000.0, 0.0]
+    components = reader.get_component_volumes(cells)
+    assert components["Component ID"].tolist() == ["Comp1"]
+    assert components["DCF=ORG/STOCH"].tolist() == [1.0]
+
+
+def test_the_source_of_the_volumes_is_checked(tmp_path):
+    with pytest.raises(ValueError, match="TALLY or TABLE"):
+        get_reader(tmp_path, "OUTPUT").read_output()